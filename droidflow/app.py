@@ -26,8 +26,9 @@ else:
     _async_mode = 'threading'
 
 from flask import Flask, render_template, jsonify, request, Response
-from flask_socketio import SocketIO, emit  # emit ใช้ push state
+from flask_socketio import SocketIO, emit, join_room  # emit ใช้ push state
 import engine
+from compiler import CompileError
 from utils.core import _adb_cmd  # เพื่อ honor ADB_PATH และ DEVICE_SERIAL
 
 import json
@@ -67,10 +68,10 @@ socketio = SocketIO(app, async_mode=_async_mode,
                     cors_allowed_origins="*")
 
 # ---------- helper : push incremental state ----------
-def push_state(delta: dict):
-    """Emit only the changed pieces to every connected client."""
+def push_state(delta: dict, room: str | None = None):
+    """Emit only the changed pieces to every connected client (or one room)."""
     if delta:
-        socketio.emit("state_delta", delta, namespace="/ui")
+        socketio.emit("state_delta", delta, namespace="/ui", to=room)
 
 # ---------- monkey-patch utils.log ----------
 import utils
@@ -82,6 +83,28 @@ def _broadcasting_log(msg, dest="prog"):
 
 utils.log = _broadcasting_log
 
+# ---------- device add/remove events ----------
+def _broadcast_device(ev: dict):
+    socketio.emit("device", ev, namespace="/ui")
+
+utils.registry.subscribe(_broadcast_device)
+if utils.backend is None:               # adb server only; other backends list their own devices
+    utils.registry.start()
+
+# ---------- flow runs (manager.py) ----------
+engine.runs.subscribe(lambda run: socketio.emit("run", run, namespace="/ui"))
+
+# ---------- hierarchy change feed (tx / payment / fg app) ----------
+def _ui_room(serial: str | None) -> str:
+    return f"dev:{serial or ''}"
+
+utils.watchers.subscribe(lambda ser, delta: push_state(delta, room=_ui_room(ser)))
+_ui_clients: dict[str, str | None] = {}     # socket sid → watched serial
+
+# LEDGER_WATCH=1 → watcher ของ device หลักทำงานตลอด (ledger บันทึกแม้ไม่มีใครเปิด UI)
+if os.getenv("LEDGER_WATCH", "0") == "1":
+    utils.watchers.acquire(os.getenv("DEVICE_SERIAL") or None)
+
 app.sched = engine.sched   # expose scheduler
 term_fd = None
 
@@ -97,14 +120,41 @@ def transactions():
     except RuntimeError as e:
         return jsonify({"error": str(e), "transactions": []}), 503
 
+# —— Transaction ledger (history incl. rows scrolled off screen) ——
+@app.route("/ledger")
+def ledger_route():
+    """
+    Newest-first page of recorded transactions:
+      ?limit=50&before=<id>&serial=&package=
+      → { items: [{ id, name, time, amount, package, serial, first_seen, … }], next: id|null }
+    """
+    before = request.args.get("before")
+    return jsonify(utils.ledger.page(
+        limit=request.args.get("limit", 50, type=int),
+        before=int(before) if before else None,
+        serial=request.args.get("serial") or None,
+        package=request.args.get("package") or None,
+    ))
+
 # —— Stream ——
 @app.route("/stream")
 def stream():
+    # ?rung=N pins a ladder rung (0 = full), default adapts; ?fmt=webp for WebP parts
     return Response(
-        engine.screenshot_stream(),
+        engine.screenshot_stream(request.args.get("rung", type=int), request.args.get("fmt")),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
 
+@app.route("/video")
+def video_page():
+    """H.264 pass-through player (VIDEO_MODE=h264, WebCodecs)."""
+    return render_template("video.html", instance_name=INSTANCE_NAME)
+
+@app.route("/stream/stats")
+def stream_stats():
+    """{seq, clients, sent_frames, sent_bytes, dropped} — the page's bandwidth meter polls this"""
+    return jsonify(engine.stream_stats())
+
 # —— Home & state ——
 @app.route("/")
 def home():
@@ -114,30 +164,10 @@ def home():
 @app.route("/devices")
 def list_devices_route():
     """Return list of ADB-visible serial strings (state=device)."""
-    import re
-    adb_path = os.getenv("ADB_PATH", "adb")
-    host = port = None
-    adb_sock = os.getenv("ADB_SERVER_SOCKET")
-    cmd = [adb_path]
-    if adb_sock and adb_sock.startswith("tcp:"):
-        hostport = adb_sock[4:]
-        if ':' in hostport:
-            host, port = hostport.split(':', 1)
-        if host:
-            cmd += ["-H", host]
-        if port:
-            cmd += ["-P", port]
-    cmd += ["devices"]
     try:
-        out = subprocess.check_output(cmd, text=True, errors="ignore")
+        return jsonify(utils.online_devices())
     except Exception:  # noqa: BLE001
         return jsonify([])
-    devs = []
-    for line in out.splitlines()[1:]:
-        m = re.match(r"^(\S+)\s+device$", line.strip())
-        if m:
-            devs.append(m.group(1))
-    return jsonify(devs)
 
 @app.route("/terminal")
 def terminal_page():
@@ -266,20 +296,93 @@ def load_flow():
 def schedule():
     name = request.args.get("name", "")
     cron = request.args.get("cron", "")
-    engine.schedule_job(name, cron)
+    engine.schedule_job(name, cron, request.args.get("serials", ""))
     return "", 204
 
 # —— Run now & compile+run ——
 @app.route("/run")
 def run_now():
     mode = request.args.get("mode", "hybrid")
-    engine.run_now(mode)
-    return "", 204
+    try:
+        run = engine.run_now(mode)
+    except CompileError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"ok": True, "id": run.id}), 202
+
+@app.route("/run_fanout")
+def run_fanout():
+    """Run a saved flow on ?serials=a,b (default: every online device)."""
+    name = request.args.get("name", "")
+    mode = request.args.get("mode", "hybrid")
+    wait = request.args.get("wait") == "1"
+    res = engine.run_saved_many(name, mode, request.args.get("serials", "all"), wait=wait)
+    return jsonify(res), (200 if wait else 202)
 
 @app.route("/run_compile", methods=["POST"])
 def run_compile():
-    # รอ implement runner.run_compile
-    return "", 204
+    """
+    Compile the posted flow and run it:
+      { actions: [...], mode?: str, pacing?: "all"|"input"|"none" }
+      → 202 { ok, steps, hash } / 400 { ok: false, error } for a malformed flow
+    """
+    body = request.get_json(force=True, silent=True) or {}
+    try:
+        run = engine.run_compile(body.get("actions") or [], body.get("mode", "hybrid"),
+                                 body.get("pacing"))
+    except CompileError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify({"ok": True, "id": run.id, "steps": len(run.prog), "hash": run.prog.hash}), 202
+
+# —— Runs (queued / running / finished flows) ——
+@app.route("/runs", methods=["GET"])
+def runs_list():
+    """?state=queued|running|done|failed|cancelled&serial= → [run, …] newest first"""
+    return jsonify(engine.list_runs(request.args.get("state") or None,
+                                    request.args.get("serial") or None))
+
+@app.route("/runs", methods=["POST"])
+def runs_submit():
+    """
+    Queue a flow: { name?: saved flow, actions?: [...], mode?, serial?, pacing? }
+      → 202 run / 400 malformed flow / 404 unknown saved flow
+    """
+    body = request.get_json(force=True, silent=True) or {}
+    try:
+        run = engine.submit_run(body.get("actions"), body.get("mode", "hybrid"),
+                                body.get("serial") or None, body.get("name", ""),
+                                body.get("pacing"))
+    except FileNotFoundError:
+        return jsonify({"ok": False, "error": "notfound"}), 404
+    except CompileError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    return jsonify(run), 202
+
+@app.route("/runs/slowest")
+def runs_slowest():
+    """?limit=20&serial= → slowest steps across recent runs, with dump/rpc/sleep/wait split"""
+    limit = request.args.get("limit", 20, type=int)
+    return jsonify(engine.slowest_steps(limit, request.args.get("serial") or None))
+
+@app.route("/runs/<rid>")
+def runs_get(rid):
+    """One run including its step trace."""
+    run = engine.get_run(rid)
+    return (jsonify(run), 200) if run else (jsonify({"error": "notfound"}), 404)
+
+@app.route("/runs/<rid>/trace.json")
+def runs_trace(rid):
+    """Step spans of one run as Chrome trace-event JSON (load in chrome://tracing / Perfetto)."""
+    data = engine.run_trace(rid)
+    if data is None:
+        return jsonify({"error": "notfound"}), 404
+    resp = jsonify(data)
+    resp.headers["Content-Disposition"] = f"attachment; filename=run-{rid}.trace.json"
+    return resp
+
+@app.route("/runs/<rid>/cancel", methods=["POST"])
+def runs_cancel(rid):
+    run = engine.cancel_run(rid)
+    return (jsonify(run), 200) if run else (jsonify({"error": "notfound"}), 404)
 
 @app.route("/click_element", methods=["GET"])
 def click_element():
@@ -372,15 +475,60 @@ def ui_connect(auth=None):
       - Conda (no args)
       - Docker + eventlet (passes auth)
     """
-    # ส่ง snapshot แรก (เต็ม) เมื่อต่อสาย
-    pay = engine.get_payment_info()
+    # ส่ง snapshot แรก (เต็ม) เมื่อต่อสาย; tx/payment/fg_app มาจาก watcher
+    # ของ device (ไม่ dump ใหม่ต่อ client)
+    serial = request.args.get("serial") or None
+    _ui_clients[request.sid] = serial
+    join_room(_ui_room(serial))
     emit("state_delta", {
         "prog_init":  engine.prog_log,
         "sched_init": engine.sched_log,
-        "payment":    pay,
-        "actions":    engine.actions
+        "actions":    engine.actions,
+        **utils.watchers.acquire(serial),
     })
 
+@socketio.on("runs", namespace="/ui")
+def ui_runs(data=None):
+    """Ack with the run list ({state?, serial?}); live changes arrive as "run" events."""
+    data = data or {}
+    return engine.list_runs(data.get("state"), data.get("serial"))
+
+@socketio.on("cancel_run", namespace="/ui")
+def ui_cancel_run(data=None):
+    return engine.cancel_run((data or {}).get("id", ""))
+
+@socketio.on("disconnect", namespace="/ui")
+def ui_disconnect(*args):
+    if request.sid in _ui_clients:
+        utils.watchers.release(_ui_clients.pop(request.sid))
+
+# ------ video namespace (H.264 pass-through) ------
+_video_clients: set[str] = set()
+
+def _video_pump(sid: str):
+    """Send one client the current GOP, then every new access unit."""
+    sent = ""
+    for key, au in engine.video_units(lambda: sid in _video_clients):
+        if sid not in _video_clients:
+            break
+        if key and engine.video_codec() != sent:
+            sent = engine.video_codec()
+            socketio.emit("config", {"codec": sent}, to=sid, namespace="/video")
+        socketio.emit("au", {"key": key, "data": au}, to=sid, namespace="/video")
+    else:
+        if sid in _video_clients:     # no server, or its reader died: client falls back to MJPEG
+            error = "H.264 stream ended" if sent else "H.264 stream needs VIDEO_MODE=h264 and scrcpy"
+            socketio.emit("unavailable", {"error": error}, to=sid, namespace="/video")
+
+@socketio.on("connect", namespace="/video")
+def video_connect(auth=None):
+    _video_clients.add(request.sid)
+    socketio.start_background_task(_video_pump, request.sid)
+
+@socketio.on("disconnect", namespace="/video")
+def video_disconnect(*args):
+    _video_clients.discard(request.sid)
+
 
 # @socketio.on("connect", namespace="/ui")
 # # for conda
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for DroidFlow hot paths (no device needed).
+
+    python bench.py elements --rows 2000     # outermost-clickable filter
+    python bench.py parse --rows 1000        # NodeTable vs ElementTree parse
+    python bench.py runner --steps 300       # run_flow overhead per step
+    python bench.py stream --frames 100      # screenshot pipeline FPS / frame fan-out
+    python bench.py routes --n 200           # Flask route latency
+
+runner / stream / routes รันบน replay backend (utils/replay.py) เสมอ;
+`--budget-*` ทำให้ exit 1 เมื่อช้ากว่าที่กำหนด (ใช้จับ regression ใน CI)
+"""
+
+import os
+
+# everything here runs against fake devices; must be set before utils is imported
+os.environ.setdefault("DROIDFLOW_BACKEND", "replay")
+
+import argparse
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from utils.hierarchy import Snapshot, outermost
+from utils.nodetable import CLICKABLE, NodeTable
+
+
+# ───────────── synthetic hierarchies ─────────────
+def synth_hierarchy(rows: int = 1000, seed: int = 0, width: int = 1080) -> str:
+    """uiautomator-style XML: toolbar, a long list of clickable rows each
+    holding clickable buttons (some duplicated), and a bottom nav bar."""
+    rnd = random.Random(seed)
+    row_h = 96
+    height = 240 + rows * row_h + 160
+    out = ['<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0">']
+
+    def node(bounds, clickable, text="", rid="", cls="android.widget.FrameLayout", close=True):
+        l, t, r, b = bounds
+        out.append(
+            f'<node index="0" text="{text}" resource-id="{rid}" class="{cls}" '
+            f'package="com.example" content-desc="" checkable="false" checked="false" '
+            f'clickable="{"true" if clickable else "false"}" enabled="true" focusable="false" '
+            f'focused="false" scrollable="false" long-clickable="false" password="false" '
+            f'selected="false" bounds="[{l},{t}][{r},{b}]"' + ("/>" if close else ">"))
+
+    node((0, 0, width, height), False, close=False)
+    node((0, 0, width, 240), False, rid="com.example:id/toolbar", close=False)
+    node((24, 60, 144, 180), True, rid="com.example:id/back")
+    node((width - 144, 60, width - 24, 180), True, rid="com.example:id/menu")
+    out.append("</node>")
+    node((0, 240, width, 240 + rows * row_h), False, rid="com.example:id/list", close=False)
+    for i in range(rows):
+        top = 240 + i * row_h
+        node((0, top, width, top + row_h), True, rid="com.example:id/row", close=False)
+        node((24, top + 8, 600, top + 56), False, text=f"row {i}", cls="android.widget.TextView")
+        node((width - 200, top + 16, width - 24, top + 80), True, rid="com.example:id/btn")
+        if rnd.random() < 0.05:   # duplicated overlay → both copies drop out
+            node((width - 200, top + 16, width - 24, top + 80), True, rid="com.example:id/btn")
+        out.append("</node>")
+    out.append("</node>")
+    node((0, height - 160, width, height), False, rid="com.example:id/nav", close=False)
+    for k in range(4):
+        w = width // 4
+        node((k * w, height - 160, (k + 1) * w, height), True, rid=f"com.example:id/tab{k}")
+    out.append("</node></node></hierarchy>")
+    return "".join(out)
+
+
+def _clickable_rects(xml: str) -> list[list[int]]:
+    t = Snapshot(None, xml, 0.0, 0).table
+    return [list(t.rect(i)) for i in t.where(CLICKABLE) if t.rect(i)]
+
+
+def _outermost_naive(raw: list[list[int]]) -> list[int]:
+    """The original pairwise filter from get_elements()."""
+    def inside(a, b):
+        return a[0] >= b[0] and a[1] >= b[1] and a[2] <= b[2] and a[3] <= b[3]
+    return [i for i, b1 in enumerate(raw)
+            if not any(i != j and inside(b1, b2) for j, b2 in enumerate(raw))]
+
+
+def _timeit(fn, *args, repeat: int = 3) -> tuple[float, object]:
+    best, res = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        res = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, res
+
+
+# ───────────── benchmarks ─────────────
+def bench_elements(args) -> int:
+    print(f"{'rows':>6} {'clickable':>9} {'naive ms':>10} {'sweep ms':>10} {'speedup':>8}")
+    for rows in args.rows:
+        raw = _clickable_rects(synth_hierarchy(rows, seed=rows))
+        t_naive, ref = _timeit(_outermost_naive, raw, repeat=1 if rows > 1000 else 3)
+        t_new, got = _timeit(outermost, raw)
+        if got != ref:
+            print(f"MISMATCH at rows={rows}", file=sys.stderr)
+            return 1
+        print(f"{rows:>6} {len(raw):>9} {t_naive * 1e3:>10.1f} {t_new * 1e3:>10.2f} "
+              f"{t_naive / max(t_new, 1e-9):>7.0f}x")
+
+    # randomized equivalence check on small, heavily nested/overlapping sets
+    rnd = random.Random(1)
+    for _ in range(args.fuzz):
+        raw = []
+        for _ in range(rnd.randint(0, 40)):
+            l, t = rnd.randint(0, 50), rnd.randint(0, 50)
+            raw.append([l, t, l + rnd.randint(0, 50), t + rnd.randint(0, 50)])
+        raw += rnd.sample(raw, k=min(len(raw), 3))
+        if outermost(raw) != _outermost_naive(raw):
+            print(f"MISMATCH on {raw}", file=sys.stderr)
+            return 1
+    print(f"fuzz: {args.fuzz} random sets identical")
+    return 0
+
+
+def _parse_etree(xml: str):
+    """The previous snapshot pipeline: ElementTree + regex bounds + parent map."""
+    root = ET.fromstring(xml)
+    parent = {c: p for p in root.iter("node") for c in p}
+    bounds = [list(map(int, re.findall(r"\d+", n.get("bounds") or ""))) for n in root.iter("node")]
+    return root, parent, bounds
+
+
+def _peak_kib(fn, *args) -> tuple[float, object]:
+    """Memory still held by fn's result (KiB) — what a cached snapshot costs."""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    res = fn(*args)
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return held / 1024, res
+
+
+def bench_parse(args) -> int:
+    print(f"{'rows':>6} {'nodes':>6} {'etree ms':>9} {'table ms':>9} {'etree KiB':>10} {'table KiB':>10}")
+    for rows in args.rows:
+        xml = synth_hierarchy(rows, seed=rows)
+        t_et, (root, _, _) = _timeit(_parse_etree, xml, repeat=5)
+        t_nt, table = _timeit(NodeTable.parse, xml, repeat=5)
+        nodes = sum(1 for _ in root.iter("node"))
+        if nodes != len(table) or _clickable_rects(xml) != [
+                b for n, b in zip(root.iter("node"), _parse_etree(xml)[2])
+                if n.get("clickable") == "true" and len(b) == 4]:
+            print(f"MISMATCH at rows={rows}", file=sys.stderr)
+            return 1
+        m_et, _ = _peak_kib(_parse_etree, xml)
+        m_nt, _ = _peak_kib(NodeTable.parse, xml)
+        print(f"{rows:>6} {nodes:>6} {t_et * 1e3:>9.1f} {t_nt * 1e3:>9.1f} {m_et:>10.0f} {m_nt:>10.0f}")
+    return 0
+
+
+# ───────────── replay-backed benchmarks ─────────────
+def _replay(rows: int, png: bytes | None = None):
+    """The replay backend, serving one synthetic screen of *rows* list rows."""
+    import utils
+    from utils.replay import ReplayBackend, Screen
+    if not isinstance(utils.backend, ReplayBackend):
+        raise SystemExit("DROIDFLOW_BACKEND must be replay for this benchmark")
+    utils.backend.set_screens([Screen("synth", synth_hierarchy(rows, seed=rows), png)])
+    utils.hierarchy_cache.invalidate()
+    return utils.backend
+
+
+def _pct(xs: list[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+def _budget(name: str, value: float, budget: float | None) -> int:
+    if budget is not None and value > budget:
+        print(f"OVER BUDGET: {name} {value:.2f} > {budget:.2f}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def bench_runner(args) -> int:
+    import runner
+    dev = _replay(args.rows).device(None)
+    cycle = [
+        {"op": "click", "rid": "com.example:id/back"},                # selector → dump + match
+        {"op": "click", "bounds": "[24,60][144,180]", "verify": args.verify},
+        {"op": "key", "key": "back"},
+        {"op": "swipe", "dir": "up"},
+        {"op": "wait", "sec": 0},
+    ]
+    acts = [cycle[i % len(cycle)] for i in range(args.steps)]
+    runner.run_flow(acts[:len(cycle)], "hybrid", pacing="none")       # warm-up (compile, pools)
+    best, trace = float("inf"), []
+    for _ in range(args.repeat):
+        dev.inputs.clear()
+        t0 = time.perf_counter()
+        trace = runner.run_flow(acts, "hybrid", pacing="none")
+        best = min(best, time.perf_counter() - t0)
+    per_step = best / len(acts) * 1e3
+    print(f"steps={len(acts)} rows={args.rows} total={best * 1e3:.1f} ms "
+          f"per-step={per_step:.3f} ms inputs={len(dev.inputs)}")
+    print(f"{'op':>8} {'n':>5} {'mean ms':>8} {'dump ms':>8} {'rpc ms':>8}")
+    for op in dict.fromkeys(e["op"] for e in trace):
+        es = [e for e in trace if e["op"] == op]
+        mean = lambda k: sum(e.get(k, 0) for e in es) / len(es) * 1e3
+        print(f"{op:>8} {len(es):>5} {mean('sec'):>8.3f} {mean('dump'):>8.3f} {mean('rpc'):>8.3f}")
+    return _budget("per-step ms", per_step, args.budget_ms)
+
+
+def bench_stream(args) -> int:
+    import io
+    from PIL import Image
+    import utils
+    from utils import screenshot
+    w, h = map(int, args.size.split("x"))
+    buf = io.BytesIO()           # noisy frame: PNG encode/decode cost close to a real screen
+    Image.merge("RGB", [Image.effect_noise((w, h), 40 + 20 * i) for i in range(3)]).save(buf, "PNG")
+    _replay(args.rows, buf.getvalue())
+    if args.width:
+        screenshot._TARGET_W = args.width
+    ss = utils.get_streamer()
+    paths = {"png": lambda: ss._process(ss._grab_png()),
+             "raw": lambda: (ss._grab_raw(), ss._process_raw())[1]}
+    fps = 0.0
+    for mode in (paths if args.capture == "both" else [args.capture]):
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            for _ in range(args.frames):
+                jpg = paths[mode]()
+            best = min(best, time.perf_counter() - t0)
+        fps = args.frames / best
+        out = Image.open(io.BytesIO(jpg)).size
+        print(f"{mode:>4} capture+encode {fps:6.1f} fps ({best / args.frames * 1e3:.1f} ms/frame) "
+              f"{w}x{h} → {out[0]}x{out[1]}, {len(jpg) / 1024:.0f} KiB")
+    # fan-out: changed frames published at --rate Hz, --clients readers (one slow)
+    from utils.broadcast import FrameBroadcaster
+    bc, frame = FrameBroadcaster(), ss._process(ss._grab_png())
+    got = [0] * args.clients
+    def client(i):
+        for seq, jpg in bc.frames():
+            bc.sent(len(jpg))
+            got[i] += 1
+            if i == 0:
+                time.sleep(0.1)                          # slow consumer
+            if seq >= args.frames:
+                return
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    t0 = time.perf_counter()
+    for _ in range(args.frames):
+        bc.publish(frame)
+        time.sleep(1 / args.rate)
+    for t in threads:
+        t.join(5)
+    wall = time.perf_counter() - t0
+    st = bc.stats()
+    print(f"broadcast {args.frames} frames @ {args.rate:.0f} Hz → {args.clients} clients in {wall:.2f} s: "
+          f"sent {st['sent_frames']} ({st['sent_bytes'] / wall / 1024:.0f} KiB/s), "
+          f"slow client {got[0]}, dropped {st['dropped']}")
+    return _budget("1/fps", 1 / fps, None if args.min_fps is None else 1 / args.min_fps)
+
+
+def bench_routes(args) -> int:
+    _replay(args.rows)
+    import app
+    client = app.app.test_client()
+    fail = 0
+    print(f"{'route':<28} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for url in args.urls:
+        client.get(url)                                   # warm-up (first dump, imports)
+        times = []
+        for _ in range(args.n):
+            t0 = time.perf_counter()
+            status = client.get(url).status_code
+            times.append((time.perf_counter() - t0) * 1e3)
+            if status >= 500:
+                print(f"{url}: HTTP {status}", file=sys.stderr)
+                return 1
+        p95 = _pct(times, 0.95)
+        print(f"{url:<28} {_pct(times, 0.5):>8.2f} {p95:>8.2f} {max(times):>8.2f}")
+        fail |= _budget(f"{url} p95 ms", p95, args.budget_ms)
+    return fail
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("elements", help="outermost clickable filter (get_elements)")
+    p.add_argument("--rows", type=int, nargs="+", default=[100, 500, 1000, 2000])
+    p.add_argument("--fuzz", type=int, default=2000)
+    p.set_defaults(fn=bench_elements)
+
+    p = sub.add_parser("parse", help="hierarchy parse: NodeTable vs ElementTree")
+    p.add_argument("--rows", type=int, nargs="+", default=[100, 500, 1000, 2000])
+    p.set_defaults(fn=bench_parse)
+
+    p = sub.add_parser("runner", help="run_flow overhead per step (replay backend)")
+    p.add_argument("--steps", type=int, default=300)
+    p.add_argument("--rows", type=int, default=200, help="list rows in the replayed screen")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--verify", default="off", help="post-click policy of the bounds clicks")
+    p.add_argument("--budget-ms", type=float, help="fail when per-step overhead exceeds this")
+    p.set_defaults(fn=bench_runner)
+
+    p = sub.add_parser("stream", help="screenshot capture/encode and MJPEG FPS (replay backend)")
+    p.add_argument("--frames", type=int, default=50)
+    p.add_argument("--rows", type=int, default=20)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--capture", choices=("png", "raw", "both"), default="both",
+                   help="SS_CAPTURE path(s) to time; --min-fps applies to the last")
+    p.add_argument("--size", default="1080x1920", help="replayed screen size")
+    p.add_argument("--width", type=int, default=540, help="target width (SS_WIDTH)")
+    p.add_argument("--clients", type=int, default=4, help="broadcast readers (the first one is slow)")
+    p.add_argument("--rate", type=float, default=20, help="broadcast publish rate (Hz)")
+    p.add_argument("--min-fps", type=float, help="fail below this capture+encode rate")
+    p.set_defaults(fn=bench_stream)
+
+    p = sub.add_parser("routes", help="Flask route latency (replay backend)")
+    p.add_argument("--n", type=int, default=200)
+    p.add_argument("--rows", type=int, default=200)
+    p.add_argument("--urls", nargs="+", default=[
+        "/elements", "/current_app", "/inspect?x=0.5&y=0.5", "/screen_size",
+        "/devices", "/runs", "/transactions"])
+    p.add_argument("--budget-ms", type=float, help="fail when a route's p95 exceeds this")
+    p.set_defaults(fn=bench_routes)
+
+    args = ap.parse_args(argv)
+    return args.fn(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Flow compiler: JSON steps → pre-resolved instruction array.
+
+เดิม runner ตีความ dict ทีละ step (if/elif ยาวบน op, `a.get(...)`, สร้าง
+labels ใหม่ทุกรอบ, regex `bounds` ตอนรัน)  compile ครั้งเดียวต่อ flow:
+  • ตรวจ op / ค่าที่ต้องมี / loop, if ที่ไม่ครบคู่ / goto ไป label ที่ไม่มี
+    → CompileError พร้อมเลข step
+  • label หายไป, goto / loop_end / if_start / else ได้ index ปลายทางตรง ๆ
+  • bounds เป็น (l, t, r, b) แล้ว, selector compile แล้ว (utils.selector)
+  • ผลถูก cache ตาม hash ของเนื้อหา flow (FLOW_CACHE_SIZE ตัวล่าสุด)
+runner.py รัน `Program.code` ผ่าน dispatch table ของ handler ต่อ op
+
+if_start: `{"op": "if_start", "rid"|"text"|"desc"|"xpath"|"sel": …, "not": bool}`
+เงื่อนไข = element นั้นอยู่บนจอ; เท็จ → ข้ามไปหลัง `else` / `if_end` ที่คู่กัน
+`{"op": "if_start"}` เปล่า (flow เก่า ก่อนมีเงื่อนไข) = จริงเสมอ และไม่ต้องมี if_end
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from utils import compile_selector, parse_bounds
+
+# ───────────── config ─────────────
+FLOW_CACHE_SIZE = int(os.getenv("FLOW_CACHE_SIZE", "64"))   # compiled flows kept in memory
+
+OPS = ("wait", "click", "key", "type", "swipe", "wait_el", "wait_text", "assert",
+       "loop_start", "loop_end", "if_start", "else", "goto")
+VERIFY_POLICIES = ("log", "retry", "abort", "off")
+# ops that only shape control flow / come from the recorder and emit no instruction
+# (open_app … hover: recorder blocks that the runner has always skipped)
+_NOOPS = ("label", "rec", "if_end", "note",
+          "open_app", "close_app", "restart_app", "refresh", "hover")
+_SEL_KEYS = ("rid", "text", "desc")
+
+
+class CompileError(ValueError):
+    """The flow is malformed (message names the offending step)."""
+
+
+class Click:
+    """Pre-resolved click target: selector, parsed bounds, raw x/y."""
+
+    __slots__ = ("sel", "rect", "bounds", "xy", "verify")
+
+    def __init__(self, a: dict):
+        sel = compile_selector(a)
+        self.sel = sel if sel else None
+        self.bounds = a.get("bounds") or ""
+        self.rect = parse_bounds(self.bounds)
+        self.xy = (float(a["x"]), float(a["y"])) if "x" in a and "y" in a else None
+        self.verify = a.get("verify") or None      # per-step post-click policy override
+        if self.verify not in (None, *VERIFY_POLICIES):
+            raise ValueError(f"unknown verify policy {self.verify!r}")
+
+
+class Instr:
+    __slots__ = ("op", "arg", "jump", "step")
+
+    def __init__(self, op: str, arg=None, jump: int | None = None, step: int = 0):
+        self.op = op
+        self.arg = arg            # pre-resolved operand (see _operand)
+        self.jump = jump          # target instruction index (goto/loop/if/else)
+        self.step = step          # index in the source flow, for messages
+
+    def __repr__(self):
+        return f"Instr({self.op!r}, {self.arg!r}, jump={self.jump}, step={self.step})"
+
+
+class Program:
+    """A compiled flow; `code` is what runner.execute() walks."""
+
+    __slots__ = ("code", "hash", "labels")
+
+    def __init__(self, code: list[Instr], digest: str, labels: dict):
+        self.code = code
+        self.hash = digest
+        self.labels = labels      # label → instruction index
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+
+# ───────────── operands ─────────────
+def _float(a: dict, key: str, default: float, i: int) -> float:
+    try:
+        return float(a.get(key, default))
+    except (TypeError, ValueError):
+        raise CompileError(f"step {i}: {a.get('op')} needs a number in {key!r}, got {a.get(key)!r}")
+
+
+def _condition(a: dict, i: int):
+    spec = dict(a.get("sel") or {}, **{k: a[k] for k in (*_SEL_KEYS, "xpath", "bounds") if a.get(k)})
+    if not spec:
+        return None               # legacy bare if_start: always true
+    try:
+        sel = compile_selector(spec)
+    except ValueError as e:
+        raise CompileError(f"step {i}: {e}") from e
+    if not sel:
+        raise CompileError(f"step {i}: if_start needs rid/text/desc/xpath/sel")
+    return sel, bool(a.get("not"))
+
+
+def _operand(op: str, a: dict, i: int):
+    if op == "wait":
+        return _float(a, "sec", 0, i), bool(a.get("idle"))
+    if op == "click":
+        try:
+            c = Click(a)
+        except (TypeError, ValueError) as e:
+            raise CompileError(f"step {i}: click {e}") from e
+        if c.sel is None and c.rect is None and c.xy is None:
+            raise CompileError(f"step {i}: click has no selector/bounds/x,y")
+        return c
+    if op == "key":
+        if not a.get("key"):
+            raise CompileError(f"step {i}: key needs 'key'")
+        return a["key"]
+    if op == "type":
+        return a.get("text", "")
+    if op == "swipe":
+        return a.get("dir", "left")
+    if op == "wait_el":
+        sel = {k: a.get(k) for k in _SEL_KEYS if a.get(k)}
+        if not sel:
+            raise CompileError(f"step {i}: wait_el needs rid/text/desc")
+        return sel, _float(a, "timeout", 10, i)
+    if op == "wait_text":
+        return a.get("text", ""), _float(a, "timeout", 10, i)
+    if op == "assert":
+        sel = compile_selector({**(a.get("sel") or {}), "bounds": a.get("bounds") or ""}, tol=15)
+        return (sel if sel else None), a.get("sel")
+    if op == "loop_start":
+        return int(_float(a, "val", 1, i))
+    return None
+
+
+# ───────────── compile ─────────────
+def _digest(acts: list[dict]) -> str:
+    raw = json.dumps(acts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _compile(acts: list[dict], digest: str) -> Program:
+    code: list[Instr] = []
+    labels: dict = {}
+    gotos: list[tuple[Instr, object]] = []
+    loops: list[tuple[int, Instr]] = []  # open loop_start (index, instr)
+    ifs: list[tuple[Instr, bool]] = []   # open if_start (or its else once seen), bare?
+    for i, a in enumerate(acts):
+        if not isinstance(a, dict):
+            raise CompileError(f"step {i}: not an object")
+        op = a.get("op")
+        if op == "label":
+            if a.get("val") in labels:
+                raise CompileError(f"step {i}: duplicate label {a.get('val')!r}")
+            labels[a.get("val")] = len(code)
+            continue
+        if op == "if_end":
+            if not ifs:
+                raise CompileError(f"step {i}: if_end without if_start")
+            ifs.pop()[0].jump = len(code)
+            continue
+        if op in _NOOPS:
+            continue
+        if op not in OPS:
+            raise CompileError(f"step {i}: unknown op {op!r}")
+
+        ins = Instr(op, step=i)
+        if op == "if_start":
+            ins.arg = _condition(a, i)
+            ifs.append((ins, ins.arg is None))
+        elif op == "else":
+            if not ifs or ifs[-1][0].op == "else":
+                raise CompileError(f"step {i}: else without if_start")
+            ifs[-1][0].jump = len(code) + 1          # false branch starts after else
+            ifs[-1] = (ins, ifs[-1][1])              # if_end patches the else jump
+        elif op == "loop_start":
+            ins.arg = _operand(op, a, i)
+            loops.append((len(code), ins))
+        elif op == "loop_end":
+            if not loops:
+                raise CompileError(f"step {i}: loop_end without loop_start")
+            ins.jump = loops.pop()[0] + 1
+        elif op == "goto":
+            gotos.append((ins, a.get("val")))
+        else:
+            ins.arg = _operand(op, a, i)
+        code.append(ins)
+
+    if loops:
+        raise CompileError(f"step {loops[-1][1].step}: loop_start without loop_end")
+    for ins, bare in ifs:
+        if not bare:
+            raise CompileError(f"step {ins.step}: if_start without if_end")
+        ins.jump = len(code)                     # legacy bare if: runs to the end
+    for ins, label in gotos:
+        if label not in labels:
+            raise CompileError(f"step {ins.step}: goto unknown label {label!r}")
+        ins.jump = labels[label]
+    return Program(code, digest, labels)
+
+
+_cache: "OrderedDict[str, Program]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def compile_flow(acts: list[dict]) -> Program:
+    """Validate and compile *acts*; identical flows share one cached Program."""
+    if isinstance(acts, Program):
+        return acts
+    digest = _digest(acts)
+    with _cache_lock:
+        prog = _cache.get(digest)
+        if prog is not None:
+            _cache.move_to_end(digest)
+            return prog
+    prog = _compile(list(acts), digest)
+    with _cache_lock:
+        _cache[digest] = prog
+        while len(_cache) > FLOW_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return prog
@@ -2,16 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import os
-import threading
 import re
 import subprocess
 from apscheduler.schedulers.background import BackgroundScheduler
 
 import os
 import utils
-from utils import connect
+from utils import connect, trace
 from utils.core import _adb_cmd
 import runner
+from compiler import CompileError, compile_flow
+from manager import runs
 
 # Try an initial connect but don't crash if device not ready yet.
 try:
@@ -53,8 +54,18 @@ sched_log = utils.sched_log
 
 # def screenshot_b64() -> str:
 #     return utils.screenshot_b64()
-def screenshot_stream():
-    return utils.screenshot_stream()
+def screenshot_stream(rung: int | None = None, fmt: str | None = None):
+    return utils.screenshot_stream(rung, fmt)
+
+def stream_stats() -> dict:
+    return utils.stream_stats()
+
+def video_units(alive=lambda: True):
+    """H.264 access units for one /video client (VIDEO_MODE=h264)."""
+    return utils.video_units(alive)
+
+def video_codec() -> str:
+    return utils.video_codec()
 
 def screenshot_b64() -> str:
     return utils.screenshot_b64()
@@ -118,9 +129,10 @@ def get_payment_info() -> dict:
 
 # ──────── scheduler helpers ────────
 
-def schedule_job(name: str, cron: str):
+def schedule_job(name: str, cron: str, serials: str = ""):
     """
     Schedule a saved flow by cron expression (min hour dom mon dow).
+    ``serials`` ("a,b" or "all") fans the job out to several devices.
     """
     if not (name and cron):
         return
@@ -130,7 +142,7 @@ def schedule_job(name: str, cron: str):
 
     m, h, dom, mo, dow = (cron.split() + ["*"]*5)[:5]
     sched.add_job(
-        run_saved,
+        run_saved_many if serials else run_saved,
         "cron",
         id=name,
         minute=m,
@@ -138,9 +150,9 @@ def schedule_job(name: str, cron: str):
         day=dom,
         month=mo,
         day_of_week=dow,
-        args=[name, "hybrid"]
+        args=[name, "hybrid", serials] if serials else [name, "hybrid"]
     )
-    utils.log(f"add job {name} {cron}", dest="sched")
+    utils.log(f"add job {name} {cron}" + (f" on {serials}" if serials else ""), dest="sched")
 
 
 def run_saved(name: str, mode: str):
@@ -156,27 +168,106 @@ def run_saved(name: str, mode: str):
         utils.log(f"load {name} fail {e}", dest="sched")
         return
 
-    utils.log(f"job {name} start", dest="sched")
-    threading.Thread(
-        target=runner.run_flow,
-        args=(acts, mode),
-        daemon=True
-    ).start()
+    if utils.registry.live and not utils.registry.online():
+        utils.log(f"job {name} skip: no device online", dest="sched")
+        return
+
+    try:
+        run = runs.submit(acts, mode, name=name)
+    except CompileError as e:
+        utils.log(f"job {name} compile fail {e}", dest="sched")
+        return
+    utils.log(f"job {name} queued as {run.id}", dest="sched")
+
+def _resolve_serials(serials) -> list[str]:
+    """"a,b" / list → serials; "all" or empty → every online device."""
+    if isinstance(serials, str):
+        serials = [s.strip() for s in serials.split(",") if s.strip()]
+    if not serials or serials == ["all"]:
+        return utils.online_devices()
+    return list(serials)
+
+
+def run_saved_many(name: str, mode: str, serials="all", wait: bool = False):
+    """
+    Load a saved flow and run it on several devices at once.
+    With ``wait=True`` block and return per-device results.  A flow that
+    does not load or compile is logged and returns ``{}`` either way.
+    """
+    try:
+        result = load_flow(name)
+        if not result.get("ok"):
+            raise FileNotFoundError(name)
+        acts = result["actions"]
+    except Exception as e:
+        utils.log(f"load {name} fail {e}", dest="sched")
+        return {}
+
+    targets = _resolve_serials(serials)
+    if not targets:
+        utils.log(f"job {name} skip: no device online", dest="sched")
+        return {}
+    try:
+        prog = compile_flow(acts)      # once, so both paths report a bad flow alike
+    except CompileError as e:
+        utils.log(f"job {name} compile fail {e}", dest="sched")
+        return {}
+    utils.log(f"job {name} start on {','.join(targets)}", dest="sched")
+    if wait:
+        return runner.run_flow_many(prog, mode, targets)
+    started = runner.run_fanout(prog, mode, targets)
+    return {ser: run.id for ser, run in started.items()}
 
 # ──────── run-now / compile+run ────────
 
 def run_now(mode: str = "hybrid"):
     """
-    Run the current recorded actions immediately.
+    Queue the current recorded actions; returns the Run.
     """
-    runner.run_now(mode)
+    return runner.run_now(mode)
 
 
-def run_compile(acts_list, mode: str = "hybrid"):
+def run_compile(acts_list, mode: str = "hybrid", pacing: str | None = None):
     """
-    Run a provided list of actions (e.g. compiled flow).
+    Compile a provided list of actions and queue it.
+    Raises compiler.CompileError for a malformed flow; returns the Run.
     """
-    runner.run_compile(acts_list, mode)
+    return runner.run_compile(acts_list, mode, pacing)
+
+# ──────── run manager ────────
+
+def list_runs(state: str | None = None, serial: str | None = None) -> list[dict]:
+    return runs.list(state, serial)
+
+def get_run(rid: str) -> dict | None:
+    run = runs.get(rid)
+    return run.as_dict(trace=True) if run else None
+
+def run_trace(rid: str) -> dict | None:
+    """Chrome trace-event JSON of one run (chrome://tracing, Perfetto)."""
+    run = runs.get(rid)
+    return trace.chrome([run.as_dict(trace=True)]) if run else None
+
+def slowest_steps(limit: int = 20, serial: str | None = None) -> list[dict]:
+    """Longest steps across the runs still kept in history (RUN_HISTORY)."""
+    return trace.slowest(runs.list(serial=serial, trace=True), limit)
+
+def cancel_run(rid: str) -> dict | None:
+    run = runs.cancel(rid)
+    return run.as_dict() if run else None
+
+def submit_run(acts, mode: str = "hybrid", serial: str | None = None,
+               name: str = "", pacing: str | None = None) -> dict:
+    """
+    Queue *acts* (or the saved flow *name* when acts is None).
+    Raises FileNotFoundError / compiler.CompileError.
+    """
+    if acts is None:
+        result = load_flow(name)
+        if not result.get("ok"):
+            raise FileNotFoundError(name)
+        acts = result["actions"]
+    return runs.submit(acts, mode, serial, name, pacing).as_dict()
 
 # ──────── core APIs ────────
 
@@ -205,42 +296,26 @@ def restart_app(pkg: str, mode: str = "safe") -> tuple[bool, str]:
 # ──────── click_by_selector ────────
 
 def click_by_selector(sel: dict) -> bool:
-    import utils, re, subprocess
+    """Tap the node matching *all* of sel's rid/text/desc (one dump + one tap)."""
     d = connect()
     utils.log(f"🔍 click_by_selector sel={sel}")
-    # prepare selector args...
-    args = {}
-    if sel.get("rid"):  args["resourceId"] = sel["rid"]
-    if sel.get("text"): args["text"]       = sel["text"]
-    if sel.get("desc"): args["description"]= sel["desc"]
+    matcher = utils.compile_selector(
+        {k: sel[k] for k in ("rid", "text", "desc") if sel.get(k)}, mode="all")
+    if not matcher:
+        return False
 
     try:
-        el = d(**args)
-        utils.log(f"   element.exists={el.exists}")
-        if not el.exists:
+        t = utils.snapshot(getattr(d, "serial", None)).table
+        n = matcher.find(t)
+        utils.log(f"   element.exists={n is not None}")
+        rect = t.rect(n) if n is not None else None
+        if not rect:
             return False
 
-        info_bounds = el.info.get("bounds", "")
-        # ถ้าเป็น dict ให้อ่านค่าจาก key 'left','top','right','bottom'
-        if isinstance(info_bounds, dict):
-            l = info_bounds.get("left",0)
-            t = info_bounds.get("top",0)
-            r = info_bounds.get("right",0)
-            btm = info_bounds.get("bottom",0)
-        else:
-            # เก่ายังรองรับ string
-            nums = re.findall(r"\d+", info_bounds)
-            if len(nums) != 4:
-                el.click()
-                return True
-            l, t, r, btm = map(int, nums)
-
-        cx, cy = (l + r)//2, (t + btm)//2
+        l, top, r, btm = rect
+        cx, cy = (l + r)//2, (top + btm)//2
         utils.log(f"   tapping at ({cx},{cy})")
-        subprocess.run(
-          _adb_cmd(["shell", "input", "tap", str(cx), str(cy)]),
-          check=False
-        )
+        utils.input_channel(getattr(d, "serial", None)).tap(cx, cy)
         return True
 
     except Exception as e:
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run manager: every flow run goes through one bounded executor.
+
+เดิม run_now / run_compile / run_saved แต่ละตัวเปิด daemon thread ใหม่เอง
+ไม่มีขีดจำกัด ไม่มี handle หยุดไม่ได้ และ cron สองตัวชนกันก็ขับ device
+เดียวกันพร้อมกัน  ที่นี่:
+  • run ทุกตัวมี id และสถานะ queued → running → done / failed / cancelled
+  • คิวต่อ device: device หนึ่งรันทีละ flow ตามลำดับที่ส่งเข้ามา
+    executor (RUN_WORKERS) รับเฉพาะ run ที่ device ว่างแล้ว จึงไม่มี worker
+    ค้างรอ lock
+  • cancel: run ที่ยังรอคิวถูกถอดออกทันที, run ที่กำลังรันหยุดก่อน step ถัดไป
+  • listener (`subscribe`) ได้ run dict ทุกครั้งที่สถานะเปลี่ยน → socket.io
+"""
+
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from compiler import compile_flow
+from runner import RunCancelled, run_flow
+from utils import log
+from utils.core import _default_serial
+
+# ───────────── config ─────────────
+# FANOUT_WORKERS (ชื่อเดิมของ "max devices driven at once" จาก fan-out pool) ยังใช้ได้
+# เป็นค่า default ของ RUN_WORKERS เพราะ fan-out วิ่งผ่าน manager นี้แล้ว
+RUN_WORKERS = int(os.getenv("RUN_WORKERS", os.getenv("FANOUT_WORKERS", "8")))   # flows running at once (all devices)
+RUN_HISTORY = int(os.getenv("RUN_HISTORY", "200"))   # finished runs kept for /runs
+
+STATES = ("queued", "running", "done", "failed", "cancelled")
+_FINAL = ("done", "failed", "cancelled")
+
+
+class Run:
+    """One submitted flow run."""
+
+    def __init__(self, rid: str, prog, mode: str, serial: str | None, name: str,
+                 pacing: str | None):
+        self.id = rid
+        self.prog = prog
+        self.mode = mode
+        self.serial = serial
+        self.key = serial or ""         # device queue; fixed for the run's lifetime
+        self.name = name
+        self.pacing = pacing
+        self.state = "queued"
+        self.error = ""
+        self.created = time.time()
+        self.started: float | None = None
+        self.ended: float | None = None
+        self.trace: list[dict] = []
+        self.cancel = threading.Event()
+        self.finished = threading.Event()
+
+    def as_dict(self, trace: bool = False) -> dict:
+        d = {
+            "id": self.id, "name": self.name, "serial": self.serial, "mode": self.mode,
+            "state": self.state, "error": self.error, "created": self.created,
+            "started": self.started, "ended": self.ended,
+            "step": len(self.trace), "steps": len(self.prog), "hash": self.prog.hash,
+        }
+        if trace:
+            d["trace"] = list(self.trace)
+        return d
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.finished.wait(timeout)
+
+
+class RunManager:
+    """Bounded executor with one FIFO queue per device."""
+
+    def __init__(self, workers: int = RUN_WORKERS, history: int = RUN_HISTORY):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="run")
+        self._history = history
+        self._lock = threading.Lock()
+        self._runs: "OrderedDict[str, Run]" = OrderedDict()
+        self._queues: dict[str, deque] = {}     # device → runs waiting for it
+        self._busy: set[str] = set()            # devices with a run in the executor
+        self._ids = itertools.count(1)
+        self._listeners: list[Callable[[dict], None]] = []
+
+    def subscribe(self, fn: Callable[[dict], None]):
+        """Call ``fn(run dict)`` on every state change."""
+        self._listeners.append(fn)
+
+    def _publish(self, run: Run):
+        d = run.as_dict()
+        for fn in list(self._listeners):
+            try:
+                fn(d)
+            except Exception:
+                pass
+
+    # ───────────── submit / dispatch ─────────────
+    def submit(self, acts, mode: str = "hybrid", serial: str | None = None,
+               name: str = "", pacing: str | None = None) -> Run:
+        """Queue a flow (steps or Program) for *serial*; raises CompileError up front.
+
+        ``serial=None`` is resolved to the default device here, once, so the
+        run queues (and drives) the same device as an explicit run for it,
+        even if DEVICE_SERIAL is rewritten while it waits.
+        """
+        prog = compile_flow(acts)
+        serial = serial or _default_serial() or None
+        with self._lock:
+            run = Run(f"r{next(self._ids)}", prog, mode, serial, name, pacing)
+            self._runs[run.id] = run
+            self._queues.setdefault(run.key, deque()).append(run)
+            self._trim()
+            self._dispatch(run.key)
+        self._publish(run)
+        return run
+
+    def _dispatch(self, key: str):
+        # caller holds self._lock
+        q = self._queues.get(key)
+        if key in self._busy or not q:
+            return
+        run = q.popleft()
+        if not q:
+            del self._queues[key]
+        self._busy.add(key)
+        self._pool.submit(self._execute, run)
+
+    def _execute(self, run: Run):
+        try:
+            if run.cancel.is_set():
+                raise RunCancelled()
+            run.state, run.started = "running", time.time()
+            self._publish(run)
+            run_flow(run.prog, run.mode, run.serial, run.pacing, run.cancel, run.trace)
+            run.state = "done"
+        except RunCancelled:
+            run.state = "cancelled"
+        except Exception as e:
+            run.state, run.error = "failed", str(e)
+            tag = f"[{run.serial}] " if run.serial else ""
+            log(f"✖ {tag}run {run.id} fail {e}")
+        finally:
+            run.ended = time.time()
+            with self._lock:
+                self._busy.discard(run.key)
+                self._dispatch(run.key)
+            run.finished.set()
+            self._publish(run)
+
+    def _trim(self):
+        # caller holds self._lock; forget the oldest finished runs
+        extra = len(self._runs) - self._history
+        if extra <= 0:
+            return
+        for rid in [rid for rid, r in self._runs.items() if r.state in _FINAL][:extra]:
+            del self._runs[rid]
+
+    # ───────────── control / status ─────────────
+    def cancel(self, rid: str) -> Run | None:
+        """Cancel a queued run at once, or a running one before its next step."""
+        with self._lock:
+            run = self._runs.get(rid)
+            if run is None or run.state in _FINAL:
+                return run
+            run.cancel.set()
+            q = self._queues.get(run.key)
+            if run.state == "queued" and q and run in q:
+                q.remove(run)
+                if not q:
+                    del self._queues[run.key]
+                run.state, run.ended = "cancelled", time.time()
+                run.finished.set()
+            else:
+                return run
+        self._publish(run)
+        return run
+
+    def get(self, rid: str) -> Run | None:
+        with self._lock:
+            return self._runs.get(rid)
+
+    def list(self, state: str | None = None, serial: str | None = None,
+             trace: bool = False) -> list[dict]:
+        """Newest first; *trace* includes each run's step spans."""
+        with self._lock:
+            runs = list(self._runs.values())
+        return [r.as_dict(trace) for r in reversed(runs)
+                if (state is None or r.state == state) and (serial is None or r.serial == serial)]
+
+
+runs = RunManager()
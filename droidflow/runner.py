@@ -1,178 +1,410 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import threading
 import time
-import re
-import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from utils import (
     connect,
+    snapshot,
+    input_channel,
+    swipe_dir,
     log,
-    el_matches,
-    node_at,
     actions,
     wait_for_el,
     wait_for_text,
+    ui_idle,
+    hierarchy_cache,
+    capture_lease,
+    trace as spans,
 )
+from compiler import Click, CompileError, compile_flow
+
+# ───────────── config ─────────────
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", "8"))   # post-click checks running at once (all runs)
+FLOW_PACING = os.getenv("FLOW_PACING", "input")          # all | input | none (see _PACED)
+FLOW_STEP_DELAY = float(os.getenv("FLOW_STEP_DELAY", "0.12"))   # pause after a paced step (s)
+FLOW_IDLE_WAITS = os.getenv("FLOW_IDLE_WAITS", "recorded")      # recorded | all | none: waits that end once the UI is idle
+POST_CLICK_SETTLE = float(os.getenv("POST_CLICK_SETTLE", "0.5"))  # max wait for a post-click snapshot (s)
+FLOW_VERIFY = os.getenv("FLOW_VERIFY", "log")             # log | retry | abort | off: failed post-click check
+FLOW_VERIFY_RETRIES = int(os.getenv("FLOW_VERIFY_RETRIES", "1"))   # re-clicks per step under "retry"
+
+# post-click checks run here, overlapping the following steps
+_verify_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="verify")
+
+
+class VerifyError(RuntimeError):
+    """A post-click check failed under the "abort" policy."""
+
+
+class RunCancelled(Exception):
+    """The run's cancel event was set; raised between steps."""
 
 # ──────────── coordinate helper ────────────
-def _xy_to_px(d, x, y):
+def _xy_to_px(d, x, y, size=None):
     """Convert normalized or absolute x,y to pixel coordinates."""
-    w, h = d.window_size()
+    w, h = size or d.window_size()
     px = int(x * w) if 0 <= x <= 1 else int(x)
     py = int(y * h) if 0 <= y <= 1 else int(y)
     return px, py
 
 # ────── post-click check ───────
-def _post_click_check(d, px, py, expected_bounds):
-    """After click, verify element still there or report disappearance/resize."""
+def _verify_click(serial, px, py, expected, since):
+    """Check a coordinate click against the first snapshot taken after *since*.
+
+    Uses whatever snapshot the runner (or anyone) dumps next; only when none
+    shows up within POST_CLICK_SETTLE does it dump one itself.
+    Returns ``(status, detail)``: ok / gone / moved.
+    """
+    deadline = since + POST_CLICK_SETTLE
+    while True:
+        ver = hierarchy_cache.version(serial)
+        snap = hierarchy_cache.peek(serial)
+        if snap is not None and snap.ts >= since:
+            break
+        rest = deadline - time.time()
+        if rest <= 0:
+            snap = snapshot(serial)
+            break
+        hierarchy_cache.wait_change(serial, ver, rest)
+    idx = snap.index
+    n = idx.smallest_at(px, py, clickable=True)
+    if n is None:
+        return "gone", "element disappeared after click"
+    if expected and idx.table.rect(n) != expected:
+        l, t, r, b = expected
+        return "moved", f"bounds changed [{l},{t}][{r},{b}] -> {idx.table.get(n, 'bounds')}"
+    return "ok", ""
+
+def _post_click_check(d, px, py, expected):
+    """After click, verify element still there or report disappearance/resize (inline)."""
     try:
-        time.sleep(0.5)
-        root = ET.fromstring(d.dump_hierarchy())
-        n = node_at(root, px, py)
-        if not n:
-            log("⚠ element disappeared after click")
-        elif expected_bounds and n.get('bounds') != expected_bounds:
-            log(f"⚠ bounds changed {expected_bounds} -> {n.get('bounds')}")
+        status, detail = _verify_click(getattr(d, "serial", None), px, py, expected, time.time())
+        if status != "ok":
+            log(f"⚠ {detail}")
     except Exception as e:
         log(f"post-click check fail {e}")
 
 # ────── click implementation ───────
-def do_click(d, a, mode):
-    """
-    Try 1) selector-based click (if mode!='position'),
-        2) click at midpoint of bounds,
-        3) click at raw x/y.
+def _click(d, c: Click, mode, inp, size=None):
+    """Click a pre-resolved target (see do_click for the fallback order).
+
+    Returns ``(px, py, expected rect | None)`` for a coordinate tap that
+    still needs a post-click check, None otherwise.
     """
-    # 1) selector
-    if mode != "position":
-        for key, kw in (("rid","resourceId"), ("text","text"), ("desc","description")):
-            v = a.get(key)
-            if v:
-                try:
-                    getattr(d, kw)(v).click()
-                    return
-                except:
-                    pass
+    # 1) selector (matched locally against the shared snapshot; bounds only rank candidates)
+    if mode != "position" and c.sel is not None:
+        try:
+            t = snapshot(getattr(d, "serial", None)).table
+            n = c.sel.find(t)
+            r = t.rect(n) if n is not None else None
+            if r:
+                spans.note("path", "selector")
+                inp.tap((r[0] + r[2])//2, (r[1] + r[3])//2)
+                return
+        except Exception as e:
+            log(f"selector click fail {e}")
 
     # 2) bounds
-    bounds = a.get("bounds")
-    if bounds:
-        l, t, r, b = map(int, re.findall(r"\d+", bounds))
+    if c.rect:
+        l, t, r, b = c.rect
         px, py = (l + r)//2, (t + b)//2
-        d.click(px, py)
-        _post_click_check(d, px, py, bounds)
-        return
+        spans.note("path", "bounds")
+        inp.tap(px, py)
+        return px, py, c.rect
 
     # 3) raw coords
-    if "x" in a and "y" in a:
-        px, py = _xy_to_px(d, a["x"], a["y"])
-        d.click(px, py)
-        _post_click_check(d, px, py, None)
-        return
+    if c.xy:
+        px, py = _xy_to_px(d, *c.xy, size)
+        spans.note("path", "xy")
+        inp.tap(px, py)
+        return px, py, None
 
+    spans.note("path", "none")
     log("⚠ do_click(): no selector/bounds to click")
 
+def do_click(d, a, mode, inp=None):
+    """
+    Try 1) selector-based click (if mode!='position'), resolved from one snapshot,
+        2) click at midpoint of bounds,
+        3) click at raw x/y.
+    Coordinate taps go through the persistent input channel *inp*.
+    """
+    inp = inp or input_channel(getattr(d, "serial", None))
+    tap = _click(d, Click(a), mode, inp)
+    if tap:
+        _post_click_check(d, *tap)
+
+# ──────── op handlers ────────
+# handler(run, instr) → next pc, or None for the following instruction
+class _Run:
+    """Per-run state shared by the op handlers."""
+
+    __slots__ = ("d", "inp", "serial", "dev", "mode", "loops", "_size",
+                 "pc", "entry", "trace", "pending", "retries", "cancel")
+
+    def __init__(self, d, inp, serial, mode, cancel=None, trace=None):
+        self.d = d
+        self.inp = inp
+        self.serial = serial
+        self.dev = getattr(d, "serial", None) or serial
+        self.mode = mode
+        self.loops: list[int] = []        # remaining iterations, innermost last
+        self._size = None
+        self.pc = 0
+        self.entry: dict = {}             # trace entry of the running step
+        self.trace: list[dict] = [] if trace is None else trace
+        self.cancel: threading.Event = cancel or threading.Event()
+        self.pending: list[tuple] = []    # (pc, instr, trace entry, future) of running checks
+        self.retries: dict[int, int] = {}
+
+    @property
+    def size(self):
+        if self._size is None:
+            with spans.part("rpc"):
+                self._size = self.d.window_size()
+        return self._size
+
+def _op_wait(r, ins):
+    sec, settle = ins.arg
+    with spans.part("sleep"):
+        if FLOW_IDLE_WAITS == "all" or (settle and FLOW_IDLE_WAITS == "recorded"):
+            with capture_lease(r.dev):         # frames tell idle apart from a slow UI
+                ui_idle.wait_idle(r.dev, sec, cancel=r.cancel, leased=True)   # recorded think-time: go on once the UI settled
+            if r.cancel.is_set():
+                raise RunCancelled()
+        elif r.cancel.wait(sec):
+            raise RunCancelled()
+
+def _op_click(r, ins):
+    c = ins.arg
+    since = time.time()
+    tap = _click(r.d, c, r.mode, r.inp, r.size if c.xy else None)
+    if tap and (c.verify or FLOW_VERIFY) != "off":
+        fut = _verify_pool.submit(_verify_click, r.dev, *tap, since)
+        r.pending.append((r.pc, ins, r.entry, fut))
+
+def _op_key(r, ins):
+    r.inp.key(ins.arg)
+
+def _op_type(r, ins):
+    r.inp.text(ins.arg)
+
+def _op_swipe(r, ins):
+    # swipe เริ่มและสิ้นสุดในโซนกลาง (30%–70%) ของหน้าจอ (ดู SWIPES ใน utils.core)
+    swipe_dir(ins.arg, r.serial)
+
+def _op_wait_el(r, ins):
+    sel, timeout = ins.arg
+    with spans.part("wait"):
+        wait_for_el(sel, timeout, serial=r.serial)
+
+def _op_wait_text(r, ins):
+    text, timeout = ins.arg
+    with spans.part("wait"):
+        wait_for_text(text, timeout, serial=r.serial)
+
+def _op_assert(r, ins):
+    sel, label = ins.arg
+    if sel is not None and sel.find(snapshot(r.dev).table) is not None:
+        log(f"✔ assert {label} OK")
+    else:
+        log(f"✖ assert {label} FAIL")
+
+def _op_loop_start(r, ins):
+    r.loops.append(ins.arg)
+
+def _op_loop_end(r, ins):
+    if not r.loops:
+        return None
+    r.loops[-1] -= 1
+    if r.loops[-1] > 0:
+        return ins.jump
+    r.loops.pop()
+
+def _op_if_start(r, ins):
+    if ins.arg is None:           # legacy bare if_start: always true
+        return None
+    sel, negate = ins.arg
+    found = sel.find(snapshot(r.dev).table) is not None
+    if found == negate:
+        return ins.jump
+
+def _op_jump(r, ins):
+    return ins.jump
+
+HANDLERS = {
+    "wait": _op_wait, "click": _op_click, "key": _op_key, "type": _op_type,
+    "swipe": _op_swipe, "wait_el": _op_wait_el, "wait_text": _op_wait_text,
+    "assert": _op_assert, "loop_start": _op_loop_start, "loop_end": _op_loop_end,
+    "if_start": _op_if_start, "else": _op_jump, "goto": _op_jump,
+}
+
+# pacing: which steps are followed by FLOW_STEP_DELAY
+_PACED = {
+    "all":   frozenset(HANDLERS),
+    "input": frozenset(("click", "key", "type", "swipe")),   # let the device catch up after input
+    "none":  frozenset(),
+}
+
+# steps that wait for outstanding checks when the policy can stop or repeat the
+# run: more input (or a jump) must not happen on top of a failed click
+_BARRIER = frozenset(("click", "key", "type", "swipe", "loop_end", "if_start", "else", "goto"))
+
+def _collect(r, block):
+    """Attach finished post-click checks to the trace and apply their policy.
+
+    With *block*, checks whose policy is retry/abort are waited for.
+    Returns the pc of a click to repeat, or None.
+    """
+    keep, again = [], None
+    for item in r.pending:
+        pc, ins, entry, fut = item
+        policy = ins.arg.verify or FLOW_VERIFY
+        if not fut.done() and not (block and policy != "log"):
+            keep.append(item)
+            continue
+        try:
+            status, detail = fut.result()
+        except Exception as e:
+            status, detail = "error", f"post-click check fail {e}"
+        entry["verify"] = status
+        if detail:
+            entry["verify_detail"] = detail
+        if status == "ok":
+            continue
+        log(f"⚠ step {ins.step}: {detail}")
+        if status == "error":
+            continue                      # the check itself broke: nothing to act on
+        if policy == "abort":
+            raise VerifyError(f"step {ins.step}: {detail}")
+        if policy == "retry" and again is None and r.retries.get(pc, 0) < FLOW_VERIFY_RETRIES:
+            r.retries[pc] = r.retries.get(pc, 0) + 1
+            again = pc
+    r.pending = keep
+    return again
+
 # ──────── main flow runner ────────
-def run_flow(acts_list, mode):
-    d = connect()
-    pc = 0
-    # build label → index map
-    labels = {a.get("val"): i for i, a in enumerate(acts_list) if a.get("op") == "label"}
-    stack = []
-    log(f"RUN mode={mode}")
-
-    while pc < len(acts_list):
-        a = acts_list[pc]
-        op = a.get("op")
-
-        if   op == "wait":
-            time.sleep(a.get("sec", 0))
-        elif op == "click":
-            do_click(d, a, mode)
-        elif op == "key":
-            d.press(a.get("key"))
-        elif op == "type":
-            d.shell(f'input text "{a.get("text","")}"')
-
-        elif op == "swipe":
-            direction = a.get("dir", "left")
-            # ปรับ swipe ให้เริ่มและสิ้นสุดในโซนกลาง (30%–70%) ของหน้าจอ
-            if direction == "right":
-                d.swipe(0.3, 0.5, 0.7, 0.5, 0.3)
-            elif direction == "left":
-                d.swipe(0.7, 0.5, 0.3, 0.5, 0.3)
-            elif direction == "down":
-                d.swipe(0.5, 0.4, 0.5, 0.6, 0.3)
-            elif direction == "up":
-                d.swipe(0.5, 0.6, 0.5, 0.4, 0.3)
-            else:
-                d.swipe(0.7, 0.5, 0.3, 0.5, 0.3)
-
-
-        # elif op == "swipe":
-        #     direction = a.get("dir", "left")
-        #     # ย้ายทุก swipe มาไว้ใน bottom 30% ของหน้าจอ (y: 70%–100%)
-        #     if direction == "right":
-        #         d.swipe(0.15, 0.85, 0.85, 0.85, 0.3)
-        #     elif direction == "left":
-        #         d.swipe(0.85, 0.85, 0.15, 0.85, 0.3)
-        #     elif direction == "down":
-        #         d.swipe(0.5, 0.75, 0.5, 0.95, 0.3)
-        #     elif direction == "up":
-        #         d.swipe(0.5, 0.95, 0.5, 0.75, 0.3)
-        #     else:
-        #         d.swipe(0.85, 0.85, 0.15, 0.85, 0.3)
-    
-
-        # elif op == "swipe":
-        #     direction = a.get("dir", "left")
-        #     if direction == "right":
-        #         d.swipe(0.1, 0.5, 0.9, 0.5, 0.3)
-        #     elif direction == "up":
-        #         d.swipe(0.5, 0.9, 0.5, 0.1, 0.3)
-        #     elif direction == "down":
-        #         d.swipe(0.5, 0.1, 0.5, 0.9, 0.3)
-        #     else:
-        #         d.swipe(0.9, 0.5, 0.1, 0.5, 0.3)
-
-
-        elif op == "wait_el":
-            sel = {k: a.get(k) for k in ("rid", "text", "desc") if a.get(k)}
-            wait_for_el(sel, float(a.get("timeout", 10)))
-        elif op == "wait_text":
-            wait_for_text(a.get("text", ""), float(a.get("timeout", 10)))
-        elif op == "assert":
-            ok = el_matches(d, a)
-            if ok:
-                log(f"✔ assert {a.get('sel')} OK")
-            else:
-                log(f"✖ assert {a.get('sel')} FAIL")
-        elif op == "loop_start":
-            stack.append({"pos": pc, "cnt": int(a.get("val", 1))})
-        elif op == "loop_end":
-            top = stack[-1]
-            top["cnt"] -= 1
-            if top["cnt"] > 0:
-                pc = top["pos"]
-            else:
-                stack.pop()
-        elif op == "if_start":
-            # TODO: implement skipping to matching if_end on false
-            pass
-        elif op == "goto":
-            pc = labels.get(a.get("val"), pc)
-
-        pc += 1
-        time.sleep(0.12)
-
-    log("END")
+def _begin(r, ins, now, t0):
+    """Open the trace span of the step about to run (see utils/trace.py).
+
+    The span starts at *now*, before any wait on earlier post-click checks,
+    so that wait is part of it.
+    """
+    r.entry = {"step": ins.step, "op": ins.op, "at": round(now - t0, 3)}
+    r.trace.append(r.entry)
+    spans.begin(r.entry, t0)
+    waited = time.time() - now
+    if waited > 0.001:
+        spans.add("wait", now, waited)
+
+def run_flow(acts_list, mode, serial=None, pacing=None, cancel=None, trace=None):
+    """Run *acts_list* (steps or a compiled Program) on *serial* (default device when None).
+
+    Returns the step trace: ``[{step, op, at, sec, dump?, rpc?, sleep?, wait?,
+    parts?, path?, verify?, verify_detail?}, …]`` — one span per step, see
+    utils/trace.py (filled into *trace* as it goes when given).  Setting the *cancel* event
+    stops the run before its next step with RunCancelled.
+    """
+    tag = f"[{serial}] " if serial else ""
+    try:
+        prog = compile_flow(acts_list)
+    except CompileError as e:
+        log(f"✖ {tag}compile fail {e}")
+        raise
+    paced = _PACED.get(pacing or FLOW_PACING, _PACED["input"])
+    t0 = time.time()                      # span times ("at") count from here, connect included
+    d = connect(serial)
+    r = _Run(d, input_channel(getattr(d, "serial", None) or serial), serial, mode, cancel, trace)
+    code = prog.code
+    log(f"{tag}RUN mode={mode}")
+
+    try:
+        pc = 0
+        while pc < len(code):
+            if r.cancel.is_set():
+                log(f"{tag}CANCELLED")
+                raise RunCancelled()
+            ins = code[pc]
+            now = time.time()
+            if r.pending:
+                again = _collect(r, ins.op in _BARRIER)
+                if again is not None:
+                    log(f"{tag}↻ retry step {code[again].step}")
+                    pc, ins = again, code[again]
+            r.pc = pc
+            _begin(r, ins, now, t0)
+            nxt = HANDLERS[ins.op](r, ins)
+            pc = pc + 1 if nxt is None else nxt
+            if ins.op in paced:
+                with spans.part("sleep"):
+                    ui_idle.wait_idle(r.dev, FLOW_STEP_DELAY, cancel=r.cancel)
+            r.entry["sec"] = round(time.time() - now, 3)
+
+        while r.pending:                  # the last clicks' checks still belong in the trace
+            for *_, fut in r.pending:
+                try:
+                    fut.result()
+                except Exception:
+                    pass                  # reported by _collect
+            again = _collect(r, True)
+            if again is not None:         # retry of a final click: run just that step again
+                log(f"{tag}↻ retry step {code[again].step}")
+                r.pc, ins = again, code[again]
+                now = time.time()
+                _begin(r, ins, now, t0)
+                HANDLERS[ins.op](r, ins)
+                r.entry["sec"] = round(time.time() - now, 3)
+    finally:
+        spans.end()
+    log(f"{tag}END")
+    return r.trace
+
+# ──────── fan-out across devices ────────
+def run_flow_many(acts_list, mode, serials):
+    """Run the same flow on every serial through the run manager and wait.
+
+    Returns ``{serial: {"ok": bool, "sec": float, "error"?: str}}``.
+    """
+    from manager import runs
+    serials = list(dict.fromkeys(s for s in serials if s))
+    if not serials:
+        log("⚠ fan-out: no devices")
+        return {}
+    try:
+        prog = compile_flow(acts_list)          # once for every device
+    except CompileError as e:
+        log(f"✖ fan-out compile fail {e}")
+        return {ser: {"ok": False, "error": str(e), "sec": 0} for ser in serials}
+    log(f"FAN-OUT {len(serials)} devices mode={mode}")
+    started = {ser: runs.submit(prog, mode, ser, name="fan-out") for ser in serials}
+    results = {}
+    for ser, run in started.items():
+        run.wait()
+        res = {"ok": run.state == "done", "sec": round((run.ended or 0) - (run.started or run.ended or 0), 3)}
+        if run.state != "done":
+            res["error"] = run.error or run.state
+        results[ser] = res
+    ok = sum(r["ok"] for r in results.values())
+    log(f"FAN-OUT done {ok}/{len(results)} ok")
+    return results
 
 # ──────── spawning helpers ────────
+# ทุก run ผ่าน manager.runs (executor จำกัดจำนวน + คิวต่อ device)
 def run_now(mode="hybrid"):
-    """Run the current recorded actions immediately."""
-    threading.Thread(target=run_flow, args=(actions.copy(), mode), daemon=True).start()
+    """Queue the current recorded actions."""
+    from manager import runs
+    return runs.submit(actions.copy(), mode, name="recorded")
+
+def run_compile(acts_list, mode="hybrid", pacing=None):
+    """Compile *acts_list* now (raises CompileError) and queue it."""
+    from manager import runs
+    return runs.submit(acts_list, mode, pacing=pacing, name="compiled")
 
-def run_compile(acts_list, mode="hybrid"):
-    """Run a provided list of actions (e.g. compiled flow)."""
-    threading.Thread(target=run_flow, args=(acts_list, mode), daemon=True).start()
\ No newline at end of file
+def run_fanout(acts_list, mode="hybrid", serials=()):
+    """Queue one run of *acts_list* per device; returns ``{serial: Run}``."""
+    from manager import runs
+    prog = compile_flow(acts_list)
+    return {ser: runs.submit(prog, mode, ser, name="fan-out")
+            for ser in dict.fromkeys(s for s in serials if s)}
@@ -0,0 +1,148 @@
+"""Shared fixtures: import path, no real device, and a fake adb server."""
+
+import os
+import socket
+import sys
+import threading
+
+# `import utils` from the droidflow root, as app.py / runner.py do; the replay
+# backend keeps the package import from probing a real adb server / device
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DROIDFLOW_BACKEND", "replay")
+
+import pytest  # noqa: E402
+
+
+class FakeAdbServer:
+    """Localhost server speaking the adb smart-socket protocol.
+
+    Handles ``host:version``, ``host:devices``, ``host:track-devices(-l)``,
+    ``host:transport:<serial>`` / ``host:transport-any`` followed by one
+    ``shell:`` / ``exec:`` service.  ``services`` maps a service string to
+    the bytes it returns; unknown services answer FAIL.
+    """
+
+    def __init__(self):
+        self.devices: dict[str, str] = {"emulator-5554": "device"}
+        self.services: dict[str, bytes] = {}
+        self.requests: list[str] = []      # every request, in arrival order
+        self.connections = 0
+        self._trackers: list[tuple[socket.socket, bool]] = []   # (socket, long format)
+        self._lock = threading.Lock()
+        self._srv = socket.create_server(("127.0.0.1", 0))
+        self.port = self._srv.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    # ───────────── protocol ─────────────
+    @staticmethod
+    def _recv_exact(sock, n: int) -> bytes:
+        buf = b""
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                raise ConnectionError
+            buf += chunk
+        return buf
+
+    def _request(self, sock) -> str:
+        n = int(self._recv_exact(sock, 4), 16)
+        req = self._recv_exact(sock, n).decode()
+        with self._lock:
+            self.requests.append(req)
+        return req
+
+    @staticmethod
+    def _msg(text: str) -> bytes:
+        data = text.encode()
+        return b"%04x" % len(data) + data
+
+    def _fail(self, sock, text: str):
+        sock.sendall(b"FAIL" + self._msg(text))
+        sock.close()
+
+    def _device_list(self, long: bool) -> str:
+        # caller holds self._lock
+        rows = list(self.devices.items())
+        extra = " product:sdk model:fake transport_id:1" if long else ""
+        return "".join(f"{s}\t{st}{extra}\n" for s, st in rows)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._srv.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        try:
+            req = self._request(sock)
+            if req == "host:version":
+                sock.sendall(b"OKAY" + self._msg("0029"))
+            elif req == "host:devices":
+                with self._lock:
+                    sock.sendall(b"OKAY" + self._msg(self._device_list(False)))
+            elif req.startswith("host:track-devices"):
+                long = req.endswith("-l")
+                with self._lock:             # registered first: no change is missed
+                    self._trackers.append((sock, long))
+                    sock.sendall(b"OKAY" + self._msg(self._device_list(long)))
+                return                       # kept open; set_device() pushes updates
+            elif req.startswith("host:transport"):
+                serial = req.split(":", 2)[2] if req.startswith("host:transport:") else None
+                with self._lock:
+                    ok = (self.devices.get(serial) == "device" if serial
+                          else "device" in self.devices.values())
+                if not ok:
+                    return self._fail(sock, f"device '{serial}' not found")
+                sock.sendall(b"OKAY")
+                svc = self._request(sock)
+                out = self.services.get(svc)
+                if out is None:
+                    return self._fail(sock, f"unknown service {svc}")
+                sock.sendall(b"OKAY" + out)
+            else:
+                return self._fail(sock, f"unknown request {req}")
+            sock.close()
+        except (OSError, ConnectionError):
+            sock.close()
+
+    # ───────────── test controls ─────────────
+    def set_device(self, serial: str, state: str | None):
+        """Change (None: remove) a device and notify open tracking sockets."""
+        with self._lock:
+            if state is None:
+                self.devices.pop(serial, None)
+            else:
+                self.devices[serial] = state
+            for sock, long in self._trackers:
+                try:
+                    sock.sendall(self._msg(self._device_list(long)))
+                except OSError:
+                    pass
+
+    def close(self):
+        self._srv.close()
+        with self._lock:
+            trackers, self._trackers = self._trackers, []
+        for sock, _ in trackers:
+            sock.close()
+
+
+@pytest.fixture
+def fake_adb():
+    srv = FakeAdbServer()
+    yield srv
+    srv.close()
+
+
+@pytest.fixture
+def refused_port():
+    """A localhost port nothing listens on."""
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
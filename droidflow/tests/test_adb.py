@@ -0,0 +1,106 @@
+"""AdbClient against a fake adb server (utils/adb.py)."""
+
+import time
+
+import pytest
+
+from utils import core
+from utils.adb import AdbClient, AdbError
+
+SERIAL = "emulator-5554"
+
+
+def _client(fake, **kw):
+    return AdbClient("127.0.0.1", fake.port, timeout=2, **kw)
+
+
+def test_version_and_devices(fake_adb):
+    fake_adb.devices["emulator-5556"] = "offline"
+    c = _client(fake_adb)
+    assert c.version() == 0x29
+    assert c.devices() == [(SERIAL, "device"), ("emulator-5556", "offline")]
+
+
+def test_shell_quotes_and_reads_to_eof(fake_adb):
+    fake_adb.services["shell:echo 'a b'"] = b"a b\n"
+    c = _client(fake_adb, pool_size=0)
+    assert c.shell(SERIAL, ["echo", "a b"]) == b"a b\n"
+    assert fake_adb.requests[-2:] == [f"host:transport:{SERIAL}", "shell:echo 'a b'"]
+
+
+def test_exec_out_is_binary_safe(fake_adb):
+    png = bytes(range(256)) * 1000
+    fake_adb.services["exec:screencap -p"] = png
+    c = _client(fake_adb, pool_size=0)
+    assert c.exec_out(SERIAL, ["screencap", "-p"]) == png
+    buf = bytearray(10)
+    n = c.exec_out_into(SERIAL, ["screencap", "-p"], buf)
+    assert bytes(buf[:n]) == png
+
+
+def test_transport_any_without_serial(fake_adb):
+    fake_adb.services["shell:id"] = b"uid=2000\n"
+    assert _client(fake_adb, pool_size=0).shell(None, "id") == b"uid=2000\n"
+    assert "host:transport-any" in fake_adb.requests
+
+
+def test_fail_status_raises(fake_adb):
+    c = _client(fake_adb, pool_size=0)
+    with pytest.raises(AdbError, match="not found"):
+        c.shell("nope", "id")
+    with pytest.raises(AdbError, match="unknown service"):
+        c.shell(SERIAL, "missing")
+
+
+def test_pooled_transport_is_reused(fake_adb):
+    fake_adb.services["shell:true"] = b""
+    c = _client(fake_adb, pool_size=1)
+    c.shell(SERIAL, "true")                   # schedules a pre-switched socket
+    deadline = time.time() + 2
+    while not c._idle.get(SERIAL) and time.time() < deadline:
+        time.sleep(0.01)
+    assert c._idle.get(SERIAL)
+
+    def no_fresh_transport(*a, **kw):
+        raise AssertionError("expected the pooled transport socket")
+    c._switch = no_fresh_transport
+    c._schedule_refill = lambda serial: None
+    switches = fake_adb.requests.count(f"host:transport:{SERIAL}")
+    assert c.shell(SERIAL, "true") == b""
+    assert fake_adb.requests.count(f"host:transport:{SERIAL}") == switches
+    assert not c._idle[SERIAL]
+
+
+def test_drop_closes_pooled_sockets(fake_adb):
+    fake_adb.services["shell:true"] = b""
+    c = _client(fake_adb, pool_size=1)
+    c.shell(SERIAL, "true")
+    deadline = time.time() + 2
+    while not c._idle.get(SERIAL) and time.time() < deadline:
+        time.sleep(0.01)
+    (sock, _), = c._idle[SERIAL]
+    c.drop(SERIAL)
+    assert SERIAL not in c._idle and sock.fileno() == -1
+
+
+def test_refused_connection_raises(refused_port):
+    with pytest.raises(ConnectionRefusedError):
+        AdbClient("127.0.0.1", refused_port, timeout=1).devices()
+
+
+def test_core_falls_back_to_adb_binary_when_refused(monkeypatch, refused_port):
+    calls = []
+
+    def check_output(cmd, **kw):
+        calls.append(cmd)
+        if "devices" in cmd:
+            return "List of devices attached\nemulator-5554\tdevice\n"
+        return "ok\n" if kw.get("text") else b"raw"
+    monkeypatch.setattr(core, "backend", None)
+    monkeypatch.setattr(core, "adb_client", AdbClient("127.0.0.1", refused_port, timeout=1))
+    monkeypatch.setattr(core.subprocess, "check_output", check_output)
+    assert core.adb_shell(["echo", "ok"], serial=SERIAL) == "ok\n"
+    assert core.adb_exec_out(["screencap"], serial=SERIAL) == b"raw"
+    assert core.adb_devices("127.0.0.1", str(refused_port)) == [("emulator-5554", "device")]
+    assert calls[0][-3:] == ["shell", "echo", "ok"]
+    assert calls[1][-2:] == ["exec-out", "screencap"]
@@ -0,0 +1,83 @@
+"""Spatial lookups in utils/hierarchy.py give exactly the linear-scan results."""
+
+import random
+
+import pytest
+
+from bench import synth_hierarchy
+from utils.hierarchy import GridIndex, SpatialIndex, outermost
+from utils.nodetable import CLICKABLE, HAS_BOUNDS, NodeTable
+
+
+def _inside(a, b):
+    return a[0] >= b[0] and a[1] >= b[1] and a[2] <= b[2] and a[3] <= b[3]
+
+
+def _outermost_ref(rects):
+    """The original pairwise filter from get_elements()."""
+    return [i for i, a in enumerate(rects)
+            if not any(i != j and _inside(a, b) for j, b in enumerate(rects))]
+
+
+def _smallest_ref(t: NodeTable, px, py, clickable):
+    best, area = None, float("inf")
+    for i in range(len(t)):
+        if not t.flags[i] & HAS_BOUNDS or (clickable and not t.flags[i] & CLICKABLE):
+            continue
+        l, tp, r, b = t.left[i], t.top[i], t.right[i], t.bottom[i]
+        if l <= px <= r and tp <= py <= b and (r - l) * (b - tp) < area:
+            best, area = i, (r - l) * (b - tp)
+    return best
+
+
+def _random_rects(rnd, n, span=50, inverted=False):
+    out = []
+    for _ in range(n):
+        l, t = rnd.randint(0, span), rnd.randint(0, span)
+        w, h = rnd.randint(0, span), rnd.randint(0, span)
+        out.append([l, t, l - w, t - h] if inverted and rnd.random() < 0.1 else [l, t, l + w, t + h])
+    return out + rnd.sample(out, k=min(len(out), 3))       # exact duplicates
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_outermost_matches_pairwise_filter(seed):
+    rnd = random.Random(seed)
+    rects = _random_rects(rnd, rnd.randint(0, 40), inverted=seed % 4 == 0)
+    assert outermost(rects) == _outermost_ref(rects)
+
+
+@pytest.mark.parametrize("rows", [0, 1, 30, 200])
+def test_outermost_on_synthetic_hierarchy(rows):
+    t = NodeTable.parse(synth_hierarchy(rows, seed=rows))
+    rects = [list(t.rect(i)) for i in t.where(CLICKABLE) if t.rect(i)]
+    assert outermost(rects) == _outermost_ref(rects)
+
+
+@pytest.mark.parametrize("cell", [7, 96, 1000])
+def test_grid_returns_every_container(cell):
+    rnd = random.Random(cell)
+    rects = _random_rects(rnd, 60, span=300)
+    grid = GridIndex(cell)
+    for i, (l, t, r, b) in enumerate(rects):
+        grid.insert(i, l, t, r, b)
+    for x in range(0, 601, 13):
+        for y in range(0, 601, 11):
+            want = {i for i, (l, t, r, b) in enumerate(rects) if l <= x <= r and t <= y <= b}
+            assert want <= set(grid.at(x, y))
+
+
+@pytest.mark.parametrize("cell", [32, 96, 4096])
+@pytest.mark.parametrize("clickable", [False, True])
+def test_smallest_at_matches_linear_scan(cell, clickable):
+    t = NodeTable.parse(synth_hierarchy(40, seed=7))
+    idx = SpatialIndex(t, cell)
+    w = max(t.right[i] for i in range(len(t)) if t.flags[i] & HAS_BOUNDS)
+    h = max(t.bottom[i] for i in range(len(t)) if t.flags[i] & HAS_BOUNDS)
+    pts = [(x, y) for x in range(0, w + 2, 37) for y in range(0, h + 2, 29)]
+    # bounds edges and grid-cell borders, where off-by-one bucketing would show
+    for i in range(0, len(t), 3):
+        if t.flags[i] & HAS_BOUNDS:
+            pts += [(t.left[i], t.top[i]), (t.right[i], t.bottom[i])]
+    pts += [(cell * k, cell * k - 1) for k in range(1, 8)]
+    for x, y in pts:
+        assert idx.smallest_at(x, y, clickable) == _smallest_ref(t, x, y, clickable), (x, y)
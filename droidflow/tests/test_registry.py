@@ -0,0 +1,43 @@
+"""DeviceRegistry fed by a fake adb server's track-devices stream (utils/registry.py)."""
+
+from utils.adb import AdbClient
+from utils.registry import DeviceRegistry, _parse
+
+
+def _registry(fake):
+    reg = DeviceRegistry(AdbClient("127.0.0.1", fake.port, timeout=2), retry=0.05)
+    assert reg.wait_live(2)
+    assert reg.wait_for(lambda: bool(reg.snapshot()), 2)
+    return reg
+
+
+def test_parse_long_format():
+    t = _parse("emulator-5554\tdevice product:sdk model:fake transport_id:3\nbad\n")
+    assert t == {"emulator-5554": {"state": "device", "transport_id": "3",
+                                   "props": {"product": "sdk", "model": "fake"}}}
+
+
+def test_initial_table(fake_adb):
+    reg = _registry(fake_adb)
+    assert reg.online() == ["emulator-5554"]
+    assert reg.get("emulator-5554")["props"]["model"] == "fake"
+    assert "host:track-devices-l" in fake_adb.requests
+
+
+def test_changes_are_pushed(fake_adb):
+    reg = _registry(fake_adb)
+    events = []
+    reg.subscribe(events.append)
+    fake_adb.set_device("emulator-5556", "device")
+    assert reg.wait_online("emulator-5556", timeout=2) == "emulator-5556"
+    fake_adb.set_device("emulator-5554", "offline")
+    assert reg.wait_for(lambda: reg.state("emulator-5554") == "offline", 2)
+    assert reg.online() == ["emulator-5556"]
+    assert {"serial": "emulator-5554", "state": "offline", "prev": "device"}.items() <= events[-1].items()
+
+
+def test_server_loss_clears_table(fake_adb):
+    reg = _registry(fake_adb)
+    fake_adb.close()
+    assert reg.wait_for(lambda: not reg.live and not reg.snapshot(), 2)
+    assert reg.first_online() is None
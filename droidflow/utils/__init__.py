@@ -9,25 +9,34 @@ DEVICE_SERIAL = _os.getenv("DEVICE_SERIAL")
 from .core import *  # noqa: F401,F403
 
 # Video streaming (H.264 / minicap)
-from .videostream import streamer as _vs, video_frame, video_stream
+from .videostream import streamer as _vs, video_codec, video_frame, video_stream, video_units
 
-# PNG fallback
-from .screenshot import ScreenshotStreamer
+# PNG fallback (one shared capture loop per serial, running only while subscribed)
+from .screenshot import (ScreenshotStreamer, capture_lease, get_streamer,
+                         on_any_capture, on_any_frame_change)
 
-_ss = ScreenshotStreamer()
+# a changed frame wakes wait_el / wait_text (hierarchy_cache.wait_change)
+on_any_frame_change(hierarchy_cache.signal)
+# every capture feeds the UI-idle detector (frame stability)
+on_any_capture(ui_idle.frame)
 
 
 def screenshot_b64():
     """Return the latest device screenshot encoded as base64."""
-    return _ss.screenshot_b64()
+    return get_streamer().screenshot_b64()
 
 from .core import log as _log
 
 
-def screenshot_stream():
+def screenshot_stream(rung=None, fmt=None):
     # บังคับไม่ใช้ scrcpy/minicap, ใช้การจับภาพแบบเดิมเสมอ
     _log("VideoStreamer: forced screenshot fallback")
-    return _ss.screenshot_stream()
+    return get_streamer().screenshot_stream(rung, fmt)
+
+
+def stream_stats() -> dict:
+    """Counters of the /stream frame broadcaster and its capture loop."""
+    return get_streamer().stream_stats()
 
 # def screenshot_stream():
 #     try:
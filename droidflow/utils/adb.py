@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process ADB client (smart-socket protocol ของ adb server)
+
+แทนการ fork `adb` ทุกคำสั่ง: คุยกับ adb server ผ่าน TCP โดยตรง
+  • request  = "%04x" % len(payload) + payload
+  • response = "OKAY" | "FAIL" + "%04x" + message
+  • host:*           → คำสั่งระดับ server (devices, connect, version …)
+  • host:transport:S → สลับ socket ไปที่ device S แล้วส่ง service ต่อ
+  • shell:/exec:     → อ่าน output จนกว่า server จะปิด socket (EOF)
+
+socket ที่ผ่าน `host:transport:` แล้วจะถูกเตรียมไว้ล่วงหน้าใน pool ต่อ serial
+(service ของ adb ใช้ socket ได้ครั้งเดียว จึง pool เป็น "socket ที่พร้อมรับ
+service" แทน) ทำให้แต่ละคำสั่งเหลือแค่ write + read ครั้งเดียว
+"""
+
+import os
+import queue
+import shlex
+import socket
+import threading
+import time
+from collections import deque
+
+# ───────────── config ─────────────
+ADB_POOL_SIZE = int(os.getenv("ADB_POOL_SIZE", "2"))          # pre-switched sockets kept per serial
+ADB_POOL_IDLE = float(os.getenv("ADB_POOL_IDLE", "30"))       # drop idle sockets older than this (s)
+
+
+class AdbError(RuntimeError):
+    """The adb server answered FAIL (device offline, unknown service, …)."""
+
+
+def server_address() -> tuple[str, int]:
+    """Return (host, port) of the adb server honoring ADB_SERVER_SOCKET."""
+    adb_sock = os.getenv("ADB_SERVER_SOCKET")
+    if adb_sock and adb_sock.startswith("tcp:"):
+        hostport = adb_sock[4:]
+        if ":" in hostport:
+            host, port = hostport.split(":", 1)
+        else:
+            host, port = "", hostport
+        return host or "127.0.0.1", int(port or 5037)
+    host = os.getenv("ANDROID_ADB_SERVER_HOST") or "127.0.0.1"
+    port = int(os.getenv("ANDROID_ADB_SERVER_PORT") or 5037)
+    return host, port
+
+
+def _quote(cmd: str | list[str]) -> str:
+    if isinstance(cmd, str):
+        return cmd
+    return " ".join(shlex.quote(str(c)) for c in cmd)
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if not k:
+            raise ConnectionError("adb server closed connection")
+        got += k
+    return bytes(buf)
+
+
+def _recv_all(sock: socket.socket) -> bytes:
+    chunks = []
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            break
+        chunks.append(data)
+    return b"".join(chunks)
+
+
+def _recv_into(sock: socket.socket, buf: bytearray) -> int:
+    """Read until EOF into *buf* (grown as needed); returns the byte count."""
+    got = 0
+    while True:
+        if got == len(buf):
+            buf.extend(bytes(max(65536, len(buf))))
+        with memoryview(buf) as view:
+            k = sock.recv_into(view[got:])
+        if not k:
+            return got
+        got += k
+
+
+class AdbClient:
+    """Talk to the adb server's smart socket without forking `adb`."""
+
+    def __init__(self, host: str | None = None, port: int | None = None,
+                 timeout: float = 5.0, pool_size: int = ADB_POOL_SIZE):
+        self._host = host
+        self._port = port
+        self.timeout = timeout
+        self._pool_size = pool_size
+        self._idle: dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._refill_q: queue.Queue = queue.Queue()
+        self._refill_started = False
+
+    @property
+    def address(self) -> tuple[str, int]:
+        host, port = server_address()
+        return self._host or host, self._port or port
+
+    # ───────────── low-level protocol ─────────────
+    def _open(self, timeout: float | None = None) -> socket.socket:
+        sock = socket.create_connection(self.address, timeout=timeout or self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    @staticmethod
+    def _send(sock: socket.socket, req: str):
+        data = req.encode()
+        sock.sendall(b"%04x" % len(data) + data)
+
+    @staticmethod
+    def _read_status(sock: socket.socket):
+        status = _recv_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            n = int(_recv_exact(sock, 4), 16)
+            raise AdbError(_recv_exact(sock, n).decode(errors="ignore"))
+        raise AdbError(f"unexpected adb status {status!r}")
+
+    @staticmethod
+    def _read_msg(sock: socket.socket) -> str:
+        n = int(_recv_exact(sock, 4), 16)
+        return _recv_exact(sock, n).decode(errors="ignore")
+
+    def host_request(self, req: str, *, reply: bool = True) -> str:
+        """Send a `host:` request on a fresh socket and return its payload."""
+        with self._open() as sock:
+            self._send(sock, req)
+            self._read_status(sock)
+            return self._read_msg(sock) if reply else ""
+
+    # ───────────── transport pool ─────────────
+    def _switch(self, serial: str | None, timeout: float | None = None) -> socket.socket:
+        sock = self._open(timeout)
+        try:
+            self._send(sock, f"host:transport:{serial}" if serial else "host:transport-any")
+            self._read_status(sock)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _take_idle(self, serial: str | None) -> socket.socket | None:
+        if not serial or not self._pool_size:
+            return None
+        now = time.time()
+        with self._lock:
+            dq = self._idle.get(serial)
+            while dq:
+                sock, ts = dq.popleft()
+                if now - ts < ADB_POOL_IDLE:
+                    return sock
+                sock.close()
+        return None
+
+    def _refill_loop(self):
+        while True:
+            serial = self._refill_q.get()
+            with self._lock:
+                have = len(self._idle.get(serial, ()))
+            if have >= self._pool_size:
+                continue
+            try:
+                sock = self._switch(serial)
+            except Exception:
+                continue
+            with self._lock:
+                self._idle.setdefault(serial, deque()).append((sock, time.time()))
+
+    def _schedule_refill(self, serial: str | None):
+        if not serial or not self._pool_size:
+            return
+        if not self._refill_started:
+            self._refill_started = True
+            threading.Thread(target=self._refill_loop, daemon=True).start()
+        self._refill_q.put(serial)
+
+    def drop(self, serial: str):
+        """Close pooled sockets for *serial* (e.g. after it went offline)."""
+        with self._lock:
+            for sock, _ in self._idle.pop(serial, ()):
+                sock.close()
+
+    def open_service(self, serial: str | None, service: str,
+                     timeout: float | None = None) -> socket.socket:
+        """Return a socket already attached to *service* on *serial*.
+
+        A pre-switched socket from the pool is tried first; if the server
+        closed it meanwhile we fall back to a fresh transport once.
+        """
+        sock = self._take_idle(serial)
+        if sock is not None:
+            try:
+                sock.settimeout(timeout or self.timeout)
+                self._send(sock, service)
+                self._read_status(sock)
+                self._schedule_refill(serial)
+                return sock
+            except AdbError:
+                sock.close()
+                raise
+            except OSError:
+                sock.close()
+        sock = self._switch(serial, timeout)
+        try:
+            self._send(sock, service)
+            self._read_status(sock)
+        except Exception:
+            sock.close()
+            raise
+        self._schedule_refill(serial)
+        return sock
+
+    # ───────────── services ─────────────
+    def shell(self, serial: str | None, cmd: str | list[str],
+              timeout: float | None = None) -> bytes:
+        """Run `shell:<cmd>` and return stdout+stderr bytes."""
+        with self.open_service(serial, f"shell:{_quote(cmd)}", timeout) as sock:
+            return _recv_all(sock)
+
+    def exec_out(self, serial: str | None, cmd: str | list[str],
+                 timeout: float | None = None) -> bytes:
+        """Run `exec:<cmd>` (raw, no pty / CRLF mangling) and return stdout."""
+        with self.open_service(serial, f"exec:{_quote(cmd)}", timeout) as sock:
+            return _recv_all(sock)
+
+    def exec_out_into(self, serial: str | None, cmd: str | list[str], buf: bytearray,
+                      timeout: float | None = None) -> int:
+        """`exec_out` into a reusable *buf*; returns how many bytes it holds."""
+        with self.open_service(serial, f"exec:{_quote(cmd)}", timeout) as sock:
+            return _recv_into(sock, buf)
+
+    # ───────────── host requests ─────────────
+    def version(self) -> int:
+        return int(self.host_request("host:version"), 16)
+
+    def devices(self) -> list[tuple[str, str]]:
+        """Return [(serial, state), …] as `adb devices` would list them."""
+        out = self.host_request("host:devices")
+        devs = []
+        for line in out.splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                devs.append((parts[0], parts[1]))
+        return devs
+
+    def connect_device(self, addr: str) -> str:
+        """Equivalent of `adb connect <addr>`; returns the server's message."""
+        return self.host_request(f"host:connect:{addr}")
+
+    def track_devices(self, long: bool = True) -> socket.socket:
+        """Open a `host:track-devices` stream (blocking socket).
+
+        The server immediately sends the full device list and then a new
+        full list on every change; read each one with `read_message()`.
+        """
+        sock = self._open()
+        try:
+            self._send(sock, "host:track-devices-l" if long else "host:track-devices")
+            self._read_status(sock)
+        except Exception:
+            sock.close()
+            raise
+        sock.settimeout(None)
+        return sock
+
+    read_message = _read_msg
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pluggable device backend.
+
+ค่าเริ่มต้น (DROIDFLOW_BACKEND=adb) คือทางเดิมใน utils/core.py: adb server +
+uiautomator2  backend อื่นแทนที่จุดที่แตะ device จริงทั้งหมด:
+  • open(serial)          → handle แบบ u2.Device (dump_hierarchy, window_size,
+                            app_current, app_start, app_stop, screenshot, info)
+  • input_channel(serial) → แบบ utils.input.InputChannel (tap/swipe/key/text)
+  • devices()             → [(serial, state), …]
+  • shell / exec_out      → แทน `adb shell` / `adb exec-out`
+
+DROIDFLOW_BACKEND=replay → utils/replay.py (fixture, ไม่ต้องมี emulator)
+หรือ `package.module:Class` สำหรับ backend ภายนอก  ทุก method ข้างบนเป็น abstract:
+backend ที่ขาดตัวใดตัวหนึ่งสร้าง instance ไม่ได้ (TypeError ตอน load_backend)
+"""
+
+import importlib
+from abc import ABC, abstractmethod
+
+
+class DeviceBackend(ABC):
+    """Where device handles, input, device lists and shell output come from."""
+
+    name = "base"
+
+    @abstractmethod
+    def open(self, serial: str | None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def input_channel(self, serial: str | None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def devices(self) -> list[tuple[str, str]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def shell(self, serial: str | None, cmd: list[str], timeout: float = 3.0) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def exec_out(self, serial: str | None, cmd: list[str], timeout: float = 3.0) -> bytes:
+        raise NotImplementedError
+
+
+def load_backend(spec: str) -> DeviceBackend | None:
+    """Backend for DROIDFLOW_BACKEND; None means the built-in adb/uiautomator2 path."""
+    spec = (spec or "adb").strip()
+    if spec == "adb":
+        return None
+    if spec == "replay":
+        from .replay import ReplayBackend
+        return ReplayBackend()
+    if ":" not in spec:
+        raise ValueError(f"unknown DROIDFLOW_BACKEND {spec!r} (adb | replay | module:Class)")
+    mod, cls = spec.split(":", 1)
+    return getattr(importlib.import_module(mod), cls)()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fan-out of captured frames to stream clients.
+
+เดิม `/stream` แต่ละ client วน generator ของตัวเองทุก SS_INTERVAL (20 ms)
+แล้วส่ง `_last_jpeg` ซ้ำไปเรื่อย ๆ ~50 ครั้ง/วินาที ไม่ว่าจอจะเปลี่ยนหรือไม่
+ที่นี่ capture thread `publish()` เฉพาะภาพที่เปลี่ยนพร้อมเลข seq แล้ว client
+รอบน condition variable:
+  • ส่งเมื่อมี seq ใหม่เท่านั้น (จอนิ่ง = ไม่มี byte วิ่ง นอกจาก keepalive)
+  • pacing ต่อ client: ไม่เกิน STREAM_MAX_FPS
+  • client ช้าได้ภาพล่าสุดเสมอ ภาพระหว่างทางถูกข้าม (นับใน `dropped`)
+bandwidth / CPU จึงโตตามอัตราการเปลี่ยนของจอ ไม่ใช่ จำนวน client × 50 Hz
+payload เป็นอะไรก็ได้ (screenshot.py ส่ง ladder.Frame ให้แต่ละ client encode
+ตาม rung ของตัวเอง) ผู้ส่งนับ byte ที่ส่งจริงด้วย `sent()`
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable
+
+# ───────────── config ─────────────
+STREAM_MAX_FPS = float(os.getenv("STREAM_MAX_FPS", "30"))       # per-client frame cap
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "10"))   # resend the last frame after this idle (s)
+
+
+class FrameBroadcaster:
+    """Latest frame + sequence number; clients block until a newer one exists."""
+
+    def __init__(self, max_fps: float = STREAM_MAX_FPS, keepalive: float = STREAM_KEEPALIVE):
+        self._cv = threading.Condition()
+        self._seq = 0
+        self._frame: Any = None
+        self._ts = 0.0
+        self._gap = 1.0 / max_fps if max_fps > 0 else 0.0
+        self._keepalive = keepalive
+        self.clients = 0
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+
+    # ───────────── producer ─────────────
+    def publish(self, frame):
+        """Capture thread: a new (changed) frame."""
+        with self._cv:
+            self._seq += 1
+            self._frame, self._ts = frame, time.time()
+            self._cv.notify_all()
+
+    def latest(self) -> tuple[int, Any]:
+        with self._cv:
+            return self._seq, self._frame
+
+    # ───────────── consumers ─────────────
+    def wait(self, after: int, timeout: float | None = None) -> tuple[int, Any]:
+        """Block until a frame newer than seq *after* exists (or *timeout*)."""
+        with self._cv:
+            self._cv.wait_for(lambda: self._seq > after, timeout)
+            return self._seq, self._frame
+
+    def frames(self, fps: Callable[[], float] | None = None):
+        """Yield ``(seq, frame)`` for one client: new frames only, paced, latest wins.
+
+        *fps* (called per frame) lowers this client's cap below STREAM_MAX_FPS.
+        """
+        with self._cv:
+            self.clients += 1
+        seq, last = 0, 0.0
+        try:
+            while True:
+                gap = max(self._gap, 1.0 / fps()) if fps else self._gap
+                rest = last + gap - time.monotonic()
+                if rest > 0:
+                    time.sleep(rest)                  # per-client pacing
+                new, frame = self.wait(seq, self._keepalive or None)
+                if frame is None:
+                    continue
+                if new > seq + 1 and seq:
+                    with self._cv:
+                        self.dropped += new - seq - 1
+                seq, last = new, time.monotonic()
+                yield seq, frame
+        finally:
+            with self._cv:
+                self.clients -= 1
+
+    def sent(self, nbytes: int):
+        """Consumer: one frame of *nbytes* went out to a client."""
+        with self._cv:
+            self.sent_frames += 1
+            self.sent_bytes += nbytes
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {"seq": self._seq, "clients": self.clients, "frame_ts": self._ts,
+                    "sent_frames": self.sent_frames, "sent_bytes": self.sent_bytes,
+                    "dropped": self.dropped}
@@ -14,6 +14,14 @@ Strategy การเลือก device:
   4) env DEVICE_SERIAL (อ่านสดทุกครั้ง)
   5) first 'device' จาก `adb devices`
   6) no-arg u2.connect() fallback
+
+handle ที่ได้จะถูกเก็บใน `device_pool` (utils/pool.py) ต่อ serial; การเรียก
+`connect()` ครั้งถัดไปจะคืน handle เดิมจนกว่า health-check จะพบว่าเสีย
+รายชื่อ device อ่านจาก `registry` (utils/registry.py) ที่ติดตาม adb server แบบ
+event-driven แทนการเรียก `adb devices` ซ้ำ ๆ
+
+DROIDFLOW_BACKEND (utils/backend.py) เปลี่ยนแหล่ง device ทั้งหมดได้ เช่น
+`replay` = device จำลองจาก fixture (utils/replay.py) ไม่ต้องมี emulator
 """
 
 import os
@@ -40,19 +48,38 @@ import xml.etree.ElementTree as ET
 import uiautomator2 as u2
 from flask import has_request_context, request
 
+from .adb import AdbClient
+from .backend import load_backend
+from .hierarchy import SnapshotCache, outermost
+from .idle import IdleDetector
+from .nodetable import CLICKABLE, NodeTable, parse_bounds
+from .extract import Extractor, load_rules
+from .ledger import Ledger
+from .input import drop_input_channel, get_input_channel, on_any_input
+from .pool import DevicePool
+from .registry import DeviceRegistry
+from .selector import compile_selector
+from . import trace as _trace
+from .watcher import HierarchyWatcher, WatcherHub
+
 # ───────────── config ─────────────
 DEVICE_SERIAL_DEFAULT = os.getenv("DEVICE_SERIAL")  # อ่านครั้งแรก; อาจมีการ export ภายหลัง
 # Default to the platform-tools adb installed inside the container if available
 ADB_PATH = os.getenv("ADB_PATH", "/opt/android-sdk/platform-tools/adb")
 INSTANCE_NAME = os.getenv("INSTANCE_NAME")
 ADB_CONNECT_PORT = os.getenv("ADB_CONNECT_PORT", "5556")
+DROIDFLOW_BACKEND = os.getenv("DROIDFLOW_BACKEND", "adb")   # adb | replay | module:Class
+
+# None = adb server + uiautomator2 (ด้านล่าง); อย่างอื่นแทนทุกจุดที่แตะ device
+backend = load_backend(DROIDFLOW_BACKEND)
 
 # ───────────── runtime env helpers ─────────────
 def _current_device_serial() -> str | None:
     """อ่าน DEVICE_SERIAL สดจาก env ทุกครั้ง."""
     return os.environ.get("DEVICE_SERIAL", DEVICE_SERIAL_DEFAULT)
 
-def _adb_cmd(extra: list[str], *, include_serial: bool = True) -> list[str]:
+def _adb_cmd(extra: list[str], *, include_serial: bool = True,
+             serial: str | None = None) -> list[str]:
     """
     Construct an ``adb`` command honoring ``DEVICE_SERIAL`` and any remote
     ADB server settings.
@@ -65,6 +92,8 @@ def _adb_cmd(extra: list[str], *, include_serial: bool = True) -> list[str]:
         When ``False`` the ``-s <serial>`` flag is omitted.  This is useful for
         commands such as ``adb devices`` which must query *all* devices rather
         than a single, potentially stale serial.
+    serial:
+        Explicit serial to target instead of the live ``DEVICE_SERIAL``.
     """
 
     base = [ADB_PATH]
@@ -83,128 +112,170 @@ def _adb_cmd(extra: list[str], *, include_serial: bool = True) -> list[str]:
             base += ["-P", port]
 
     if include_serial:
-        ser = _current_device_serial()
+        ser = serial or _current_device_serial()
         if ser:
             base += ["-s", ser]
     return base + extra
 
+# ───────────── in-process adb ─────────────
+# คำสั่ง adb ทั้งหมดวิ่งผ่าน smart socket ของ adb server (utils/adb.py);
+# fork `adb` เฉพาะตอนที่ยังไม่มี server ฟังอยู่ เพื่อให้ adb start server ให้
+adb_client = AdbClient()
+
+def adb_shell(cmd: list[str], *, serial: str | None = None, timeout: float = 3.0) -> str:
+    """Run ``adb shell <cmd>`` in-process and return its text output."""
+    ser = serial or _current_device_serial()
+    if backend is not None:
+        return backend.shell(ser, cmd, timeout)
+    try:
+        return adb_client.shell(ser, cmd, timeout=timeout).decode(errors="ignore")
+    except ConnectionRefusedError:
+        return subprocess.check_output(_adb_cmd(["shell", *cmd], serial=ser),
+                                       text=True, timeout=timeout, errors="ignore")
+
+def adb_exec_out(cmd: list[str], *, serial: str | None = None, timeout: float = 3.0) -> bytes:
+    """Run ``adb exec-out <cmd>`` in-process and return raw stdout bytes."""
+    ser = serial or _current_device_serial()
+    if backend is not None:
+        return backend.exec_out(ser, cmd, timeout)
+    try:
+        return adb_client.exec_out(ser, cmd, timeout=timeout)
+    except ConnectionRefusedError:
+        return subprocess.check_output(_adb_cmd(["exec-out", *cmd], serial=ser), timeout=timeout)
+
+def adb_exec_out_into(cmd: list[str], buf: bytearray, *, serial: str | None = None,
+                      timeout: float = 3.0) -> int:
+    """`adb_exec_out` into a reusable *buf* (no per-call allocation); returns the byte count."""
+    ser = serial or _current_device_serial()
+    if backend is None:
+        try:
+            return adb_client.exec_out_into(ser, cmd, buf, timeout=timeout)
+        except ConnectionRefusedError:
+            pass
+    data = adb_exec_out(cmd, serial=ser, timeout=timeout)
+    if len(buf) < len(data):
+        buf.extend(bytes(len(data) - len(buf)))
+    buf[:len(data)] = data
+    return len(data)
+
+def adb_devices(host: str | None = None, port: str | None = None) -> list[tuple[str, str]]:
+    """Return [(serial, state), …] from the default or the given adb server."""
+    if backend is not None and not (host or port):
+        return backend.devices()
+    client = AdbClient(host, int(port) if port else None) if (host or port) else adb_client
+    try:
+        return client.devices()
+    except ConnectionRefusedError:
+        cmd = [ADB_PATH]
+        if host:
+            cmd += ["-H", host]
+        if port:
+            cmd += ["-P", port]
+        out = subprocess.check_output(cmd + ["devices"], text=True, timeout=3, errors="ignore")
+        return [tuple(line.split()[:2]) for line in out.splitlines()[1:]
+                if len(line.split()) >= 2]
+
+def _adb_connect(addr: str):
+    """`adb connect <addr>` without raising on failure."""
+    try:
+        adb_client.connect_device(addr)
+    except ConnectionRefusedError:
+        subprocess.run([ADB_PATH, "connect", addr], stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+    except Exception:
+        pass
+
+# ───────────── device registry ─────────────
+# ตาราง serial → state จาก `host:track-devices-l` (utils/registry.py);
+# อ่านได้ O(1) และรอ state เปลี่ยนได้โดยไม่ต้อง poll
+registry = DeviceRegistry(adb_client)
+
+def online_devices() -> list[str]:
+    """Serials in ``device`` state; read from the registry when it is live."""
+    if backend is not None:
+        return [ser for ser, state in backend.devices() if state == "device"]
+    if registry.wait_live(0.5):
+        return registry.online()
+    return [ser for ser, state in adb_devices() if state == "device"]
+
 def _pick_first_device_from_adb(host: str | None = None, port: str | None = None) -> str | None:
     """
     query adb server (default หรือ host:port) แล้วคืน serial ตัวแรกที่ state == device.
     """
-    cmd = [ADB_PATH]
-    if host:
-        cmd += ["-H", host]
-    if port:
-        cmd += ["-P", port]
-    cmd += ["devices"]
+    rhost, rport = registry.address
+    if registry.live and (host or rhost) == rhost and int(port or rport) == rport:
+        return registry.first_online()
     try:
-        out = subprocess.check_output(cmd, text=True, timeout=3, errors="ignore")
+        devs = adb_devices(host, port)
     except Exception:
         return None
-
-    for line in out.splitlines()[1:]:
-        line = line.strip()
-        if not line:
-            continue
-        m = re.match(r"^(\S+)\s+device$", line)
-        if m:
-            return m.group(1)
+    for ser, state in devs:
+        if state == "device":
+            return ser
     return None
     
 def ensure_device_online(timeout: int = 30, interval: float = 1.0) -> str | None:
     """Ensure there is a connected device; update DEVICE_SERIAL if found.
 
-    This polls ``adb devices`` (optionally running ``adb connect`` each loop) until
-    a device in the ``device`` state is discovered or the timeout expires.
+    When the device registry is tracking the adb server this is a table
+    lookup, and waiting for a device blocks on the registry's change signal
+    (re-issuing ``adb connect`` every *interval*).  Otherwise it falls back
+    to polling the adb server's device list until a device in the
+    ``device`` state is discovered or the timeout expires.
     Returns the device serial if found, otherwise ``None``.
     """
 
     ser = _current_device_serial()
-    # if not ser:
-    #     return
-    out = ""
-    # try:
-    #     out = subprocess.check_output(
-    #         _adb_cmd(["devices"]), text=True, timeout=3, errors="ignore"
-    #     )
-    #     if ser and re.search(rf"^{re.escape(ser)}\s+device$", out, re.M):
-    #         return ser
-    # except Exception:
-    #     out = ""
+    if backend is not None:
+        online = online_devices()
+        return ser if ser in online else (online[0] if online else None)
+    devs: list[tuple[str, str]] = []
     host = INSTANCE_NAME
     adb_sock = os.getenv("ADB_SERVER_SOCKET")
     deadline = time.time() + timeout
 
+    if registry.wait_live(min(timeout, 1.0)):
+        while True:
+            online = registry.online()
+            if ser and ser in online:
+                return ser
+            if online:
+                os.environ["DEVICE_SERIAL"] = online[0]
+                return online[0]
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            if host and not adb_sock:
+                _adb_connect(f"{host}:{ADB_CONNECT_PORT}")
+            registry.wait_for(lambda: bool(registry.online()) or not registry.live,
+                              min(remaining, interval))
+            if not registry.live:
+                break
+
     while time.time() < deadline:
+        # Always attempt to connect to the emulator if a host is provided and
+        # we're using the local ADB server (containerized setups).
         if host and not adb_sock:
-            subprocess.run(
-                [ADB_PATH, "connect", f"{host}:{ADB_CONNECT_PORT}"],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                check=False,
-            )
-
-    # if host and not adb_sock:
-    
-    # Always attempt to connect to the emulator if a host is provided and we're
-    # using the local ADB server. This supports containerized setups where the
-    # device isn't pre-attached.
-    # if host and not adb_sock:    
-    #     subprocess.run(
-    #         [ADB_PATH, "connect", f"{host}:{ADB_CONNECT_PORT}"],
-    #         stdout=subprocess.DEVNULL,
-    #         stderr=subprocess.DEVNULL,
-    #         check=False,
-    #     )
-    #     time.sleep(1)
-        # try:
-        #     out = subprocess.check_output(
-        #         _adb_cmd(["devices"]), text=True, timeout=3, errors="ignore"
-        #     )
-        #     if ser and re.search(rf"^{re.escape(ser)}\s+device$", out, re.M):
-        #         return ser
-        # except Exception:
-        #     out = ""
+            _adb_connect(f"{host}:{ADB_CONNECT_PORT}")
         try:
-            out = subprocess.check_output(
-                _adb_cmd(["devices"], include_serial=False),
-                text=True,
-                timeout=3,
-                errors="ignore",
-            )
+            devs = adb_devices()
         except Exception:
-            out = ""
+            devs = []
 
-        if ser and re.search(rf"^{re.escape(ser)}\s+device$", out, re.M):
+        online = [s for s, state in devs if state == "device"]
+        if ser and ser in online:
             return ser
 
         # No match for current serial; attempt to pick the first available
-        for line in out.splitlines()[1:]:
-            line = line.strip()
-            if not line:
-                continue
-            m = re.match(r"^(\S+)\s+device$", line)
-            if m:
-                new_ser = m.group(1)
-                os.environ["DEVICE_SERIAL"] = new_ser
-                return new_ser
+        if online:
+            os.environ["DEVICE_SERIAL"] = online[0]
+            return online[0]
 
         time.sleep(interval)
-
-    for line in out.splitlines()[1:]:
-        line = line.strip()
-        if not line:
-            continue
-        m = re.match(r"^(\S+)\s+device$", line)
-        if m:
-            new_ser = m.group(1)
-            os.environ["DEVICE_SERIAL"] = new_ser
-            return new_ser
     return None
 
-def connect(serial: str | None = None):
-    """Return uiautomator2.Device following the priority rules."""
+def _open_device(serial: str | None = None):
+    """Resolve *serial* following the priority rules and open a new handle."""
     ser_env = ensure_device_online()
 
     # 1) honor ADB_SERVER_SOCKET
@@ -253,13 +324,98 @@ def connect(serial: str | None = None):
         except Exception as e:
             raise RuntimeError("Unable to connect to any device") from e
 
+def _default_serial() -> str | None:
+    """Serial that ``serial=None`` means right now, without connecting.
+
+    Same order as `_open_device`: DEVICE_SERIAL if it is online, else the
+    first online device, else ``?serial=``, else DEVICE_SERIAL as is.
+    """
+    if backend is not None:
+        online = [s for s, st in backend.devices() if st == "device"]
+    else:
+        online = registry.online() if registry.live else []
+    ser = _current_device_serial()
+    if ser and ser in online:
+        return ser
+    if online:
+        return online[0]
+    if has_request_context() and request.args.get("serial"):
+        return request.args["serial"]
+    return ser
+
+device_pool = DevicePool(backend.open if backend is not None else _open_device,
+                         resolve=_default_serial)
+
+def _on_device_change(ev: dict):
+    """Drop pooled handles/sockets as soon as a device leaves ``device`` state."""
+    if ev["state"] != "device":
+        device_pool.invalidate(ev["serial"])
+        adb_client.drop(ev["serial"])
+        drop_input_channel(ev["serial"])
+        hierarchy_cache.invalidate(ev["serial"])
+
+registry.subscribe(_on_device_change)
+
+def connect(serial: str | None = None):
+    """Return a pooled uiautomator2.Device; resolves/reconnects only on miss."""
+    return device_pool.get(serial)
+
+def input_channel(serial: str | None = None):
+    """Shared persistent input channel (utils/input.py) for *serial*."""
+    ser = serial or getattr(connect(), "serial", None) or _current_device_serial()
+    if backend is not None:
+        return backend.input_channel(ser)
+    return get_input_channel(ser, adb_client)
+
+# ───────────── hierarchy snapshots ─────────────
+# dump ครั้งเดียวใช้ร่วมกันทุก feature; input ที่ส่งผ่าน channel จะ invalidate
+hierarchy_cache = SnapshotCache()
+on_any_input(hierarchy_cache.invalidate)
+
+def _dump(d) -> str:
+    # เวลา dump จริง (cache hit ไม่นับ) เข้า span ของ step ที่กำลังรัน (utils/trace.py)
+    with _trace.part("dump"):
+        return d.dump_hierarchy(compressed=False, pretty=True)
+
+def snapshot(serial: str | None = None, max_age: float | None = None):
+    """Shared parsed hierarchy (utils/hierarchy.py) for *serial*."""
+    d = connect(serial)
+    key = getattr(d, "serial", None) or serial
+    return hierarchy_cache.get(key, lambda: _dump(d), max_age)
+
+# UI-idle (utils/idle.py): ภาพ / hierarchy นิ่งแล้ว → runner ไปต่อได้ก่อนหมดเวลารอ
+ui_idle = IdleDetector(lambda s, age: snapshot(s, max_age=age))
+on_any_input(ui_idle.touch)
+
+# swipe presets: เริ่มและสิ้นสุดในโซนกลาง (30%–70%) ของหน้าจอ
+SWIPES = {
+    'right': (0.3, 0.5, 0.7, 0.5, 0.3),
+    'left':  (0.7, 0.5, 0.3, 0.5, 0.3),
+    'down':  (0.5, 0.4, 0.5, 0.6, 0.3),
+    'up':    (0.5, 0.6, 0.5, 0.4, 0.3),
+}
+
+def swipe_dir(direction: str, serial: str | None = None):
+    """Swipe one of the SWIPES presets through the input channel."""
+    d = connect(serial)
+    with _trace.part("rpc"):
+        w, h = d.window_size()
+    x1, y1, x2, y2, dur = SWIPES.get(direction, SWIPES['left'])
+    input_channel(getattr(d, "serial", None) or serial).swipe(x1*w, y1*h, x2*w, y2*h, dur)
+
 # ───────────── paths ─────────────
 FLOW_DIR = "./flows"
 os.makedirs(FLOW_DIR, exist_ok=True)
+LEDGER_DB = os.getenv("LEDGER_DB", os.path.join(FLOW_DIR, "ledger.sqlite3"))
+EXTRACT_RULES = os.getenv("EXTRACT_RULES", os.path.join(FLOW_DIR, "extract_rules.json"))
+
+# rule สกัดข้อมูล (payment / transactions / ของแอปอื่น) compile ครั้งเดียว
+extractor = Extractor(load_rules(EXTRACT_RULES))
 
 # ─────────── runtime state ───────────
 recording = False       # are we recording
 _last_ts = None         # timestamp of last recorded action
+_rec_ss = None          # streamer held open while recording
 actions = []            # current recorded actions
 prog_log = []           # program log lines
 sched_log = []          # scheduler log lines
@@ -287,19 +443,16 @@ def _adb(cmd: list[str]):
     subprocess.run(_adb_cmd(cmd), check=False)
 
 # ──────────── foreground helper ────────────
-def current_app() -> dict:
+def current_app(serial: str | None = None) -> dict:
     """Return {'package': str, 'activity': str} for foreground app."""
     try:
-        info = connect().app_current() or {}
+        info = connect(serial).app_current() or {}
         if info.get("package"):
             return info
     except Exception as e:
         log(f"current_app u2 fail {e}")
     try:
-        out = subprocess.check_output(
-            _adb_cmd(["shell", "dumpsys", "window", "windows"]),
-            text=True, timeout=2, errors="ignore"
-        )
+        out = adb_shell(["dumpsys", "window", "windows"], serial=serial, timeout=2)
         m = re.search(r"mCurrentFocus.*? (.+?)/(.+?) ", out)
         if m:
             return {"package": m.group(1), "activity": m.group(2)}
@@ -314,102 +467,90 @@ def read_payment_info() -> dict:
     Falls back to empty values when a device is unavailable.
     """
     try:
-        xml = connect().dump_hierarchy(compressed=False, pretty=True)
+        t = snapshot().table
     except Exception as e:  # device might be offline
         log(f"read_payment_info fail {e}")
+        device_pool.invalidate()
         return {'amount': None, 'is_new': False, 'name': ''}
-    
-    root = ET.fromstring(xml)
-    parent_map = {c: p for p in root.iter('node') for c in p}
-    for n in root.iter('node'):
-        txt = (n.get('text') or '').strip()
-        m = re.match(r'^(\+?)(\d+(?:\.\d+)?)$', txt)
-        if m:
-            return {
-                'amount': float(m.group(2)),
-                'is_new': bool(m.group(1)),
-                'name': _extract_name(n, parent_map)
-            }
-    return {'amount': None, 'is_new': False, 'name': ''}
-
-def _extract_name(node, parent_map):
-    parent = parent_map.get(node)
-    if parent:
-        for sib in parent:
-            t = (sib.get('text') or '').strip()
-            if t and not re.match(r'^(\+?)(\d+(?:\.\d+)?)$', t):
-                return t
-    return ''
+    return extractor.extract(t, names=('payment',))['payment']
 
 # ───────────── element helpers ─────────────
-def first_info(n: ET.Element) -> bool:
+def first_info(t: NodeTable, n: int) -> bool:
     """Return True if node has identifying info."""
-    return any(n.get(k) for k in ('resource-id','text','content-desc'))
+    return any(t.get(n, k) for k in ('resource-id','text','content-desc'))
 
-def node_at(root: ET.Element, px: int, py: int) -> ET.Element | None:
+def node_at(t: NodeTable, px: int, py: int) -> int | None:
     """Find smallest clickable node containing (px,py)."""
     best, area = None, float('inf')
-    for n in root.iter('node'):
-        if n.get('clickable') != 'true':
-            continue
-        bounds = list(map(int, re.findall(r'\d+', n.get('bounds') or '')))
-        if len(bounds) == 4:
-            l, t, r, b = bounds
-            if l <= px <= r and t <= py <= b:
-                a = (r - l) * (b - t)
+    for n in t.where(CLICKABLE):
+        b = t.rect(n)
+        if b:
+            l, tp, r, bt = b
+            if l <= px <= r and tp <= py <= bt:
+                a = (r - l) * (bt - tp)
                 if a < area:
                     best, area = n, a
     return best
 
 def el_matches(d, a, tol_px: int = 15) -> bool:
-    """Check selector match and bounds proximity."""
-    sel = a.get('sel', {})
-    node = None
-    for key, kw in [('rid','resourceId'),('text','text'),('desc','description')]:
-        v = sel.get(key)
-        if not v:
-            continue
-        try:
-            c = getattr(d, kw)(v)
-            if c.exists:
-                node = c
-                break
-        except Exception:
-            pass
-    if not node or not node.exists:
-        return False
-    if not a.get('bounds'):
-        return True
-    exp = list(map(int, re.findall(r'\d+', a['bounds'])))
-    cur = list(map(int, re.findall(r'\d+', node.info.get('bounds',''))))
-    if len(exp) != 4 or len(cur) != 4:
+    """Check selector match and bounds proximity against the shared snapshot."""
+    sel = compile_selector({**a.get('sel', {}), 'bounds': a.get('bounds') or ''}, tol=tol_px)
+    if not sel:
         return False
-    cx, cy = (exp[0]+exp[2])//2, (exp[1]+exp[3])//2
-    dx, dy = (cur[0]+cur[2])//2, (cur[1]+cur[3])//2
-    return abs(cx-dx) <= tol_px and abs(cy-dy) <= tol_px
+    return sel.find(snapshot(getattr(d, "serial", None)).table) is not None
 
 # ───────────── waiting helpers ─────────────
-def wait_for_el(sel: dict, timeout: float = 10.0, interval: float = 0.5) -> bool:
-    d = connect(); end = time.time() + timeout
-    while time.time() < end:
-        try:
-            if el_matches(d, {'sel': sel}):
-                return True
-        except Exception as e:
-            log(f"wait_for_el fail {e}")
-        time.sleep(interval)
-    return False
-
-def wait_for_text(text: str, timeout: float = 10.0, interval: float = 0.5) -> bool:
-    d = connect(); end = time.time() + timeout
-    while time.time() < end:
-        try:
-            if text in d.dump_hierarchy(compressed=False, pretty=True):
-                return True
-        except Exception as e:
-            log(f"wait_for_text fail {e}")
-        time.sleep(interval)
-    return False
+# รอแบบ event-driven: เช็คจาก snapshot ร่วม แล้วรอ hierarchy_cache.wait_change()
+# (input / snapshot ใหม่ / ภาพเปลี่ยน) ถ้าไม่มีอะไรเกิด backoff ยาวขึ้นทีละเท่า
+WAIT_MIN_INTERVAL = float(os.getenv("WAIT_MIN_INTERVAL", "0.05"))   # first re-check delay (s)
+WAIT_MAX_INTERVAL = float(os.getenv("WAIT_MAX_INTERVAL", "1.0"))    # backoff ceiling (s)
+
+def _streamer(serial: str | None = None):
+    # lazy: utils.screenshot imports this module
+    from .screenshot import get_streamer
+    return get_streamer(serial)
+
+def wait_until(cond, timeout: float = 10.0, interval: float | None = None,
+               serial: str | None = None) -> bool:
+    """Block until ``cond(snapshot)`` holds or *timeout* expires.
+
+    Re-checks immediately whenever the snapshot cache signals a change and
+    otherwise backs off exponentially from WAIT_MIN_INTERVAL up to
+    *interval* (WAIT_MAX_INTERVAL), so idle screens are not re-dumped
+    every half second.  Holds the device's capture loop for the duration
+    (changed frames are one of those signals).
+    """
+    ceiling = WAIT_MAX_INTERVAL if interval is None else interval
+    end = time.time() + timeout
+    delay = WAIT_MIN_INTERVAL
+    d = connect(serial)
+    key = getattr(d, "serial", None) or serial
+    dump = lambda: _dump(d)
+    with _streamer(key).subscribed():
+        while True:
+            try:
+                snap = hierarchy_cache.get(key, dump, WAIT_MIN_INTERVAL)
+                if cond(snap):
+                    return True
+            except Exception as e:
+                log(f"wait fail {e}")
+            ver = hierarchy_cache.version(key)
+            remaining = end - time.time()
+            if remaining <= 0:
+                return False
+            if hierarchy_cache.wait_change(key, ver, min(delay, remaining)):
+                delay = WAIT_MIN_INTERVAL           # something changed → re-check right away
+            else:
+                delay = min(delay * 2, ceiling)
+
+def wait_for_el(sel: dict, timeout: float = 10.0, interval: float | None = None,
+                serial: str | None = None) -> bool:
+    matcher = compile_selector(sel)
+    return wait_until(lambda s: matcher.find(s.table) is not None, timeout, interval, serial)
+
+def wait_for_text(text: str, timeout: float = 10.0, interval: float | None = None,
+                  serial: str | None = None) -> bool:
+    return wait_until(lambda s: text in s.xml, timeout, interval, serial)
 
 def sleep_if_needed():
     global _last_ts
@@ -418,38 +559,39 @@ def sleep_if_needed():
         return
     dt = time.time() - _last_ts
     if dt >= 0.05:
-        actions.append({'op':'wait','sec':round(dt,3)})
+        # think-time ของคนอัด: ตอนรันรอแค่จน UI นิ่ง (sec เป็นเพดาน)
+        actions.append({'op':'wait','sec':round(dt,3),'idle':True})
     _last_ts = time.time()
 
 # ───────────── actions & flows ─────────────
 def get_elements() -> list[dict]:
-    d = connect()
     try:
-        xml = d.dump_hierarchy(compressed=False, pretty=True)
-    except Exception as e:
-        log(f"dump fail {e}")
+        t = snapshot().table
+    except ET.ParseError as e:
+        log(f"parse fail {e}")
         return []
-    try:
-        root = ET.fromstring(xml)
     except Exception as e:
-        log(f"parse fail {e}")
+        log(f"dump fail {e}")
+        device_pool.invalidate()
         return []
-    raw = [(list(map(int, re.findall(r'\d+', n.get('bounds') or ''))), n)
-           for n in root.iter('node') if n.get('clickable') == 'true']
-    keep = [n for i,(b1,n) in enumerate(raw)
-            if not any(i!=j and inside(b1,b2) for j,(b2,_) in enumerate(raw))]
+    raw = [(t.rect(n), n) for n in t.where(CLICKABLE)]
+    raw = [(b, n) for b, n in raw if b]
+    # outermost clickable elements (sweep widest-first; see hierarchy.outermost)
+    keep = [raw[i][1] for i in outermost([b for b, _ in raw])]
     return [{
-        'bounds': n.get('bounds') or '',
-        'rid': n.get('resource-id') or '',
-        'text': n.get('text') or '',
-        'desc': n.get('content-desc') or '',
-        'cls': n.get('class') or ''
+        'bounds': t.get(n, 'bounds') or '',
+        'rid': t.get(n, 'resource-id') or '',
+        'text': t.get(n, 'text') or '',
+        'desc': t.get(n, 'content-desc') or '',
+        'cls': t.get(n, 'class') or ''
     } for n in keep]
 
 def start_record():
-    global recording, _last_ts
+    global recording, _last_ts, _rec_ss
     if not recording:
         recording = True
+        _rec_ss = _streamer()               # recorder watches the screen until stop_record
+        _rec_ss.acquire()
         _last_ts = time.time()
         actions.append({'op':'rec','state':True,'t':ts_now()})
 
@@ -457,6 +599,7 @@ def stop_record():
     global recording
     if recording:
         recording = False
+        _rec_ss.release()                   # the one acquired, even if the default moved
         actions.append({'op':'rec','state':False,'t':ts_now()})
 
 def clear_actions():
@@ -468,18 +611,18 @@ def record_click(args):
     d = connect()
     w, h = d.window_size()
     px, py = int(x * w), int(y * h)
-    d.click(px, py)
+    input_channel(getattr(d, "serial", None)).tap(px, py)
 
     sel = {}
     try:
-        root = ET.fromstring(d.dump_hierarchy(compressed=False, pretty=True))
-        n = node_at(root, px, py)
-        if n:
+        idx = snapshot(getattr(d, "serial", None)).index
+        n = idx.smallest_at(px, py, clickable=True)
+        if n is not None:
             for k in ['resource-id', 'text', 'content-desc']:
-                v = n.get(k)
+                v = idx.table.get(n, k)
                 if v:
                     sel[k.replace('-', '_')] = v
-            sel['bounds'] = n.get('bounds') or ''
+            sel['bounds'] = idx.table.get(n, 'bounds') or ''
     except Exception as e:
         log(f"inspect fail {e}")
 
@@ -498,28 +641,15 @@ def inspect_element(args) -> dict:
     px, py = int(x * w), int(y * h)
     info: dict = {}
     try:
-        xml = d.dump_hierarchy(compressed=False, pretty=True)
-        root = ET.fromstring(xml)
-        n = node_at(root, px, py)
-        if not n:
-            candidates: list[tuple[int, ET.Element]] = []
-            for m in root.iter('node'):
-                nums = re.findall(r"\d+", m.get('bounds') or '')
-                if len(nums) == 4:
-                    l, t, r2, b2 = map(int, nums)
-                    if l <= px <= r2 and t <= py <= b2:
-                        area = (r2 - l) * (b2 - t)
-                        candidates.append((area, m))
-            if candidates:
-                n = min(candidates, key=lambda x: x[0])[1]
-        if n:
-            if not first_info(n):
-                parent_map = {c: p for p in root.iter('node') for c in p}
-                cur = n
-                while (cur := parent_map.get(cur)) and not first_info(cur):
-                    pass
-                n = cur or n
-            info = {k: n.get(k) or '' for k in ['resource-id','text','content-desc','class','bounds']}
+        idx = snapshot(getattr(d, "serial", None)).index
+        n = idx.smallest_at(px, py, clickable=True)
+        if n is None:
+            n = idx.smallest_at(px, py)
+        if n is not None:
+            if not first_info(idx.table, n):
+                a = idx.identifiable_ancestor(n)
+                n = n if a is None else a
+            info = idx.table.info(n, ['resource-id','text','content-desc','class','bounds'])
     except Exception as e:
         log(f"inspect fail {e}")
     return info
@@ -531,40 +661,23 @@ def inspect_element_raw(args) -> dict:
     px, py = int(x * w), int(y * h)
     info = {}
     try:
-        xml = d.dump_hierarchy(compressed=False, pretty=True)
-        root = ET.fromstring(xml)
-        candidates = []
-        for n in root.iter('node'):
-            nums = re.findall(r'\d+', n.get('bounds') or '')
-            if len(nums)==4:
-                l, t, r2, b2 = map(int, nums)
-                if l <= px <= r2 and t <= py <= b2:
-                    area = (r2-l)*(b2-t)
-                    candidates.append((area, n))
-        if candidates:
-            n = min(candidates, key=lambda x: x[0])[1]
-            if not first_info(n):
-                parent_map = {c:p for p in root.iter('node') for c in p}
-                cur = n
-                while (cur := parent_map.get(cur)) and not first_info(cur):
-                    pass
-                n = cur or n
-            info = {k: n.get(k) or '' for k in ('resource-id','text','content-desc','class','bounds')}
+        idx = snapshot(getattr(d, "serial", None)).index
+        n = idx.smallest_at(px, py)
+        if n is not None:
+            if not first_info(idx.table, n):
+                a = idx.identifiable_ancestor(n)
+                n = n if a is None else a
+            info = idx.table.info(n, ('resource-id','text','content-desc','class','bounds'))
     except Exception as e:
         log(f"inspect_raw fail {e}")
     return info
 
 def record_key(args):
     key = args.get('key', 'home')
-    codes = {
-        'home': '3',
-        'back': '4',
-        'recent': '187',
-        'volume_up': '24',
-        'volume_down': '25',
-        'power': '26'
-    }
-    subprocess.run(_adb_cmd(['shell','input','keyevent', codes.get(key, key)]), check=False)
+    try:
+        input_channel().key(key)
+    except Exception as e:
+        log(f"key {key} fail {e}")
     if recording:
         sleep_if_needed()
         actions.append({'op':'key','key':key})
@@ -582,21 +695,14 @@ def record_block(args):
 
 def record_type(args):
     txt = args.get('txt','')
-    connect().shell(f'input text "{txt}"')
+    input_channel().text(txt)
     if recording:
         sleep_if_needed()
         actions.append({'op':'type','text':txt})
 
 def record_swipe(args):
     dir = args.get('dir','left')
-    d = connect()
-    funcs = {
-        'right': (0.3, 0.5, 0.7, 0.5, 0.3),
-        'left':  (0.7, 0.5, 0.3, 0.5, 0.3),
-        'down':  (0.5, 0.4, 0.5, 0.6, 0.3),
-        'up':    (0.5, 0.6, 0.5, 0.4, 0.3),
-    }
-    d.swipe(*funcs.get(dir, funcs['left']))
+    swipe_dir(dir)
     if recording:
         sleep_if_needed()
         actions.append({'op':'swipe','dir':dir})
@@ -621,46 +727,21 @@ def load_flow(name: str) -> dict:
         return {'ok':False,'error':'notfound'}
 
 def get_transactions() -> list[dict]:
-    root=ET.fromstring(connect().dump_hierarchy(compressed=False,pretty=True))
-    pm={c:p for p in root.iter('node') for c in p}
-    tx=[]
-    for n in root.iter('node'):
-        t=(n.get('text') or '').strip()
-        if not t.endswith('จ่ายแล้ว'):
-            continue
-        cont=pm.get(n)
-        if not cont:
-            continue
-        texts=[s.get('text') or '' for s in cont]
-        if not any(re.search(r'[\+\-]?\d+(?:\.\d+)?',x) for x in texts):
-            cont=pm.get(cont,cont)
-        tm=''; amt=''
-        for s in cont.iter('node'):
-            s_txt=(s.get('text') or '').strip()
-            if not tm:
-                m=re.search(r'\b(\d{1,2}:\d{2})\b',s_txt)
-                if m: tm=m.group(1)
-            if not amt:
-                m2=re.search(r'([\+\-]?\d+(?:\.\d+)?)',s_txt.replace('฿',''))
-                if m2 and not re.search(r'\b\d{1,2}:\d{2}\b',s_txt):
-                    amt=m2.group(1)
-            if tm and amt:
-                break
-        tx.append({'name':t,'time':tm,'amount':amt,'bounds':cont.get('bounds')or''})
-    return tx
+    return extractor.extract(snapshot().table, names=('transactions',))['transactions']
 
 def get_main_activity(pkg: str) -> tuple[bool,str]:
     try:
-        res=subprocess.check_output(_adb_cmd(['shell','cmd','package','resolve-activity','--brief',pkg]),
-                                    text=True,timeout=2).splitlines()
-        return True,res[-1] if res else ('',)
+        res=adb_shell(['cmd','package','resolve-activity','--brief',pkg],timeout=2).splitlines()
+        # shell: service has no exit status; a resolved activity is "pkg/cls"
+        if res and '/' in res[-1]:
+            return True,res[-1].strip()
     except Exception as e:
         log(f"pkginfo {pkg} fail {e}")
     return False,''
 
 def is_app_running(pkg: str) -> bool:
     try:
-        return bool(subprocess.check_output(_adb_cmd(['shell','pidof',pkg]),text=True).strip())
+        return bool(adb_shell(['pidof',pkg]).strip())
     except Exception:
         return False
 
@@ -673,7 +754,8 @@ def open_app(pkg: str) -> tuple[bool,str]:
         return False,'package not found'
     try:
         d=connect(); d.app_start(pkg,wait=True,stop=True)
-        cur=connect().app_current().get('package')
+        hierarchy_cache.invalidate(getattr(d,'serial',None))
+        cur=d.app_current().get('package')
         return (cur==pkg),'running' if cur==pkg else f'fg={cur}'
     except Exception as e:
         log(f"open {pkg} fail {e}")
@@ -684,7 +766,8 @@ def close_app(pkg: str) -> tuple[bool,str]:
         return False,'no pkg'
     log(f"close {pkg}")
     try:
-        d=connect(); d.app_stop(pkg); time.sleep(0.8)
+        d=connect(); d.app_stop(pkg)
+        hierarchy_cache.invalidate(getattr(d,'serial',None)); time.sleep(0.8)
         cur=current_app().get('package')
         return (cur!=pkg),'stopped' if cur!=pkg else f'fg={cur}'
     except Exception as e:
@@ -696,8 +779,20 @@ def restart_app(pkg: str, mode: str = 'safe') -> tuple[bool,str]:
     if not pkg:
         return False,'no pkg'
     if mode=='force':
-        _adb_cmd(['shell','am','force-stop',pkg])
+        try:
+            adb_shell(['am','force-stop',pkg])
+        except Exception as e:
+            log(f"force-stop {pkg} fail {e}")
     else:
         close_app(pkg)
     time.sleep(0.8)
-    return open_app(pkg)
\ No newline at end of file
+    return open_app(pkg)
+
+# ───────────── change feed ─────────────
+# watcher ต่อ device (utils/watcher.py) แทนการให้ทุกแท็บ poll /transactions, /current_app
+# แถว transaction ที่ watcher เห็นถูกเก็บถาวรใน ledger (utils/ledger.py)
+ledger = Ledger(LEDGER_DB)
+watchers = WatcherHub(lambda ser, emit: HierarchyWatcher(
+    ser, snap=lambda s, age: snapshot(s, max_age=age), rules=extractor.for_package,
+    app=current_app, emit=emit,
+    record=lambda s, pkg, rows: ledger.record(s, pkg, [r for r in rows if r.get('name')])))
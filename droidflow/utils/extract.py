@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Declarative extraction rules over hierarchy snapshots.
+
+เดิมข้อมูลการจ่ายเงิน / รายการ transaction ถูกดึงด้วยฟังก์ชัน Python เขียนมือ
+ต่อแอป และแต่ละฟังก์ชันเดินทั้งต้นเอง  ที่นี่แต่ละ "rule" เป็น JSON (หรือ YAML):
+
+    {
+      "name": "transactions",
+      "packages": ["*"],                 # หรือ ["com.bank.app", …]
+      "many": true,                      # ทุก anchor (false = ตัวแรกตัวเดียว)
+      "anchor": {"attr": "text", "regex": "จ่ายแล้ว$"},
+      "container": {"up": 1, "grow_unless_child": "[\\+\\-]?\\d+"},
+      "fields": {
+        "name":   {"from": "anchor"},
+        "time":   {"from": "scope", "regex": "\\b(\\d{1,2}:\\d{2})\\b"},
+        "amount": {"from": "scope", "regex": "([\\+\\-]?\\d+(?:\\.\\d+)?)",
+                   "remove": "฿", "not": "\\b\\d{1,2}:\\d{2}\\b"},
+        "bounds": {"from": "container", "attr": "bounds"}
+      }
+    }
+
+  • anchor: regex (search) บนค่า attribute ที่ strip แล้ว ของ text /
+    resource-id / content-desc / class
+  • container: ขึ้นไป `up` ชั้นจาก anchor; ถ้าไม่มีลูกตรงไหนตรง
+    `grow_unless_child` ขึ้นอีกหนึ่งชั้น
+  • field "from": anchor | parent | siblings (ลูกของ parent ของ anchor) |
+    container | children (ลูกของ container) | scope (subtree ของ container)
+    ค่า = node แรกที่มีค่า ผ่าน `not` และตรง `regex` (capture group แรกถ้ามี)
+    `remove` ตัดตัวอักษรก่อน regex, `type` = str / int / float / bool, `default`
+rule ถูก compile ครั้งเดียว; rule ทั้งหมดของ package หนึ่งหา anchor ใน
+การเดิน node table รอบเดียว (regex รันบน string ที่ไม่ซ้ำเท่านั้น)
+"""
+
+import json
+import os
+import re
+import threading
+
+from .nodetable import NodeTable
+
+_ATTR_COL = {"text": "text", "resource-id": "rid", "content-desc": "desc", "class": "cls"}
+_RELATIONS = ("anchor", "parent", "siblings", "container", "children", "scope")
+_TYPES = {"str": str, "int": int, "float": float, "bool": bool}
+
+# แทน read_payment_info / get_transactions เดิม (ให้ผลเท่าเดิม)
+BUILTIN_RULES: list[dict] = [
+    {
+        "name": "payment",
+        "packages": ["*"],
+        "anchor": {"attr": "text", "regex": r"^(\+?)(\d+(?:\.\d+)?)$"},
+        "fields": {
+            "amount": {"from": "anchor", "regex": r"^\+?(\d+(?:\.\d+)?)$", "type": "float",
+                       "default": None},
+            "is_new": {"from": "anchor", "regex": r"^(\+?)", "type": "bool", "default": False},
+            "name":   {"from": "siblings", "not": r"^(\+?)(\d+(?:\.\d+)?)$"},
+        },
+    },
+    {
+        "name": "transactions",
+        "packages": ["*"],
+        "many": True,
+        "anchor": {"attr": "text", "regex": r"จ่ายแล้ว$"},
+        "container": {"up": 1, "grow_unless_child": r"[\+\-]?\d+(?:\.\d+)?"},
+        "fields": {
+            "name":   {"from": "anchor"},
+            "time":   {"from": "scope", "regex": r"\b(\d{1,2}:\d{2})\b"},
+            "amount": {"from": "scope", "regex": r"([\+\-]?\d+(?:\.\d+)?)", "remove": "฿",
+                       "not": r"\b\d{1,2}:\d{2}\b"},
+            "bounds": {"from": "container", "attr": "bounds"},
+        },
+    },
+]
+
+
+class RuleError(ValueError):
+    """An extraction rule could not be compiled."""
+
+
+def _regex(spec, where: str):
+    if spec in (None, ""):
+        return None
+    try:
+        return re.compile(spec)
+    except re.error as e:
+        raise RuleError(f"{where}: bad regex {spec!r}: {e}") from e
+
+
+# ───────────── compiled rules ─────────────
+class _Field:
+    __slots__ = ("name", "rel", "attr", "regex", "group", "not_", "remove", "type", "default")
+
+    def __init__(self, rule: str, name: str, spec: dict):
+        where = f"{rule}.{name}"
+        self.name = name
+        self.rel = spec.get("from", "scope")
+        if self.rel not in _RELATIONS:
+            raise RuleError(f"{where}: unknown relation {self.rel!r}")
+        self.attr = spec.get("attr", "text")
+        self.regex = _regex(spec.get("regex"), where)
+        self.group = spec.get("group", 1 if self.regex is not None and self.regex.groups else 0)
+        self.not_ = _regex(spec.get("not"), where)
+        self.remove = spec.get("remove") or ""
+        typ = spec.get("type", "str")
+        if typ not in _TYPES:
+            raise RuleError(f"{where}: unknown type {typ!r}")
+        self.type = _TYPES[typ]
+        self.default = spec.get("default", "" if typ == "str" else None)
+
+    def nodes(self, t: NodeTable, n: int, cont: int):
+        rel = self.rel
+        if rel == "anchor":
+            return (n,)
+        if rel == "container":
+            return (cont,)
+        if rel == "scope":
+            return t.subtree(cont)
+        if rel == "children":
+            return t.children(cont)
+        p = t.parent[n]
+        if rel == "parent":
+            return (p,) if p >= 0 else ()
+        return t.children(p) if p >= 0 else ()          # siblings
+
+    def read(self, t: NodeTable, n: int, cont: int):
+        for s in self.nodes(t, n, cont):
+            txt = (t.get(s, self.attr) or "").strip()
+            if not txt or (self.not_ is not None and self.not_.search(txt)):
+                continue
+            for ch in self.remove:
+                txt = txt.replace(ch, "")
+            if self.regex is None:
+                return self._cast(txt)
+            m = self.regex.search(txt)
+            if m:
+                return self._cast(m.group(self.group) or "")
+        return self.default
+
+    def _cast(self, v: str):
+        if self.type is str:
+            return v
+        if self.type is bool:
+            return bool(v)
+        try:
+            return self.type(v)
+        except ValueError:
+            return self.default
+
+
+class Rule:
+    """One compiled extraction rule."""
+
+    __slots__ = ("name", "packages", "many", "col", "anchor", "up", "grow", "fields")
+
+    def __init__(self, spec: dict):
+        self.name = spec.get("name") or ""
+        if not self.name:
+            raise RuleError(f"rule without a name: {spec!r}")
+        pk = spec.get("packages", ["*"])
+        self.packages = tuple([pk] if isinstance(pk, str) else pk)
+        self.many = bool(spec.get("many"))
+        anchor = spec.get("anchor") or {}
+        attr = anchor.get("attr", "text")
+        if attr not in _ATTR_COL:
+            raise RuleError(f"{self.name}: cannot anchor on {attr!r}")
+        self.col = _ATTR_COL[attr]
+        self.anchor = _regex(anchor.get("regex"), f"{self.name}.anchor")
+        if self.anchor is None:
+            raise RuleError(f"{self.name}: anchor.regex is required")
+        cont = spec.get("container") or {}
+        self.up = int(cont.get("up", 0))
+        self.grow = _regex(cont.get("grow_unless_child"), f"{self.name}.container")
+        self.fields = [_Field(self.name, k, v) for k, v in (spec.get("fields") or {}).items()]
+
+    def applies(self, package: str | None) -> bool:
+        return "*" in self.packages or (package or "") in self.packages
+
+    def container(self, t: NodeTable, n: int) -> int | None:
+        """Row container of anchor *n* (None drops the match)."""
+        c = n
+        for _ in range(self.up):
+            c = t.parent[c]
+            if c < 0:
+                return None
+        if self.grow is not None and t.parent[c] >= 0 and \
+                not any(self.grow.search(t.get(s, "text") or "") for s in t.children(c)):
+            c = t.parent[c]
+        return c
+
+    def row(self, t: NodeTable, n: int, cont: int) -> dict:
+        return {f.name: f.read(t, n, cont) for f in self.fields}
+
+    def empty(self):
+        return [] if self.many else {f.name: f.default for f in self.fields}
+
+
+class RuleSet:
+    """The rules active for one package, scanned together."""
+
+    def __init__(self, rules: list[Rule]):
+        self.rules = rules
+        self.by_name = {r.name: r for r in rules}
+
+    def scan(self, t: NodeTable, names=None) -> dict[str, list[tuple[int, int]]]:
+        """{rule name: [(anchor, container), …]} from one walk of *t*."""
+        rules = [r for r in self.rules if names is None or r.name in names]
+        out: dict[str, list[tuple[int, int]]] = {r.name: [] for r in rules}
+        # (column, string id) → rules anchored on that string
+        wanted: dict[tuple[str, int], list[Rule]] = {}
+        strings = t.strings
+        for r in rules:
+            for sid in range(1, len(strings)):
+                if r.anchor.search(strings[sid].strip()):
+                    wanted.setdefault((r.col, sid), []).append(r)
+        if not wanted:
+            return out
+        arrays = [(c, getattr(t, c)) for c in sorted({c for c, _ in wanted})]
+        get = wanted.get
+        done: set[str] = set()
+        for n in range(len(t)):
+            for c, arr in arrays:
+                hit = get((c, arr[n]))
+                if not hit:
+                    continue
+                for r in hit:
+                    if r.name in done:
+                        continue
+                    cont = r.container(t, n)
+                    if cont is None:
+                        continue
+                    out[r.name].append((n, cont))
+                    if not r.many:
+                        done.add(r.name)
+        return out
+
+    def value(self, t: NodeTable, name: str, hits: list[tuple[int, int]]):
+        """Result of rule *name* from its scanned *hits*."""
+        r = self.by_name[name]
+        if r.many:
+            return [r.row(t, n, c) for n, c in hits]
+        return r.row(t, *hits[0]) if hits else r.empty()
+
+    def extract(self, t: NodeTable, names=None) -> dict:
+        """{rule name: row dict (single) or [row dict, …] (many)}."""
+        return {name: self.value(t, name, hits) for name, hits in self.scan(t, names).items()}
+
+
+class Extractor:
+    """Compiled rule catalogue; hands out a cached RuleSet per package."""
+
+    def __init__(self, specs: list[dict]):
+        self._rules = [Rule(s) for s in specs]
+        self._sets: dict[str | None, RuleSet] = {}
+        self._lock = threading.Lock()
+
+    def for_package(self, package: str | None) -> RuleSet:
+        rs = self._sets.get(package)
+        if rs is None:
+            # a package-specific rule replaces the wildcard rule of the same name
+            chosen: dict[str, Rule] = {}
+            for r in self._rules:
+                if not r.applies(package):
+                    continue
+                if r.name in chosen and "*" in r.packages and "*" not in chosen[r.name].packages:
+                    continue
+                chosen[r.name] = r
+            rs = RuleSet(list(chosen.values()))
+            with self._lock:
+                self._sets[package] = rs
+        return rs
+
+    def extract(self, t: NodeTable, package: str | None = None, names=None) -> dict:
+        """Run the rules for *package* (default: the package of the root node)."""
+        if package is None and len(t):
+            package = t.strings[t.pkg[0]]
+        return self.for_package(package).extract(t, names)
+
+
+def load_rules(path: str | None) -> list[dict]:
+    """Builtin rules plus those in *path* (.json, or .yml/.yaml with PyYAML).
+
+    A file rule with the same name and packages as a builtin replaces it.
+    """
+    specs = list(BUILTIN_RULES)
+    if not path or not os.path.exists(path):
+        return specs
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yml", ".yaml")):
+            try:
+                import yaml
+            except ImportError as e:
+                raise RuleError(f"{path}: PyYAML is required for YAML rules") from e
+            extra = yaml.safe_load(f) or []
+        else:
+            extra = json.load(f)
+    if isinstance(extra, dict):
+        extra = extra.get("rules", [])
+    def key(s: dict) -> tuple:
+        pk = s.get("packages", ["*"])
+        return s.get("name"), tuple(sorted([pk] if isinstance(pk, str) else pk))
+    keys = {key(s) for s in extra}
+    return [s for s in specs if key(s) not in keys] + list(extra)
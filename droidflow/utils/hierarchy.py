@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared UI-hierarchy snapshots.
+
+`dump_hierarchy` ใช้เวลา 0.5–2 s ต่อครั้ง แต่เกือบทุก feature (elements,
+inspect, record, payment, transactions, waits, post-click check) ต่างคน
+ต่าง dump เอง  cache นี้เก็บ snapshot ที่ parse แล้วต่อ serial:
+  • ใช้ร่วมกันได้ภายใน max age สั้น ๆ (HIERARCHY_MAX_AGE)
+  • คำขอที่มาพร้อมกันระหว่าง dump จะรอผลของ dump เดียวกัน (single-flight)
+  • input ใด ๆ ที่ runner / recorder ส่งไปจะ invalidate ทันที
+  • ทุกการเปลี่ยนแปลง (snapshot ใหม่, invalidate, signal จากภาพที่เปลี่ยน)
+    เพิ่ม version และปลุกคนที่รอใน `wait_change()` แทนการ sleep วนถาม
+  • XML ถูก parse เป็น NodeTable (utils/nodetable.py) แทน ElementTree
+"""
+
+import os
+import threading
+import time
+from typing import Callable
+
+from .nodetable import CLICKABLE, HAS_BOUNDS, NodeTable
+
+# ───────────── config ─────────────
+HIERARCHY_MAX_AGE = float(os.getenv("HIERARCHY_MAX_AGE", "0.5"))   # seconds a snapshot is reused
+GRID_CELL         = int(os.getenv("HIERARCHY_GRID_CELL", "96"))     # spatial index bucket size (px)
+
+_INFO_KEYS = ("resource-id", "text", "content-desc")
+
+
+# ───────────── spatial index ─────────────
+class GridIndex:
+    """Uniform grid of rectangles answering "which items contain (x, y)"."""
+
+    __slots__ = ("cell", "_cells")
+
+    def __init__(self, cell: int = GRID_CELL):
+        self.cell = cell
+        self._cells: dict[tuple[int, int], list[int]] = {}
+
+    def insert(self, item: int, l: int, t: int, r: int, b: int):
+        c = self.cell
+        cells = self._cells
+        for cx in range(l // c, r // c + 1):
+            for cy in range(t // c, b // c + 1):
+                lst = cells.get((cx, cy))
+                if lst is None:
+                    cells[(cx, cy)] = [item]
+                else:
+                    lst.append(item)
+
+    def at(self, x: int, y: int) -> list[int]:
+        """Items whose cell range covers (x, y), in insertion order."""
+        return self._cells.get((x // self.cell, y // self.cell), [])
+
+
+class SpatialIndex:
+    """Grid over a snapshot's node table for point lookups.
+
+    Built once per snapshot; point lookups only look at the nodes bucketed
+    in the grid cell under the point instead of walking the whole tree.
+    Nodes are NodeTable indices.
+    """
+
+    def __init__(self, table: NodeTable, cell: int = GRID_CELL):
+        self.table = table
+        self.grid = GridIndex(cell)
+        t = table
+        for i, f in enumerate(t.flags):
+            if f & HAS_BOUNDS:
+                self.grid.insert(i, t.left[i], t.top[i], t.right[i], t.bottom[i])
+
+    def smallest_at(self, px: int, py: int, clickable: bool = False) -> int | None:
+        """Smallest (clickable) node containing (px, py); first in doc order on ties."""
+        t = self.table
+        best, area = -1, float("inf")
+        for i in self.grid.at(px, py):
+            if clickable and not t.flags[i] & CLICKABLE:
+                continue
+            l, t_, r, b = t.left[i], t.top[i], t.right[i], t.bottom[i]
+            if l <= px <= r and t_ <= py <= b:
+                a = (r - l) * (b - t_)
+                if a < area or (a == area and i < best):
+                    best, area = i, a
+        return best if best >= 0 else None
+
+    def identifiable_ancestor(self, i: int) -> int | None:
+        """Nearest ancestor with resource-id/text/content-desc (None if none)."""
+        t = self.table
+        for a in t.ancestors(i):
+            if any(t.get(a, k) for k in _INFO_KEYS):
+                return a
+        return None
+
+
+def outermost(rects: list) -> list[int]:
+    """Indices of rects not inside any *other* rect, in input order.
+
+    Same result as the pairwise filter
+    ``[i for i, a in enumerate(rects) if not any(i != j and inside(a, b) ...)]``
+    (identical rects contain each other, so duplicates drop out) but in
+    roughly O(n log n): a container always has a strictly larger
+    width+height than what it contains, so rects are visited widest-first
+    and each one is only tested against the outermost rects found so far
+    that cover its top-left corner in a grid.
+    """
+    rects = [tuple(r[:4]) for r in rects]
+    if any(r[2] < r[0] or r[3] < r[1] for r in rects):
+        # inverted bounds break the width+height ordering; stay exact
+        return [i for i, a in enumerate(rects)
+                if not any(i != j and a[0] >= b[0] and a[1] >= b[1]
+                           and a[2] <= b[2] and a[3] <= b[3]
+                           for j, b in enumerate(rects))]
+
+    groups: dict[tuple, list[int]] = {}
+    for i, r in enumerate(rects):
+        groups.setdefault(r, []).append(i)
+    order = sorted(groups, key=lambda r: (r[2] - r[0]) + (r[3] - r[1]), reverse=True)
+
+    outer: list[tuple] = []
+    grid = GridIndex(256)
+    keep: list[int] = []
+    for r in order:
+        l, t, rr, b = r
+        if any(o[0] <= l and o[1] <= t and o[2] >= rr and o[3] >= b
+               for o in (outer[k] for k in grid.at(l, t))):
+            continue
+        grid.insert(len(outer), l, t, rr, b)
+        outer.append(r)
+        if len(groups[r]) == 1:
+            keep.append(groups[r][0])
+    keep.sort()
+    return keep
+
+
+class Snapshot:
+    """One parsed dump of a device's UI hierarchy."""
+
+    __slots__ = ("serial", "xml", "table", "ts", "seq", "_index")
+
+    def __init__(self, serial: str | None, xml: str, ts: float, seq: int):
+        self.serial = serial
+        self.xml = xml
+        self.table = NodeTable.parse(xml)
+        self.ts = ts              # when the dump was *started*
+        self.seq = seq            # increases with every stored snapshot
+        self._index = None
+
+    @property
+    def index(self) -> SpatialIndex:
+        """Spatial index over this snapshot, built on first use."""
+        if self._index is None:
+            self._index = SpatialIndex(self.table)
+        return self._index
+
+
+class _Flight:
+    __slots__ = ("started", "done", "snap", "error")
+
+    def __init__(self):
+        self.started = time.time()
+        self.done = threading.Event()
+        self.snap: Snapshot | None = None
+        self.error: BaseException | None = None
+
+
+class SnapshotCache:
+    """Per-serial snapshot cache with single-flight dumps and invalidation."""
+
+    def __init__(self, max_age: float = HIERARCHY_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._snaps: dict[str | None, Snapshot] = {}
+        self._flights: dict[str | None, _Flight] = {}
+        self._gen: dict[str | None, int] = {}
+        self._ver: dict[str | None, int] = {}
+        self._ver_all = 0
+        self._seq = 0
+
+    def peek(self, serial: str | None) -> Snapshot | None:
+        """Latest stored snapshot for *serial* without dumping (may be stale)."""
+        with self._lock:
+            return self._snaps.get(serial)
+
+    def get(self, serial: str | None, dump: Callable[[], str],
+            max_age: float | None = None) -> Snapshot:
+        """Return a snapshot no older than *max_age*, dumping via *dump()* if needed."""
+        max_age = self.max_age if max_age is None else max_age
+        now = time.time()
+        with self._lock:
+            snap = self._snaps.get(serial)
+            if snap and now - snap.ts <= max_age:
+                return snap
+            fl = self._flights.get(serial)
+            leader = fl is None or fl.started < now - max_age
+            if leader:
+                fl = self._flights[serial] = _Flight()
+            gen = self._gen.get(serial, 0)
+
+        if not leader:
+            fl.done.wait()
+            if fl.error:
+                raise fl.error
+            return fl.snap
+
+        try:
+            xml = dump()
+            with self._lock:
+                self._seq += 1
+                seq = self._seq
+            fl.snap = Snapshot(serial, xml, fl.started, seq)
+        except BaseException as e:
+            fl.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(serial) is fl:
+                    del self._flights[serial]
+                # an input arrived while dumping → the result may predate it
+                if fl.snap and self._gen.get(serial, 0) == gen:
+                    self._snaps[serial] = fl.snap
+                    self._bump(serial)
+            fl.done.set()
+        return fl.snap
+
+    def invalidate(self, serial: str | None = None):
+        """Forget the snapshot for *serial* (all serials when None)."""
+        with self._lock:
+            keys = [serial] if serial is not None else list(self._snaps) + list(self._flights)
+            for k in keys:
+                self._snaps.pop(k, None)
+                self._flights.pop(k, None)
+                self._gen[k] = self._gen.get(k, 0) + 1
+            self._bump(serial, everyone=serial is None)
+
+    # ───────────── change signal ─────────────
+    def _bump(self, serial: str | None, everyone: bool = False):
+        # caller holds self._lock
+        if everyone:
+            self._ver_all += 1
+        else:
+            self._ver[serial] = self._ver.get(serial, 0) + 1
+        self._changed.notify_all()
+
+    def _version(self, serial: str | None) -> int:
+        return self._ver.get(serial, 0) + self._ver_all
+
+    def version(self, serial: str | None) -> int:
+        """Counter that moves whenever *serial*'s UI may have changed."""
+        with self._lock:
+            return self._version(serial)
+
+    def signal(self, serial: str | None = None):
+        """Wake waiters because the screen changed (e.g. a new frame), without
+        dropping the cached snapshot.  None signals every serial."""
+        with self._lock:
+            self._bump(serial, everyone=serial is None)
+
+    def wait_change(self, serial: str | None, version: int, timeout: float) -> bool:
+        """Block until ``version(serial)`` moves past *version*; False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self._version(serial) != version, timeout)
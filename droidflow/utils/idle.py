@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI-idle detection per device.
+
+เดิม runner รอด้วย sleep ตายตัว (wait ที่ recorder จับจากจังหวะคน, 0.5 s ก่อน
+post-click check)  detector นี้บอกว่า UI "นิ่ง" แล้วหรือยัง เพื่อไปต่อได้ทันที
+โดยเวลาเดิมเหลือเป็นแค่เพดาน (ceiling):
+  • frame: ถ้า capture loop (utils/screenshot.py) กำลังส่งภาพของ device นั้น
+    นิ่ง = ไม่มีภาพเปลี่ยนนาน IDLE_QUIET (อย่างน้อย 2 รอบ capture)
+  • hierarchy: ถ้าไม่มีภาพ dump ใหม่ (max_age=0) ซ้ำจน XML เหมือนเดิม
+    ต่อเนื่อง IDLE_QUIET; dump สุดท้ายค้างอยู่ใน hierarchy_cache ให้ step ถัดไปใช้
+input ที่เพิ่งส่ง (และจุดเริ่มรอ) นับเป็นการเปลี่ยนแปลง จึงไม่ถือว่านิ่ง
+ก่อนหน้าจอมีเวลาตอบสนอง  frame ของ serial None (DEVICE_SERIAL ไม่ได้ตั้ง)
+ใช้แทน device ใดก็ได้ เหมือน hierarchy_cache.signal  ส่ง `cancel` (Event) มาด้วย
+แล้วการรอจะจบภายใน ~IDLE_POLL หลัง event ถูก set (คืน False)
+`leased=True` (ผู้เรียกเพิ่งเปิด capture_lease) รอภาพแรกไม่เกิน IDLE_FIRST_FRAME
+ก่อนเลือกทาง  ทาง hierarchy จะไม่เริ่ม dump ที่คาดว่าจะเลย ceiling (ดูจากเวลา
+dump ที่ผ่านมา) เวลารอจึงไม่เกินค่า delay เดิม
+"""
+
+import os
+import threading
+import time
+from typing import Callable
+
+# ───────────── config ─────────────
+IDLE_QUIET = float(os.getenv("IDLE_QUIET", "0.3"))   # unchanged this long = settled (s)
+IDLE_POLL = float(os.getenv("IDLE_POLL", "0.05"))    # pause between hierarchy probes (s)
+IDLE_FIRST_FRAME = float(os.getenv("IDLE_FIRST_FRAME", "0.5"))   # max wait for a just-leased capture loop's first frame (s)
+
+
+class _Frames:
+    __slots__ = ("seen", "changed", "period")
+
+    def __init__(self, now: float):
+        self.seen = now           # last capture (changed or not)
+        self.changed = now        # last capture that differed
+        self.period = 0.0         # smoothed time between captures
+
+
+class IdleDetector:
+    """Tell when a device's UI has stopped changing."""
+
+    def __init__(self, snap: Callable):
+        self._snap = snap         # (serial, max_age) -> Snapshot
+        self._cv = threading.Condition()
+        self._frames: dict[str | None, _Frames] = {}
+        self._touched: dict[str | None, float] = {}
+        self._dump_sec: dict[str | None, float] = {}   # smoothed time of one forced dump
+
+    # ───────────── signals ─────────────
+    def frame(self, serial: str | None, changed: bool = True):
+        """Capture listener: one frame of *serial* was grabbed."""
+        now = time.monotonic()
+        with self._cv:
+            f = self._frames.get(serial)
+            if f is None:
+                f = self._frames[serial] = _Frames(now)
+                self._cv.notify_all()     # a capture loop just came up (see `leased`)
+            else:
+                dt = now - f.seen
+                f.period = dt if not f.period else 0.8 * f.period + 0.2 * dt
+                f.seen = now
+            if changed:
+                f.changed = now
+                self._cv.notify_all()
+
+    def touch(self, serial: str | None):
+        """Input listener: the UI is about to change."""
+        with self._cv:
+            self._touched[serial] = time.monotonic()
+            self._cv.notify_all()
+
+    def _stream(self, serial: str | None, now: float) -> _Frames | None:
+        # caller holds self._cv; frames count only while the capture loop is running
+        f = self._frames.get(serial) or self._frames.get(None)
+        if f is None or now - f.seen > max(1.0, 3 * f.period):
+            return None
+        return f
+
+    # ───────────── waiting ─────────────
+    def wait_idle(self, serial: str | None, ceiling: float, quiet: float | None = None,
+                  cancel: threading.Event | None = None, leased: bool = False) -> bool:
+        """Block until *serial*'s UI has been still for *quiet* seconds.
+
+        Returns True as soon as it settles, False once *ceiling* seconds have
+        passed (the old fixed delay) or *cancel* is set.  A ceiling no longer
+        than *quiet* cannot be beaten, so it is simply slept.  *leased*: a
+        capture loop was just started for *serial*; wait for its first frame.
+        """
+        quiet = IDLE_QUIET if quiet is None else quiet
+        if ceiling <= quiet:
+            if ceiling > 0:
+                _nap(cancel, ceiling)
+            return False
+        start = time.monotonic()
+        deadline = start + ceiling
+        with self._cv:
+            live = self._stream(serial, start) is not None
+            if not live and leased:
+                live = self._cv.wait_for(lambda: self._stream(serial, time.monotonic()) is not None,
+                                         min(IDLE_FIRST_FRAME, ceiling - quiet))
+        if live:
+            return self._wait_frames(serial, start, deadline, quiet, cancel)
+        return self._wait_tree(serial, start, deadline, quiet, cancel)
+
+    def _wait_frames(self, serial, start: float, deadline: float, quiet: float, cancel) -> bool:
+        with self._cv:
+            while True:
+                now = time.monotonic()
+                f = self._stream(serial, now)
+                if f is None:                 # capture stopped meanwhile
+                    break
+                need = max(quiet, 2 * f.period)
+                last = max(start, f.changed, self._touched.get(serial, 0.0))
+                if now - last >= need:
+                    return True
+                if now >= deadline or (cancel is not None and cancel.is_set()):
+                    return False
+                wait = min(last + need, deadline) - now
+                # nothing notifies _cv on cancel, so look at it every IDLE_POLL
+                self._cv.wait(wait if cancel is None else min(wait, IDLE_POLL))
+        return self._wait_tree(serial, start, deadline, quiet, cancel)
+
+    def _wait_tree(self, serial, start: float, deadline: float, quiet: float, cancel) -> bool:
+        try:
+            prev = self._probe(serial, deadline)
+            since = start
+            while prev is not None:
+                now = time.monotonic()
+                if now >= deadline:
+                    return False
+                if _nap(cancel, min(IDLE_POLL, deadline - now)):
+                    return False
+                cur = self._probe(serial, deadline)
+                if cur is None:
+                    break
+                now = time.monotonic()
+                if cur != prev or self._touched.get(serial, 0.0) > since:
+                    prev, since = cur, now
+                elif now - since >= quiet:
+                    return True
+        except Exception:
+            pass                      # no hierarchy (device busy/offline)
+        # fall back to the fixed delay
+        rest = deadline - time.monotonic()
+        if rest > 0:
+            _nap(cancel, rest)
+        return False
+
+    def _probe(self, serial, deadline: float) -> int | None:
+        """Hash of a fresh dump; None if one would not finish before *deadline*."""
+        t0 = time.monotonic()
+        est = self._dump_sec.get(serial, 0.0)
+        if t0 + est > deadline:
+            return None
+        h = hash(self._snap(serial, 0).xml)
+        dt = time.monotonic() - t0
+        self._dump_sec[serial] = dt if not est else 0.7 * est + 0.3 * dt
+        return h
+
+
+def _nap(cancel: threading.Event | None, sec: float) -> bool:
+    """Sleep *sec* seconds; True if *cancel* was set meanwhile."""
+    if cancel is None:
+        time.sleep(sec)
+        return False
+    return cancel.wait(sec)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent input channel per device.
+
+เดิม tap/key/text วิ่ง 3 ทาง (u2 HTTP, fork `adb shell input`, `d.shell`) และ
+`input` ต้องเปิด JVM (app_process) ใหม่บนเครื่องทุก event  โมดูลนี้เปิด shell
+ค้างไว้หนึ่งเส้นต่อ device แล้วเขียนคำสั่งลงไปเป็น stream:
+  • touch (tap/swipe/multi-touch) → `sendevent` ตรงไปที่ touchscreen evdev
+    (ไม่มี JVM, ใช้ multitouch protocol B ตามที่ `getevent -pl` บอก)
+  • key / text → `input keyevent` / `input text` บน shell เดิม (ไม่ fork บน host)
+การ dispatch ฝั่ง host เหลือแค่ socket write ครั้งเดียว; ถ้าหา touch device
+ไม่เจอหรือจอหมุนอยู่ จะ fallback เป็น `input tap/swipe` บน shell เดียวกัน
+ทุกคำสั่งตามด้วย `echo` เลขลำดับ แล้ว send() รอจนอ่านเลขนั้นกลับมา (shell รัน
+คำสั่งก่อนหน้าเสร็จแล้ว) ก่อนแจ้ง listener  snapshot ถัดไปจึงไม่ใช่หน้าจอก่อน input
+"""
+
+import os
+import re
+import shlex
+import threading
+import time
+from typing import Callable
+
+from .adb import AdbClient
+from .trace import part
+
+# ───────────── evdev constants ─────────────
+EV_SYN, EV_KEY, EV_ABS = 0, 1, 3
+SYN_REPORT = 0
+BTN_TOUCH = 0x14a
+ABS_MT_SLOT = 0x2f
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+
+# names accepted by u2 `d.press()` / the UI → Android keycodes
+KEYCODES = {
+    "home": 3, "back": 4, "up": 19, "down": 20, "left": 21, "right": 22,
+    "center": 23, "volume_up": 24, "volume_down": 25, "power": 26,
+    "camera": 27, "enter": 66, "delete": 67, "menu": 82, "search": 84,
+    "volume_mute": 164, "recent": 187,
+}
+
+_ORIENT_TTL = 5.0   # seconds to trust the cached display orientation
+INPUT_ACK_TIMEOUT = float(os.getenv("INPUT_ACK_TIMEOUT", "5"))   # max wait for a command to finish (s); 0 = don't wait
+_ACK = re.compile(rb"__dfack(\d+)__")
+
+
+def _parse_touch_device(getevent: str) -> dict | None:
+    """Pick the multi-touch device out of `getevent -pl` output."""
+    for block in getevent.split("add device")[1:]:
+        m = re.search(r"^\s*\d+:\s*(\S+)", block)
+        mx = re.search(r"ABS_MT_POSITION_X\s*:.*?max (\d+)", block)
+        my = re.search(r"ABS_MT_POSITION_Y\s*:.*?max (\d+)", block)
+        if m and mx and my:
+            return {
+                "path": m.group(1),
+                "max_x": int(mx.group(1)),
+                "max_y": int(my.group(1)),
+                "slots": "ABS_MT_SLOT" in block,
+                "btn_touch": "BTN_TOUCH" in block,
+            }
+    return None
+
+
+class InputChannel:
+    """Long-lived shell on one device that accepts a stream of input commands."""
+
+    def __init__(self, serial: str, client: AdbClient):
+        self.serial = serial
+        self._client = client
+        self._sock = None
+        self._lock = threading.Lock()
+        self._touch: dict | None = None
+        self._size: tuple[int, int] | None = None
+        self._orient = (0, 0.0)            # (rotation, checked_at)
+        self._tracking_id = 0
+        self._probed = False
+        self._listeners: list[Callable[[str], None]] = []
+        self._seq = 0                      # last command marker written
+        self._acked = 0                    # last marker read back from the shell
+        self._ack_cv = threading.Condition()
+        self._eof = None                   # socket whose shell has gone away
+
+    # ───────────── connection ─────────────
+    def _drain(self, sock):
+        """Discard shell output, except the markers that acknowledge commands."""
+        tail = b""
+        try:
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                buf = tail + chunk
+                seqs = [int(m.group(1)) for m in _ACK.finditer(buf)]
+                if seqs:
+                    with self._ack_cv:
+                        self._acked = max(self._acked, *seqs)
+                        self._ack_cv.notify_all()
+                tail = buf[-24:]           # a marker split across two reads
+        except OSError:
+            pass
+        with self._ack_cv:                 # shell gone: nobody waits for it any more
+            self._eof = sock
+            self._ack_cv.notify_all()
+
+    def _open(self):
+        sock = self._client.open_service(self.serial, "shell:sh")
+        sock.settimeout(None)
+        threading.Thread(target=self._drain, args=(sock,), daemon=True).start()
+        self._sock = sock
+
+    def _probe(self):
+        """Find the touchscreen and physical size once per channel."""
+        self._probed = True
+        try:
+            out = self._client.shell(self.serial, ["getevent", "-pl"], timeout=3)
+            self._touch = _parse_touch_device(out.decode(errors="ignore"))
+        except Exception:
+            self._touch = None
+        try:
+            out = self._client.shell(self.serial, ["wm", "size"], timeout=3).decode(errors="ignore")
+            m = re.search(r"Physical size:\s*(\d+)x(\d+)", out)
+            if m:
+                self._size = (int(m.group(1)), int(m.group(2)))
+        except Exception:
+            self._size = None
+
+    def send(self, line: str):
+        """Write one shell line and wait until the shell has run it.
+
+        Reopens the shell once if it was closed.  Listeners are notified only
+        after the command's marker comes back (or INPUT_ACK_TIMEOUT).
+        """
+        with self._lock, part("rpc"):
+            self._seq += 1
+            seq = self._seq
+            # printf, not echo: a tty echoing the typed line must not look like the ack
+            data = (line.rstrip("\n") + f"\nprintf '__dfack%s__\\n' {seq}\n").encode()
+            for attempt in (0, 1):
+                try:
+                    if self._sock is None:
+                        self._open()
+                    sock = self._sock
+                    sock.sendall(data)
+                    break
+                except OSError:
+                    self._close()
+                    if attempt:
+                        raise
+            if INPUT_ACK_TIMEOUT > 0:
+                with self._ack_cv:
+                    if not self._ack_cv.wait_for(
+                            lambda: self._acked >= seq or self._eof is sock, INPUT_ACK_TIMEOUT):
+                        self._close()      # shell stuck: next command gets a fresh one
+        for fn in list(self._listeners) + _any_input:
+            fn(self.serial)
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def on_input(self, fn: Callable[[str], None]):
+        """Call ``fn(serial)`` after every command written to the device."""
+        self._listeners.append(fn)
+
+    # ───────────── geometry ─────────────
+    def size(self) -> tuple[int, int] | None:
+        """Physical display size in pixels (natural orientation)."""
+        if not self._probed:
+            self._probe()
+        return self._size
+
+    def _rotation(self) -> int:
+        rot, ts = self._orient
+        if time.time() - ts < _ORIENT_TTL:
+            return rot
+        try:
+            with part("rpc"):
+                out = self._client.shell(
+                    self.serial, "dumpsys input | grep -m1 SurfaceOrientation", timeout=2
+                ).decode(errors="ignore")
+            m = re.search(r"SurfaceOrientation:\s*(\d)", out)
+            rot = int(m.group(1)) if m else 0
+        except Exception:
+            rot = 0
+        self._orient = (rot, time.time())
+        return rot
+
+    def _raw_ok(self) -> bool:
+        if not self._probed:
+            self._probe()
+        return bool(self._touch and self._size) and self._rotation() == 0
+
+    def _axis(self, x: int, y: int) -> tuple[int, int]:
+        w, h = self._size
+        t = self._touch
+        return (int(x * (t["max_x"] + 1) / w), int(y * (t["max_y"] + 1) / h))
+
+    # ───────────── sendevent encoding ─────────────
+    def _ev(self, typ: int, code: int, val: int) -> str:
+        return f"sendevent {self._touch['path']} {typ} {code} {val}"
+
+    def _frame(self, points: dict[int, tuple[int, int] | None]) -> list[str]:
+        """Encode one multi-touch frame: {slot: (x, y) | None (lift)}."""
+        out = []
+        for slot, pt in points.items():
+            if self._touch["slots"]:
+                out.append(self._ev(EV_ABS, ABS_MT_SLOT, slot))
+            if pt is None:
+                out.append(self._ev(EV_ABS, ABS_MT_TRACKING_ID, -1))
+                continue
+            ax, ay = self._axis(*pt)
+            out.append(self._ev(EV_ABS, ABS_MT_POSITION_X, ax))
+            out.append(self._ev(EV_ABS, ABS_MT_POSITION_Y, ay))
+        out.append(self._ev(EV_SYN, SYN_REPORT, 0))
+        return out
+
+    def _down(self, slots: dict[int, tuple[int, int]]) -> list[str]:
+        out = []
+        for slot, pt in slots.items():
+            self._tracking_id = (self._tracking_id + 1) % 0xFFFF
+            if self._touch["slots"]:
+                out.append(self._ev(EV_ABS, ABS_MT_SLOT, slot))
+            out.append(self._ev(EV_ABS, ABS_MT_TRACKING_ID, self._tracking_id))
+        if self._touch["btn_touch"]:
+            out.append(self._ev(EV_KEY, BTN_TOUCH, 1))
+        return out + self._frame(slots)
+
+    def _up(self, slots) -> list[str]:
+        out = self._frame({s: None for s in slots})
+        if self._touch["btn_touch"]:
+            out.insert(-1, self._ev(EV_KEY, BTN_TOUCH, 0))
+        return out
+
+    # ───────────── public API ─────────────
+    def tap(self, x: int, y: int):
+        if not self._raw_ok():
+            return self.send(f"input tap {int(x)} {int(y)}")
+        self.send(";".join(self._down({0: (x, y)}) + self._up([0])))
+
+    def swipe(self, x1: int, y1: int, x2: int, y2: int, duration: float = 0.3):
+        if not self._raw_ok():
+            return self.send(f"input swipe {int(x1)} {int(y1)} {int(x2)} {int(y2)} {int(duration * 1000)}")
+        steps = max(2, int(duration / 0.016))
+        cmds = self._down({0: (x1, y1)})
+        for i in range(1, steps + 1):
+            f = i / steps
+            cmds.append(f"sleep {duration / steps:.3f}")
+            cmds += self._frame({0: (x1 + (x2 - x1) * f, y1 + (y2 - y1) * f)})
+        self.send(";".join(cmds + self._up([0])))
+
+    def multi_touch(self, frames: list[list[tuple[int, int]]], dt: float = 0.016):
+        """Play a gesture: each frame lists one (x, y) per finger."""
+        if not frames or not self._raw_ok() or not self._touch["slots"]:
+            raise RuntimeError("multi-touch needs a slotted touchscreen")
+        first = dict(enumerate(frames[0]))
+        cmds = self._down(first)
+        for fr in frames[1:]:
+            cmds.append(f"sleep {dt:.3f}")
+            cmds += self._frame(dict(enumerate(fr)))
+        self.send(";".join(cmds + self._up(first.keys())))
+
+    def key(self, key: str | int):
+        code = KEYCODES.get(str(key).lower(), key)
+        self.send(f"input keyevent {shlex.quote(str(code))}")
+
+    def text(self, txt: str):
+        self.send(f"input text {shlex.quote(txt.replace(' ', '%s'))}")
+
+
+# ───────────── per-serial registry ─────────────
+_channels: dict[str, InputChannel] = {}
+_channels_lock = threading.Lock()
+_any_input: list[Callable[[str], None]] = []
+
+
+def on_any_input(fn: Callable[[str], None]):
+    """Call ``fn(serial)`` after input is sent on *any* channel."""
+    _any_input.append(fn)
+
+
+def get_input_channel(serial: str, client: AdbClient) -> InputChannel:
+    """Return the shared channel for *serial*, creating it on first use."""
+    with _channels_lock:
+        ch = _channels.get(serial)
+        if ch is None:
+            ch = _channels[serial] = InputChannel(serial, client)
+        return ch
+
+
+def drop_input_channel(serial: str):
+    with _channels_lock:
+        ch = _channels.pop(serial, None)
+    if ch:
+        ch.close()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive per-client stream quality.
+
+เดิมทุก client ของ `/stream` ได้ภาพเดียวกัน (SS_WIDTH × SS_QUALITY) ไม่ว่าลิงก์
+จะเร็วหรือช้า  ที่นี่ capture loop เผยแพร่ `Frame` (ภาพ PIL ขนาดบนสุด) แทน JPEG
+แล้วแต่ละ client เลือกขั้น (rung) ของ ladder = (width, quality, fps):
+  • rung 0 = SS_WIDTH / SS_QUALITY / STREAM_MAX_FPS เดิม ตามด้วย STREAM_LADDER
+  • encode ต่อ (rung, format) ทำครั้งเดียวต่อเฟรมแล้ว cache ใน Frame
+    client ที่อยู่ rung เดียวกันใช้ bytes ชุดเดียวกัน
+  • Adapter วัด backpressure: เวลาที่ server ใช้เขียน part หนึ่งลง socket
+    (generator ถูกเรียกต่อหลังเขียนเสร็จ)  ช้ากว่า STREAM_SLOW × ช่วงเฟรม
+    ติดกัน 2 ครั้ง → ลดขั้น; เร็วต่อเนื่อง STREAM_UPGRADE วินาที → เพิ่มขั้น
+  • `?rung=N` ตรึงขั้น, `?fmt=webp` ส่ง WebP แทน JPEG (Pillow ต้องมี libwebp)
+"""
+
+import io
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from PIL import Image
+
+# ───────────── config ─────────────
+STREAM_LADDER = os.getenv("STREAM_LADDER", "540:60:20,360:50:12,240:40:6")   # width:quality:fps below rung 0
+STREAM_FORMAT = os.getenv("STREAM_FORMAT", "jpeg")          # jpeg | webp (default when ?fmt= is absent)
+STREAM_SLOW = float(os.getenv("STREAM_SLOW", "0.5"))        # write time / frame interval that counts as congested
+STREAM_UPGRADE = float(os.getenv("STREAM_UPGRADE", "5"))    # seconds without congestion before stepping up
+
+MIME = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+class Rung(NamedTuple):
+    width: int
+    quality: int
+    fps: float
+
+
+def parse_ladder(top: Rung, spec: str = STREAM_LADDER) -> list[Rung]:
+    """*top* followed by the narrower rungs of *spec* (``width:quality:fps,…``)."""
+    ladder = [top]
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        w, q, fps = item.split(":")
+        r = Rung(int(w), int(q), float(fps))
+        if r.width < ladder[-1].width:
+            ladder.append(r)
+    return ladder
+
+
+class Frame:
+    """One captured image and its encodes, one per (width, quality, format)."""
+
+    __slots__ = ("img", "_sized", "_enc", "_lock")
+
+    def __init__(self, img: Image.Image):
+        self.img = img
+        self._sized: dict[int, Image.Image] = {img.width: img}
+        self._enc: dict[tuple, bytes] = {}
+        self._lock = threading.Lock()
+
+    def encode(self, rung: Rung, fmt: str = "jpeg") -> bytes:
+        key = (rung.width, rung.quality, fmt)
+        with self._lock:            # clients on the same rung wait for the one encode
+            out = self._enc.get(key)
+            if out is None:
+                out = self._enc[key] = self._encode(rung, fmt)
+            return out
+
+    def _encode(self, rung: Rung, fmt: str) -> bytes:
+        img = self._sized.get(rung.width)
+        if img is None:
+            if self.img.width > rung.width:
+                h = round(self.img.height * rung.width / self.img.width)
+                img = self.img.resize((rung.width, h), Image.BILINEAR)
+            else:
+                img = self.img
+            self._sized[rung.width] = img
+        buf = io.BytesIO()
+        if fmt == "webp":
+            img.save(buf, format="WEBP", quality=rung.quality, method=0)
+        else:
+            img.save(buf, format="JPEG", quality=rung.quality, optimize=True)
+        return buf.getvalue()
+
+
+class Adapter:
+    """Rung choice for one client from how long each part took to write."""
+
+    def __init__(self, ladder: list[Rung], pin: int | None = None):
+        self.ladder = ladder
+        self.pinned = pin is not None
+        self.level = min(max(pin, 0), len(ladder) - 1) if self.pinned else 0
+        self.kbps = 0.0               # smoothed write throughput
+        self._slow = 0
+        self._calm_since = time.monotonic()
+
+    @property
+    def rung(self) -> Rung:
+        return self.ladder[self.level]
+
+    def fps(self) -> float:
+        return self.rung.fps
+
+    def sent(self, nbytes: int, sec: float):
+        """One part of *nbytes* took *sec* to hand to the socket."""
+        now = time.monotonic()
+        if sec > 0:
+            rate = nbytes / sec / 1024
+            self.kbps = rate if not self.kbps else 0.8 * self.kbps + 0.2 * rate
+        if self.pinned:
+            return
+        if sec > STREAM_SLOW / self.rung.fps:
+            self._slow += 1
+            self._calm_since = now
+            if self._slow >= 2 and self.level < len(self.ladder) - 1:
+                self.level += 1
+                self._slow = 0
+        else:
+            self._slow = 0
+            if self.level and now - self._calm_since >= STREAM_UPGRADE:
+                self.level -= 1
+                self._calm_since = now
+
+    def state(self) -> dict:
+        w, q, fps = self.rung
+        return {"rung": self.level, "width": w, "quality": q, "fps": fps,
+                "kbps": round(self.kbps, 1), "pinned": self.pinned}
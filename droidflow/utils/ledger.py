@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent transaction ledger (SQLite).
+
+`/transactions` คืนเฉพาะแถวที่ยังเห็นบนจอ และแถวที่เลื่อนหายไปก็หายไปเลย
+ledger นี้เก็บทุกแถวที่ watcher (utils/watcher.py) เคยเห็นลง SQLite:
+  • key = content fingerprint (package + name + time + amount + ลำดับของแถว
+    ที่เหมือนกันทุกช่อง เช่น โอนชื่อเดียวกัน นาทีเดียวกัน ยอดเท่ากันสองครั้ง)
+  • แถวเดิมที่กลับมาให้เห็นอีก (เลื่อนขึ้นลง, เปิดแอปใหม่) แค่ update last_seen
+  • fingerprint ที่ไม่เคยเห็นภายใน LEDGER_DEDUP_HOURS = transaction ใหม่
+    → `record()` คืนให้ผู้เรียก emit event ได้ครั้งเดียว (แม้ restart server)
+  • query แบบแบ่งหน้า (keyset บน id) ผ่าน `page()`
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# ───────────── config ─────────────
+LEDGER_DEDUP_HOURS = float(os.getenv("LEDGER_DEDUP_HOURS", "20"))   # same fingerprint = same tx within this window
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tx (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    fp          TEXT NOT NULL,
+    serial      TEXT,
+    package     TEXT,
+    name        TEXT,
+    time        TEXT,
+    amount      TEXT,
+    first_seen  REAL NOT NULL,
+    last_seen   REAL NOT NULL,
+    seen_count  INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS tx_fp ON tx (fp, last_seen);
+"""
+
+_COLS = ("id", "fp", "serial", "package", "name", "time", "amount",
+         "first_seen", "last_seen", "seen_count")
+
+
+def occurrence(row: dict) -> int | None:
+    """The watcher's ``-k`` suffix of ``row['id']``: which of several identical rows this is."""
+    _, sep, k = str(row.get("id", "")).rpartition("-")
+    return int(k) if sep and k.isdigit() else None
+
+
+def fingerprint(package: str, row: dict, occ: int = 0) -> str:
+    """Stable content key of one transaction row (position/bounds ignored).
+
+    *occ* tells identical rows apart; the first one keeps the plain content key.
+    """
+    parts = [package or "", row.get("name", ""), row.get("time", ""), str(row.get("amount", ""))]
+    if occ:
+        parts.append(f"#{occ}")
+    return hashlib.sha1("\x1f".join(parts).encode()).hexdigest()
+
+
+class Ledger:
+    """Append-mostly transaction store; one connection guarded by a lock."""
+
+    def __init__(self, path: str, dedup_hours: float = LEDGER_DEDUP_HOURS):
+        self.path = path
+        self.dedup = dedup_hours * 3600
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # caller holds self._lock; the file is only created on first use
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def record(self, serial: str | None, package: str, rows: list[dict]) -> list[dict]:
+        """Store *rows*; return the ones never seen before (each exactly once)."""
+        if not rows:
+            return []
+        now = time.time()
+        new = []
+        batch: dict[str, int] = {}      # content key → identical rows so far (no watcher id)
+        with self._lock:
+            db = self._conn()
+            with db:
+                for row in rows:
+                    occ = occurrence(row)
+                    if occ is None:
+                        base = fingerprint(package, row)
+                        occ = batch[base] = batch.get(base, -1) + 1
+                    fp = fingerprint(package, row, occ)
+                    hit = db.execute(
+                        "SELECT id FROM tx WHERE fp = ? AND last_seen >= ? ORDER BY id DESC LIMIT 1",
+                        (fp, now - self.dedup)).fetchone()
+                    if hit:
+                        db.execute("UPDATE tx SET last_seen = ?, seen_count = seen_count + 1 "
+                                   "WHERE id = ?", (now, hit[0]))
+                        continue
+                    cur = db.execute(
+                        "INSERT INTO tx (fp, serial, package, name, time, amount, first_seen, last_seen) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (fp, serial, package, row.get("name", ""), row.get("time", ""),
+                         str(row.get("amount", "")), now, now))
+                    new.append(dict(row, ledger_id=cur.lastrowid, fp=fp, first_seen=now))
+        return new
+
+    def page(self, limit: int = 50, before: int | None = None,
+             serial: str | None = None, package: str | None = None) -> dict:
+        """Newest-first page: ``{'items': [...], 'next': id | None}``.
+
+        Pass the returned ``next`` as *before* to fetch the following page.
+        """
+        limit = max(1, min(int(limit), 500))
+        where, args = [], []
+        if before is not None:
+            where.append("id < ?"); args.append(int(before))
+        if serial:
+            where.append("serial = ?"); args.append(serial)
+        if package:
+            where.append("package = ?"); args.append(package)
+        sql = f"SELECT {', '.join(_COLS)} FROM tx"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn().execute(sql, (*args, limit + 1)).fetchall()
+        items = [dict(zip(_COLS, r)) for r in rows[:limit]]
+        return {"items": items, "next": items[-1]["id"] if len(rows) > limit else None}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-serial pool of live uiautomator2 handles.
+
+`connect()` เดิมต้อง fork `adb connect` + `adb devices` แล้วสร้าง
+`u2.Device` ใหม่ทุกครั้ง  pool นี้เก็บ handle ที่ยังใช้ได้ไว้ต่อ serial,
+มี health-check thread คอยตรวจทุก TTL และจะ reconnect เฉพาะตอนที่ handle
+เสียเท่านั้น
+"""
+
+import os
+import threading
+import time
+from typing import Callable
+
+# ───────────── config ─────────────
+POOL_TTL      = float(os.getenv("DEVICE_POOL_TTL", "30"))       # seconds a handle is trusted without a check
+POOL_INTERVAL = float(os.getenv("DEVICE_POOL_INTERVAL", "5"))   # health-check thread period
+
+
+class _Entry:
+    __slots__ = ("device", "checked_at", "ok")
+
+    def __init__(self, device):
+        self.device = device
+        self.checked_at = time.time()
+        self.ok = True
+
+
+class DevicePool:
+    """Keep one healthy device handle per serial key.
+
+    ``opener(serial)`` does the expensive resolve + connect and is only
+    called when there is no cached handle or the cached one failed its
+    health check.  ``None`` ("the default device") is first turned into a
+    concrete serial by ``resolve()``, so it shares the entry of that serial
+    and follows DEVICE_SERIAL / the device list when they change.  If it
+    cannot be resolved the handle is cached under the serial it reports,
+    which later unresolved ``None`` calls reuse.
+    """
+
+    def __init__(self, opener: Callable[[str | None], object],
+                 ttl: float = POOL_TTL, interval: float = POOL_INTERVAL,
+                 resolve: Callable[[], str | None] | None = None):
+        self._opener = opener
+        self._resolve = resolve
+        self._default: str | None = None   # last serial None was opened as
+        self._ttl = ttl
+        self._interval = interval
+        self._entries: dict[str | None, _Entry] = {}
+        self._lock = threading.Lock()
+        self._key_locks: dict[str | None, threading.Lock] = {}
+        self._thread_started = False
+
+    # ───────────── health ─────────────
+    @staticmethod
+    def _healthy(device) -> bool:
+        """Cheap liveness probe: one jsonrpc round-trip to the atx agent."""
+        try:
+            device.info
+            return True
+        except Exception:
+            return False
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self._interval)
+            now = time.time()
+            with self._lock:
+                due = [(k, e) for k, e in self._entries.items()
+                       if e.ok and now - e.checked_at >= self._ttl]
+            for key, ent in due:
+                ent.ok = self._healthy(ent.device)
+                ent.checked_at = time.time()
+                if not ent.ok:
+                    self.invalidate(key)
+
+    def _ensure_thread(self):
+        with self._lock:              # concurrent first get() calls start one thread
+            if self._thread_started:
+                return
+            self._thread_started = True
+            threading.Thread(target=self._check_loop, daemon=True).start()
+
+    def _key(self, serial: str | None) -> str | None:
+        if serial is None and self._resolve is not None:
+            try:
+                serial = self._resolve() or None
+            except Exception:
+                serial = None
+        return serial if serial is not None else self._default
+
+    # ───────────── public API ─────────────
+    def get(self, serial: str | None = None):
+        """Return a live handle for *serial*, (re)connecting only if needed."""
+        self._ensure_thread()
+        serial = self._key(serial)
+        with self._lock:
+            ent = self._entries.get(serial)
+            if ent and ent.ok:
+                return ent.device
+            key_lock = self._key_locks.setdefault(serial, threading.Lock())
+        # one connect per key at a time; other callers wait for its result
+        with key_lock:
+            with self._lock:
+                ent = self._entries.get(serial)
+                if ent and ent.ok:
+                    return ent.device
+            device = self._opener(serial)
+            if serial is None:
+                serial = self._default = getattr(device, "serial", None)
+            with self._lock:
+                self._entries[serial] = _Entry(device)
+            return device
+
+    def invalidate(self, serial: str | None = None):
+        """Drop the cached handle(s) for *serial*; next `get()` reconnects.
+
+        Handles cached under other keys that point at the same device are
+        dropped too, so a stale alias does not outlive its serial.
+        """
+        serial = self._key(serial)
+        with self._lock:
+            ent = self._entries.pop(serial, None)
+            real = getattr(ent.device, "serial", None) if ent else serial
+            for k in [k for k, e in self._entries.items()
+                      if real and getattr(e.device, "serial", None) == real]:
+                self._entries.pop(k, None)
+
+    def serials(self) -> list[str]:
+        """Serials that currently have a pooled handle."""
+        with self._lock:
+            return sorted({getattr(e.device, "serial", None) or str(k)
+                           for k, e in self._entries.items()})
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Event-driven device registry.
+
+ถือ socket `host:track-devices-l` ค้างไว้กับ adb server หนึ่งเส้น แล้วเก็บ
+ตาราง serial → {state, transport_id, props} ในหน่วยความจำ  ผู้เรียกอ่านตาราง
+ได้ทันที (ไม่ต้อง fork `adb devices`) หรือรอ state เปลี่ยนผ่าน condition
+variable แทนการ `time.sleep()` วนถาม
+"""
+
+import threading
+import time
+from typing import Callable
+
+from .adb import AdbClient, AdbError
+
+
+def _parse(payload: str) -> dict[str, dict]:
+    """Parse one track-devices(-l) message into {serial: info}."""
+    table: dict[str, dict] = {}
+    for line in payload.splitlines():
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        serial, state = parts[0], parts[1]
+        props = {}
+        for tok in parts[2:]:
+            if ":" in tok:
+                k, v = tok.split(":", 1)
+                props[k] = v
+        table[serial] = {
+            "state": state,
+            "transport_id": props.pop("transport_id", None),
+            "props": props,
+        }
+    return table
+
+
+class DeviceRegistry:
+    """Live serial → state table fed by the adb server's tracking stream."""
+
+    def __init__(self, client: AdbClient, retry: float = 2.0):
+        self._client = client
+        self._retry = retry
+        self._devices: dict[str, dict] = {}
+        self._cond = threading.Condition()
+        self._listeners: list[Callable[[dict], None]] = []
+        self._thread_started = False
+        self.live = False          # True while the tracking socket is connected
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._client.address
+
+    # ───────────── tracking thread ─────────────
+    def _apply(self, table: dict[str, dict]):
+        events = []
+        with self._cond:
+            old = self._devices
+            for ser in old.keys() | table.keys():
+                prev = old.get(ser, {}).get("state")
+                cur = table.get(ser, {}).get("state")
+                if prev != cur:
+                    events.append({"serial": ser, "state": cur, "prev": prev,
+                                   "props": table.get(ser, {}).get("props", {})})
+            self._devices = table
+            self._cond.notify_all()
+        for ev in events:
+            for fn in list(self._listeners):
+                try:
+                    fn(ev)
+                except Exception:
+                    pass
+
+    def _track_loop(self):
+        long = True
+        while True:
+            try:
+                sock = self._client.track_devices(long=long)
+            except AdbError:
+                long = False            # very old servers lack track-devices-l
+                time.sleep(self._retry)
+                continue
+            except OSError:
+                time.sleep(self._retry)
+                continue
+            with self._cond:
+                self.live = True
+                self._cond.notify_all()
+            try:
+                with sock:
+                    while True:
+                        self._apply(_parse(self._client.read_message(sock)))
+            except Exception:
+                pass
+            with self._cond:
+                self.live = False
+            # server went away: every device is gone until we hear otherwise
+            self._apply({})
+            time.sleep(self._retry)
+
+    def start(self):
+        if not self._thread_started:
+            self._thread_started = True
+            threading.Thread(target=self._track_loop, daemon=True).start()
+
+    # ───────────── queries (O(1), no I/O) ─────────────
+    def get(self, serial: str) -> dict | None:
+        with self._cond:
+            info = self._devices.get(serial)
+            return dict(info) if info else None
+
+    def state(self, serial: str) -> str | None:
+        with self._cond:
+            return self._devices.get(serial, {}).get("state")
+
+    def online(self) -> list[str]:
+        """Serials in the ``device`` state."""
+        with self._cond:
+            return [s for s, i in self._devices.items() if i["state"] == "device"]
+
+    def first_online(self) -> str | None:
+        devs = self.online()
+        return devs[0] if devs else None
+
+    def snapshot(self) -> dict[str, dict]:
+        with self._cond:
+            return {s: dict(i) for s, i in self._devices.items()}
+
+    # ───────────── waiting ─────────────
+    def wait_live(self, timeout: float) -> bool:
+        """Start tracking if needed and wait until the stream is connected."""
+        self.start()
+        with self._cond:
+            return self._cond.wait_for(lambda: self.live, timeout)
+
+    def wait_for(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        """Block until *predicate()* holds after some device change."""
+        with self._cond:
+            return self._cond.wait_for(predicate, timeout)
+
+    def wait_online(self, serial: str | None = None, timeout: float = 30.0) -> str | None:
+        """Wait for *serial* (or any device) to reach ``device`` state."""
+        def _pick():
+            if serial:
+                st = self._devices.get(serial, {}).get("state")
+                return serial if st == "device" else None
+            for s, i in self._devices.items():
+                if i["state"] == "device":
+                    return s
+            return None
+
+        with self._cond:
+            self._cond.wait_for(lambda: _pick() is not None, timeout)
+            return _pick()
+
+    # ───────────── events ─────────────
+    def subscribe(self, fn: Callable[[dict], None]):
+        """Call ``fn({'serial','state','prev','props'})`` whenever a device changes."""
+        self._listeners.append(fn)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay backend: deterministic fake devices (DROIDFLOW_BACKEND=replay).
+
+เสิร์ฟ hierarchy XML + PNG จาก fixture แทน emulator เพื่อให้ run_flow,
+recorder, ScreenshotStreamer และ Flask routes รันได้บนเครื่อง Linux เปล่า
+(bench.py, CI):
+  • REPLAY_DIR: `*.xml` เรียงตามชื่อ = หน้าจอ, `<ชื่อเดียวกัน>.png` = ภาพของหน้านั้น
+    (ไม่มี PNG → ภาพสีเรียบขนาดเท่า root bounds; ไม่มี fixture → หน้าจอในตัว)
+  • latency จำลองต่อ RPC: REPLAY_RPC (input / shell / app_*), REPLAY_DUMP,
+    REPLAY_SCREENCAP (วินาที)
+  • REPLAY_ADVANCE=input → input ทุกคำสั่งเลื่อนไปหน้าจอถัดไป (วนรอบ)
+  • input ที่ได้รับเก็บไว้ใน `device.inputs` [(ts, "input tap x y"), …]
+"""
+
+import glob
+import io
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+from PIL import Image
+
+from .backend import DeviceBackend
+from .input import InputChannel, _any_input
+from .nodetable import parse_bounds
+from .trace import part
+
+# ───────────── config ─────────────
+REPLAY_DIR = os.getenv("REPLAY_DIR", "./flows/replay")
+REPLAY_SERIALS = os.getenv("REPLAY_SERIALS", "replay-1")     # comma-separated fake devices
+REPLAY_RPC = float(os.getenv("REPLAY_RPC", "0"))             # latency per input/shell/app call (s)
+REPLAY_DUMP = float(os.getenv("REPLAY_DUMP", "0"))           # latency per hierarchy dump (s)
+REPLAY_SCREENCAP = float(os.getenv("REPLAY_SCREENCAP", "0"))  # latency per screenshot (s)
+REPLAY_ADVANCE = os.getenv("REPLAY_ADVANCE", "none")          # none | input
+REPLAY_KEEP = int(os.getenv("REPLAY_KEEP", "10000"))          # inputs remembered per device
+
+_DEFAULT_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0">'
+    '<node index="0" text="" resource-id="" class="android.widget.FrameLayout" '
+    'package="com.example.replay" content-desc="" clickable="false" bounds="[0,0][1080,1920]">'
+    '<node index="0" text="Replay" resource-id="com.example.replay:id/title" '
+    'class="android.widget.TextView" package="com.example.replay" content-desc="" '
+    'clickable="false" bounds="[48,120][1032,240]"/>'
+    '<node index="1" text="OK" resource-id="com.example.replay:id/ok" '
+    'class="android.widget.Button" package="com.example.replay" content-desc="" '
+    'clickable="true" bounds="[390,1600][690,1760]"/>'
+    '</node></hierarchy>'
+)
+_COLORS = ((32, 33, 36), (48, 63, 159), (0, 121, 107), (230, 81, 0), (94, 53, 177))
+
+
+class Screen:
+    """One fixture: hierarchy XML and the matching PNG."""
+
+    def __init__(self, name: str, xml: str, png: bytes | None = None, color=_COLORS[0]):
+        self.name = name
+        self.xml = xml
+        i = xml.find('bounds="')
+        self.size = (parse_bounds(xml[i + 8:xml.find('"', i + 8)]) or (0, 0, 1080, 1920))[2:]
+        i = xml.find('package="')
+        self.package = xml[i + 9:xml.find('"', i + 9)] if i >= 0 else ""
+        self._png = png
+        self._raw: bytes | None = None
+        self._color = color
+
+    @property
+    def png(self) -> bytes:
+        if self._png is None:
+            buf = io.BytesIO()
+            Image.new("RGB", self.size, self._color).save(buf, format="PNG")
+            self._png = buf.getvalue()
+        return self._png
+
+    @property
+    def raw(self) -> bytes:
+        """`screencap` without -p: 16-byte header (w, h, RGBA_8888, dataspace) + pixels."""
+        if self._raw is None:
+            img = Image.open(io.BytesIO(self.png)).convert("RGBA")
+            self._raw = struct.pack("<IIII", *img.size, 1, 0) + img.tobytes()
+        return self._raw
+
+
+def load_screens(path: str = REPLAY_DIR) -> list[Screen]:
+    """Screens from *path* (``*.xml`` + optional ``*.png``), or the built-in one."""
+    screens = []
+    for i, fx in enumerate(sorted(glob.glob(os.path.join(path, "*.xml")))):
+        stem = os.path.splitext(fx)[0]
+        with open(fx, encoding="utf-8") as f:
+            xml = f.read()
+        png = None
+        if os.path.exists(stem + ".png"):
+            with open(stem + ".png", "rb") as f:
+                png = f.read()
+        screens.append(Screen(os.path.basename(stem), xml, png, _COLORS[i % len(_COLORS)]))
+    return screens or [Screen("default", _DEFAULT_XML)]
+
+
+class ReplayInput(InputChannel):
+    """InputChannel that hands every command line to a ReplayDevice."""
+
+    def __init__(self, device: "ReplayDevice"):
+        super().__init__(device.serial, None)
+        self._device = device
+        self._probed = True       # no touchscreen → tap/swipe go out as `input …` lines
+
+    def send(self, line: str):
+        with part("rpc"):
+            self._device.receive(line)
+        for fn in list(self._listeners) + _any_input:
+            fn(self.serial)
+
+    def close(self):
+        pass
+
+
+class ReplayDevice:
+    """The subset of uiautomator2.Device that DroidFlow uses, served from fixtures."""
+
+    def __init__(self, serial: str, screens: list[Screen], advance: str = REPLAY_ADVANCE):
+        self.serial = serial
+        self.advance = advance
+        self.inputs: deque = deque(maxlen=REPLAY_KEEP)    # (ts, command line)
+        self._lock = threading.Lock()
+        self._screens = screens
+        self._at = 0
+        self.channel = ReplayInput(self)
+
+    # ───────────── screens ─────────────
+    @property
+    def screen(self) -> Screen:
+        return self._screens[self._at]
+
+    def set_screens(self, screens: list[Screen]):
+        with self._lock:
+            self._screens, self._at = screens, 0
+
+    def goto(self, name: str) -> bool:
+        with self._lock:
+            for i, s in enumerate(self._screens):
+                if s.name == name:
+                    self._at = i
+                    return True
+        return False
+
+    def receive(self, line: str):
+        """One input command from the channel."""
+        if REPLAY_RPC:
+            time.sleep(REPLAY_RPC)
+        with self._lock:
+            self.inputs.append((time.time(), line))
+            if self.advance == "input":
+                self._at = (self._at + 1) % len(self._screens)
+
+    # ───────────── uiautomator2 surface ─────────────
+    @property
+    def info(self) -> dict:
+        w, h = self.screen.size
+        return {"productName": "replay", "displayWidth": w, "displayHeight": h}
+
+    def window_size(self) -> tuple[int, int]:
+        if REPLAY_RPC:
+            time.sleep(REPLAY_RPC)
+        return self.screen.size
+
+    def dump_hierarchy(self, compressed: bool = False, pretty: bool = False, **_) -> str:
+        if REPLAY_DUMP:
+            time.sleep(REPLAY_DUMP)
+        return self.screen.xml
+
+    def screencap(self, raw: bool = False) -> bytes:
+        if REPLAY_SCREENCAP:
+            time.sleep(REPLAY_SCREENCAP)
+        return self.screen.raw if raw else self.screen.png
+
+    def screenshot(self, filename: str | None = None, format: str = "pillow"):
+        png = self.screencap()
+        if format == "raw":
+            return png
+        img = Image.open(io.BytesIO(png))
+        if filename:
+            img.save(filename)
+        return img
+
+    def app_current(self) -> dict:
+        if REPLAY_RPC:
+            time.sleep(REPLAY_RPC)
+        return {"package": self.screen.package, "activity": ""}
+
+    def app_start(self, pkg: str, activity: str | None = None, wait: bool = False,
+                  stop: bool = False, **_):
+        self.receive(f"am start {pkg}")
+        with self._lock:
+            for i, s in enumerate(self._screens):
+                if s.package == pkg:
+                    self._at = i
+                    break
+
+    def app_stop(self, pkg: str):
+        self.receive(f"am force-stop {pkg}")
+
+    def press(self, key):
+        self.channel.key(key)
+
+    def click(self, x, y):
+        self.channel.tap(x, y)
+
+
+class ReplayBackend(DeviceBackend):
+    """Fake devices (REPLAY_SERIALS) sharing the screens in REPLAY_DIR."""
+
+    name = "replay"
+
+    def __init__(self, path: str = REPLAY_DIR, serials: str = REPLAY_SERIALS):
+        screens = load_screens(path)
+        self.devices_by_serial = {s: ReplayDevice(s, screens)
+                                  for s in (x.strip() for x in serials.split(",")) if s}
+
+    def device(self, serial: str | None) -> ReplayDevice:
+        if serial is None:
+            return next(iter(self.devices_by_serial.values()))
+        try:
+            return self.devices_by_serial[serial]
+        except KeyError:
+            raise RuntimeError(f"no replay device {serial!r}") from None
+
+    def set_screens(self, screens: list[Screen]):
+        """Swap the fixtures of every device (e.g. synthetic ones from bench.py)."""
+        for dev in self.devices_by_serial.values():
+            dev.set_screens(screens)
+
+    # ───────────── DeviceBackend ─────────────
+    def open(self, serial):
+        return self.device(serial)
+
+    def input_channel(self, serial):
+        return self.device(serial).channel
+
+    def devices(self):
+        return [(s, "device") for s in self.devices_by_serial]
+
+    def shell(self, serial, cmd, timeout=3.0):
+        dev = self.device(serial)
+        if REPLAY_RPC:
+            time.sleep(REPLAY_RPC)
+        cmd = cmd if isinstance(cmd, str) else " ".join(cmd)
+        w, h = dev.screen.size
+        if cmd.startswith("wm size"):
+            return f"Physical size: {w}x{h}\n"
+        if cmd.startswith("pidof "):
+            return "1000\n" if cmd.split()[1] == dev.screen.package else ""
+        if cmd.startswith("cmd package resolve-activity"):
+            pkg = cmd.split()[-1]
+            return f"{pkg}/.MainActivity\n"
+        if cmd.startswith("dumpsys window"):
+            return f"  mCurrentFocus=Window{{0 u0 {dev.screen.package}/.MainActivity}}\n"
+        if cmd.startswith("dumpsys input"):
+            return "SurfaceOrientation: 0\n"
+        if cmd.startswith(("am force-stop", "input ")):
+            dev.receive(cmd)
+        return ""
+
+    def exec_out(self, serial, cmd, timeout=3.0):
+        cmd = cmd if isinstance(cmd, str) else " ".join(cmd)
+        if cmd.startswith("screencap"):
+            return self.device(serial).screencap(raw="-p" not in cmd.split())
+        return self.shell(serial, cmd, timeout).encode()
@@ -4,13 +4,24 @@ import re
 import sys
 import threading
 import time
-import subprocess
 import base64
-from typing import Optional
+import struct
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Optional
 
 from PIL import Image
 import uiautomator2 as u2
 
+try:                    # optional: vectorized downscale for SS_CAPTURE=raw
+    import numpy as np
+except ImportError:     # pragma: no cover
+    np = None
+
+from .broadcast import STREAM_MAX_FPS, FrameBroadcaster
+from .ladder import MIME, STREAM_FORMAT, Adapter, Frame, Rung, parse_ladder
+from .core import _default_serial, adb_exec_out, adb_exec_out_into, adb_shell
+
 # ───────────── config ─────────────
 DEVICE_SERIAL  = os.getenv("DEVICE_SERIAL")
 ADB_PATH       = os.getenv("ADB_PATH", "/opt/android-sdk/platform-tools/adb")
@@ -18,6 +29,15 @@ _SS_INTERVAL   = float(os.getenv("SS_INTERVAL", "0.02"))   # seconds between cap
 # _SS_INTERVAL   = 0.08      # ดึงภาพทุก 0.08 s (≈12 fps) — ไม่อ่าน env แล้ว
 _ENV_W         = os.getenv("SS_WIDTH")                       # raw env value (None / "auto" / int)
 _JPEG_Q        = int(os.getenv("SS_QUALITY", "70"))         # JPEG quality (0‑100)
+# png: `screencap -p` (device PNG-encodes, host decodes) | raw: header + RGBA pixels,
+# no PNG on either side; downscaled by an integer area-average factor (width ≤ SS_WIDTH)
+_SS_CAPTURE    = os.getenv("SS_CAPTURE", "png")
+# capture runs only while someone subscribes (stream client, waiter, recorder)
+# and stops this long after the last one leaves (or the last one-shot screenshot)
+_SS_GRACE      = float(os.getenv("SS_GRACE", "10"))
+
+# raw screencap pixel formats (android PixelFormat) → channel order
+_RAW_FORMATS = {1: "RGBA", 2: "RGBX", 5: "BGRA"}
 
 # Optional verbose debug logging. Enable by setting SS_DEBUG=1.
 _SS_DEBUG = os.getenv("SS_DEBUG", "").lower() not in ("", "0", "false", "no")
@@ -29,21 +49,14 @@ def _dbg(msg: str) -> None:
 
 # ────────────────── helpers ──────────────────
 
-def _adb_cmd(extra: list[str]) -> list[str]:
-    cmd = [ADB_PATH]
-    if DEVICE_SERIAL:
-        cmd += ["-s", DEVICE_SERIAL]
-    return cmd + extra
-
-
-def _detect_screen_width() -> int:
+def _detect_screen_width(serial: Optional[str] = DEVICE_SERIAL) -> int:
     """Best‑effort detect physical screen width in *pixels*.
     1) `adb shell wm size`  ➜  "Physical size: 1080x2340"
     2) `uiautomator2`       ➜  d.window_size()  → (w, h)
     Returns 0 if detection fails (caller decides fallback)."""
     # —— ADB path ——
     try:
-        out = subprocess.check_output(_adb_cmd(["shell", "wm", "size"]), timeout=2, text=True, errors="ignore")
+        out = adb_shell(["wm", "size"], serial=serial, timeout=2)
         m = re.search(r"Physical size:\s*(\d+)x(\d+)", out)
         if m:
             return int(m.group(1))
@@ -51,7 +64,7 @@ def _detect_screen_width() -> int:
         pass
     # —— uiautomator2 path ——
     try:
-        d = u2.connect_usb(DEVICE_SERIAL) if DEVICE_SERIAL else u2.connect()
+        d = u2.connect_usb(serial) if serial else u2.connect()
         w, _ = d.window_size()
         return int(w)
     except Exception:
@@ -72,9 +85,26 @@ elif _ENV_W and _ENV_W.lower() == "auto":     # หรือ SS_WIDTH=auto ก
 
 _dbg(f"screen width detected={_DETECTED_W} target={_TARGET_W}")
 
+_any_frame_change: list[Callable[[Optional[str]], None]] = []
+_any_capture: list[Callable[[Optional[str], bool], None]] = []
+
+
+def on_any_frame_change(fn: Callable[[Optional[str]], None]):
+    """Call ``fn(serial)`` when *any* streamer captures a changed frame."""
+    _any_frame_change.append(fn)
+
+
+def on_any_capture(fn: Callable[[Optional[str], bool], None]):
+    """Call ``fn(serial, changed)`` after every capture of *any* streamer."""
+    _any_capture.append(fn)
+
+
 class ScreenshotStreamer:
     """Capture device screenshots in a background thread and stream them as down‑scaled JPEGs.
 
+    One per device serial (`get_streamer`); the thread runs while `acquire()`
+    references are held and stops `_SS_GRACE` seconds after the last `release()`.
+
     Improvements over the original version:
       •  Auto‑detect device resolution the first time the module is imported.  No need to
          set SS_WIDTH manually.  You can still force a width via env: `SS_WIDTH=360` or
@@ -82,41 +112,123 @@ class ScreenshotStreamer:
       •  Keeps the same down‑scale/JPEG pipeline that reduces latency & bandwidth dramatically.
     """
 
-    def __init__(self):
+    def __init__(self, serial: Optional[str] = DEVICE_SERIAL, grace: float = _SS_GRACE):
+        self.serial = serial
         self._last_jpeg: Optional[bytes] = None   # already processed JPEG
-        self._thread_started = False
+        self._thread: Optional[threading.Thread] = None
         self._lock = threading.Lock()
+        self._refs = 0                             # subscribers holding the loop open
+        self._idle_since = 0.0                     # last release / one-shot use (monotonic)
+        self._grace = grace
+        self._last_digest: Optional[int] = None    # hash of the last raw capture
+        self._frame_listeners = []
+        self._capture_listeners = []
+        self.frames = FrameBroadcaster()           # changed ladder.Frame → /stream clients
+        self.ladder = parse_ladder(Rung(_TARGET_W, _JPEG_Q, STREAM_MAX_FPS))
+        self._adapters: set[Adapter] = set()       # one per connected /stream client
+        self._raw = bytearray()                    # reused raw screencap buffer
+        self._raw_frame: tuple = ()                # (w, h, fmt, header, length) in _raw
+        self._raw_ok = _SS_CAPTURE == "raw"
 
     # ───────────── private helpers ─────────────
     def _grab_png(self) -> bytes:
         """Capture a *raw PNG* screenshot via `adb exec-out screencap` with uiautomator2 fallback."""
-        cmd = _adb_cmd(["exec-out", "screencap", "-p"])
-        _dbg(f"capture via adb: {' '.join(cmd)}")
+        _dbg(f"capture via adb: exec:screencap -p serial={self.serial}")
         try:
-            return subprocess.check_output(cmd, timeout=2)
+            return adb_exec_out(["screencap", "-p"], serial=self.serial, timeout=2)
         except Exception as e:
             _dbg(f"adb screencap failed: {e}; falling back to uiautomator2")
             buf = io.BytesIO()
             try:
-                d = u2.connect_usb(DEVICE_SERIAL) if DEVICE_SERIAL else u2.connect()
+                d = u2.connect_usb(self.serial) if self.serial else u2.connect()
             except Exception as e2:
-                _dbg(f"uiautomator2 connect failed: {e2}; trying adb://{DEVICE_SERIAL}")
+                _dbg(f"uiautomator2 connect failed: {e2}; trying adb://{self.serial}")
                 
-                d = u2.connect(f"adb://{DEVICE_SERIAL}")
+                d = u2.connect(f"adb://{self.serial}")
             d.screenshot().save(buf, format="PNG")
             return buf.getvalue()
 
     def _process(self, png_bytes: bytes) -> bytes:
         """Down‑scale & transcode PNG → JPEG bytes using the global `_TARGET_W`."""
+        return self._jpeg(self._image(png_bytes))
+
+    def _image(self, png_bytes: bytes) -> Image.Image:
+        """PNG → RGB image down‑scaled to `_TARGET_W` (the top rung)."""
         img = Image.open(io.BytesIO(png_bytes)).convert("RGB")
         w, h = img.size
         if _TARGET_W and w > _TARGET_W:
             ratio = _TARGET_W / w
             img = img.resize((int(w * ratio), int(h * ratio)), Image.BILINEAR)
+        return img
+
+    @staticmethod
+    def _jpeg(img) -> bytes:
         out = io.BytesIO()
         img.save(out, format="JPEG", quality=_JPEG_Q, optimize=True)
         return out.getvalue()
 
+    # —— raw framebuffer (SS_CAPTURE=raw) ——
+    def _grab_raw(self) -> int:
+        """`screencap` (no -p) into the reused buffer; returns a digest of the pixels."""
+        n = adb_exec_out_into(["screencap"], self._raw, serial=self.serial, timeout=2)
+        if n < 12:
+            raise ValueError(f"short raw screencap ({n} bytes)")
+        w, h, fmt = struct.unpack_from("<III", self._raw)
+        hdr = n - w * h * 4           # 12 bytes, or 16 with the dataspace field (Android 9+)
+        if hdr not in (12, 16) or fmt not in _RAW_FORMATS:
+            raise ValueError(f"unsupported raw screencap {w}x{h} format={fmt} ({n} bytes)")
+        self._raw_frame = (w, h, fmt, hdr, n)
+        with memoryview(self._raw) as mv:
+            return zlib.crc32(mv[hdr:n])
+
+    def _process_raw(self) -> bytes:
+        """Area-average the last raw frame down to ≤ `_TARGET_W` and JPEG it (one encode)."""
+        return self._jpeg(self._image_raw())
+
+    def _image_raw(self) -> Image.Image:
+        """The last raw frame area-averaged down to ≤ `_TARGET_W`, as an RGB image."""
+        w, h, fmt, hdr, n = self._raw_frame
+        k = -(-w // _TARGET_W) if _TARGET_W and w > _TARGET_W else 1
+        if np is None:
+            img = Image.frombuffer("RGBA", (w, h), bytes(self._raw[hdr:n]), "raw", _RAW_FORMATS[fmt], 0, 1)
+            img = img.convert("RGB")
+            return img.reduce(k) if k > 1 else img
+        # a view on the reused buffer; k×k box sums as k-1 vectorized adds per axis
+        # (much faster than ndarray.sum over strided axes), all 4 channels kept contiguous
+        px = np.frombuffer(self._raw, np.uint8, w * h * 4, hdr)
+        if k > 1:
+            h2, w2 = h // k, w // k
+            acc = np.uint16 if k * k * 255 <= 0xFFFF else np.uint32
+            rows = px[:h2 * k * w * 4].reshape(h2, k, w * 4)
+            s = rows[:, 0].astype(acc)
+            for i in range(1, k):
+                s += rows[:, i]
+            cols = s.reshape(h2, w, 4)[:, :w2 * k].reshape(h2, w2, k, 4)
+            s = cols[:, :, 0].copy()
+            for j in range(1, k):
+                s += cols[:, :, j]
+            s //= k * k
+            px = s.astype(np.uint8)
+        else:
+            px = px.reshape(h, w, 4)
+        rgb = px[..., 2::-1] if _RAW_FORMATS[fmt] == "BGRA" else px[..., :3]
+        img = Image.fromarray(np.ascontiguousarray(rgb))
+        del px, rgb                   # release the buffer export before the next grab
+        return img
+
+    def _capture(self):
+        """One capture → (digest, decode); decode (→ top-rung image) only runs for a changed frame."""
+        if self._raw_ok:
+            try:
+                return self._grab_raw(), self._image_raw
+            except ValueError as e:
+                _dbg(f"raw capture unusable: {e}; switching to PNG")
+                self._raw_ok = False
+            except Exception as e:
+                _dbg(f"raw capture failed: {e}; PNG for this frame")
+        png = self._grab_png()
+        return hash(png), lambda: self._image(png)
+
         # backward‑compat shim for old videostream.py
     def _grab_screenshot(self):
         """Return *raw PNG* bytes (legacy name expected by videostream)."""
@@ -124,42 +236,135 @@ class ScreenshotStreamer:
 
     # ───────────── worker thread ─────────────
     def _screenshot_loop(self):
-        _dbg("screenshot thread started")        
-        while True:
+        _dbg(f"screenshot thread started serial={self.serial}")
+        while self._keep_running():
             try:
-                jpg = self._process(self._grab_png())
+                digest, decode = self._capture()
+                changed = digest != self._last_digest
+                for fn in list(self._capture_listeners) + _any_capture:
+                    fn(self.serial, changed)
+                if not changed:
+                    time.sleep(_SS_INTERVAL)     # screen unchanged: keep the last JPEG
+                    continue
+                self._last_digest = digest
+                frame = Frame(decode())
+                jpg = frame.encode(self.ladder[0])  # /screenshot; rung-0 stream clients share it
                 with self._lock:
                     self._last_jpeg = jpg
+                self.frames.publish(frame)
+                for fn in list(self._frame_listeners) + _any_frame_change:
+                    fn(self.serial)
             except Exception as e:
                 _dbg(f"screenshot loop error: {e}")
             time.sleep(_SS_INTERVAL)
 
+    def _keep_running(self) -> bool:
+        """Loop condition; on exit forget the last frame so a restart is fresh."""
+        with self._lock:
+            if self._refs or time.monotonic() - self._idle_since < self._grace:
+                return True
+            self._thread = None
+            self._last_jpeg = None
+            self._last_digest = None
+        _dbg(f"screenshot thread idle, stopped serial={self.serial}")
+        return False
+
     def _ensure_thread(self):
-        if not self._thread_started:
-            _dbg("starting background capture thread")            
-            threading.Thread(target=self._screenshot_loop, daemon=True).start()
-            self._thread_started = True
+        # caller holds self._lock
+        if self._thread is None:
+            _dbg("starting background capture thread")
+            self._thread = threading.Thread(target=self._screenshot_loop, daemon=True)
+            self._thread.start()
+
+    # ───────────── subscribers ─────────────
+    def acquire(self):
+        """One more consumer: start capturing (if stopped) until it releases."""
+        with self._lock:
+            self._refs += 1
+            self._ensure_thread()
+
+    def release(self):
+        with self._lock:
+            self._refs = max(0, self._refs - 1)
+            if not self._refs:
+                self._idle_since = time.monotonic()
+
+    @contextmanager
+    def subscribed(self):
+        self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @property
+    def running(self) -> bool:
+        with self._lock:
+            return self._thread is not None
 
     # ───────────── public API ─────────────
+    def on_frame_change(self, fn):
+        """Call ``fn(serial)`` whenever a captured frame differs from the last one."""
+        self._frame_listeners.append(fn)
+
+    def on_capture(self, fn):
+        """Call ``fn(serial, changed)`` after every capture, changed or not."""
+        self._capture_listeners.append(fn)
+
     def screenshot_b64(self) -> str:
-        """Return latest screen as Base64‑encoded JPEG."""
-        self._ensure_thread()
+        """Return latest screen as Base64‑encoded JPEG.
+
+        A one-shot read keeps the loop warm for `_SS_GRACE` (UI polling).
+        """
         with self._lock:
-            img = self._last_jpeg or self._process(self._grab_png())
+            self._idle_since = time.monotonic()
+            self._ensure_thread()
+            img = self._last_jpeg
+        if img is None:
+            img = self._process(self._grab_png())
         _dbg(f"screenshot_b64 served {len(img)} bytes")    
         return base64.b64encode(img).decode()
     
-    def screenshot_stream(self):
-        """Yield an MJPEG stream with Content-Length per frame for throughput calculation."""
-        self._ensure_thread()
-        _dbg("screenshot_stream client connected")        
-        boundary_tpl = b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n"
-        while True:
+    def screenshot_stream(self, rung: Optional[int] = None, fmt: Optional[str] = None):
+        """Yield an MJPEG stream with Content-Length per frame for throughput calculation.
+
+        Frames come from the broadcaster: only when the screen changed, paced
+        per client, and a slow client skips straight to the newest frame.
+        Width / quality / fps follow this client's ladder rung (*rung* pins
+        it, otherwise it adapts to write backpressure); *fmt* "webp" sends
+        WebP parts instead of JPEG.
+        """
+        fmt = fmt if fmt in MIME else STREAM_FORMAT
+        adapt = Adapter(self.ladder, rung)
+        _dbg(f"screenshot_stream client connected rung={adapt.level} fmt={fmt}")
+        # each part ends with the next boundary so browsers show a frame as soon as
+        # it arrives, not when the (possibly much later) next frame starts
+        part_tpl = b"Content-Type: " + MIME[fmt].encode() + b"\r\nContent-Length: %d\r\n\r\n"
+        with self.subscribed():              # released when the client disconnects
             with self._lock:
-                img = self._last_jpeg or self._process(self._grab_png())
-            _dbg(f"stream frame {len(img)} bytes")
-            yield boundary_tpl % len(img) + img + b"\r\n"           
-            time.sleep(_SS_INTERVAL)
+                self._adapters.add(adapt)
+            try:
+                yield b"--frame\r\n"
+                for seq, frame in self.frames.frames(adapt.fps):
+                    img = frame.encode(adapt.rung, fmt)
+                    _dbg(f"stream frame #{seq} {len(img)} bytes rung={adapt.level}")
+                    t0 = time.monotonic()
+                    yield part_tpl % len(img) + img + b"\r\n--frame\r\n"
+                    # resumed once the server has written the part: the write time is
+                    # the backpressure of this client's link
+                    adapt.sent(len(img), time.monotonic() - t0)
+                    self.frames.sent(len(img))
+            finally:
+                with self._lock:
+                    self._adapters.discard(adapt)
+
+    def stream_stats(self) -> dict:
+        """Broadcaster counters (clients, frames/bytes sent, frames dropped), capture state
+        and each client's ladder rung."""
+        with self._lock:
+            state = {"capturing": self._thread is not None, "subscribers": self._refs,
+                     "rungs": [a.state() for a in self._adapters]}
+        return {**self.frames.stats(), **state}
     
     # def screenshot_stream(self):
     #     """Yield an MJPEG stream with Content-Length per frame for throughput calculation."""
@@ -181,4 +386,27 @@ class ScreenshotStreamer:
     #         with self._lock:
     #             img = self._last_jpeg or self._process(self._grab_png())
     #         yield boundary + img + b"\r\n"
-    #         time.sleep(_SS_INTERVAL)
\ No newline at end of file
+    #         time.sleep(_SS_INTERVAL)
+
+# ───────────── one capture loop per device ─────────────
+_streamers: dict[Optional[str], ScreenshotStreamer] = {}
+_streamers_lock = threading.Lock()
+
+
+def get_streamer(serial: Optional[str] = None) -> ScreenshotStreamer:
+    """The shared streamer of *serial*, created on first use.
+
+    None means the default device *now* (`core._default_serial`, as the
+    DevicePool resolves it), so it shares the loop of that serial.
+    """
+    serial = serial or _default_serial() or None
+    with _streamers_lock:
+        ss = _streamers.get(serial)
+        if ss is None:
+            ss = _streamers[serial] = ScreenshotStreamer(serial)
+        return ss
+
+
+def capture_lease(serial: Optional[str] = None):
+    """``with capture_lease(serial):`` keeps *serial*'s capture loop running."""
+    return get_streamer(serial).subscribed()
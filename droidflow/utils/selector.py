@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local selector engine over hierarchy snapshots.
+
+เดิม click / assert / wait ลอง `resourceId` → `text` → `description` ทีละ
+u2 RPC แล้วยัง `exists` + `info` อีก  ที่นี่ selector ถูก compile ครั้งเดียว
+(cache ตาม spec) แล้วประเมินกับ NodeTable ของ snapshot ที่ dump แล้ว:
+  • คีย์: rid / text / desc / cls (ตรงตัว), bounds + tol, xpath (XPath-lite)
+  • mode "any": ลองตามลำดับ xpath → rid → text → desc → cls ตัวแรกที่เจอชนะ
+    mode "all": node ต้องตรงทุกคีย์ (เหมือน `d(resourceId=…, text=…)`)
+  • bounds: ถ้ามีหลายตัวเลือก เลือกตัวที่ center ใกล้ที่สุด; ถ้าให้ tol
+    จะตัดตัวที่ห่างเกิน tol px ทิ้ง
+  • `match_many()` ประเมินหลาย selector ในการเดิน node table รอบเดียว
+
+XPath-lite: `/` กับ `//`, node test เป็น `*` หรือ class (เต็มหรือแค่ชื่อท้าย
+เช่น `Button`), `..`, predicate `[@attr='v']`, `[contains(@attr,'v')]`,
+`[starts-with(@attr,'v')]` และ `[n]` (ลำดับที่ n ภายใต้ context เดียวกัน)
+"""
+
+import re
+from functools import lru_cache
+
+from .nodetable import NodeTable, parse_bounds
+
+# spec key (flow steps, recorder rows, u2 kwargs) → canonical key
+_KEYS = {
+    "rid": "rid", "resource_id": "rid", "resource-id": "rid", "resourceId": "rid",
+    "text": "text",
+    "desc": "desc", "content_desc": "desc", "content-desc": "desc", "description": "desc",
+    "cls": "cls", "class": "cls", "className": "cls",
+}
+_PRIORITY = ("xpath", "rid", "text", "desc", "cls")
+_COL = {"rid": "rid", "text": "text", "desc": "desc", "cls": "cls"}
+
+_STEP_RE = re.compile(r"(//?)(\.\.|\*|[\w.$-]+)((?:\[[^\]]*\])*)")
+_PRED_RE = re.compile(
+    r"\[\s*(?:@([\w-]+)\s*=\s*(['\"])(.*?)\2"
+    r"|(contains|starts-with)\(\s*@([\w-]+)\s*,\s*(['\"])(.*?)\6\s*\)"
+    r"|(\d+))\s*\]")
+
+
+class SelectorError(ValueError):
+    """The selector spec (usually an XPath-lite path) could not be compiled."""
+
+
+# ───────────── XPath-lite ─────────────
+class _Step:
+    __slots__ = ("descendant", "test", "preds", "pos")
+
+    def __init__(self, descendant: bool, test: str, preds: list, pos: int | None):
+        self.descendant = descendant
+        self.test = test
+        self.preds = preds          # [(op, attr, value)]
+        self.pos = pos              # 1-based position predicate
+
+    def node_ok(self, t: NodeTable, n: int) -> bool:
+        if self.test not in ("*", "node"):
+            cls = t.get(n, "class") or ""
+            if cls != self.test and not cls.endswith("." + self.test):
+                return False
+        for op, attr, val in self.preds:
+            cur = t.get(n, attr)
+            if cur is None:
+                return False
+            if op == "=" and cur != val:
+                return False
+            if op == "contains" and val not in cur:
+                return False
+            if op == "starts-with" and not cur.startswith(val):
+                return False
+        return True
+
+
+def _compile_xpath(path: str) -> list[_Step]:
+    path = path.strip()
+    steps, at = [], 0
+    while at < len(path):
+        m = _STEP_RE.match(path, at)
+        if not m:
+            raise SelectorError(f"bad xpath at {at}: {path!r}")
+        axis, test, raw = m.groups()
+        preds, pos, p_at = [], None, 0
+        while p_at < len(raw):
+            pm = _PRED_RE.match(raw, p_at)
+            if not pm:
+                raise SelectorError(f"bad predicate {raw[p_at:]!r} in {path!r}")
+            if pm.group(1):
+                preds.append(("=", pm.group(1), pm.group(3)))
+            elif pm.group(4):
+                preds.append((pm.group(4), pm.group(5), pm.group(7)))
+            else:
+                pos = int(pm.group(8))
+            p_at = pm.end()
+        steps.append(_Step(axis == "//", test, preds, pos))
+        at = m.end()
+    if not steps:
+        raise SelectorError(f"empty xpath {path!r}")
+    return steps
+
+
+def _eval_xpath(t: NodeTable, steps: list[_Step]) -> list[int]:
+    ctx = [-1]                      # -1 = document root
+    for st in steps:
+        out: list[int] = []
+        seen: set[int] = set()
+        for c in ctx:
+            if st.test == "..":
+                hits = [t.parent[c]] if c >= 0 and t.parent[c] >= 0 else []
+            else:
+                if st.descendant:
+                    cand = range(len(t)) if c < 0 else range(c + 1, t.end[c])
+                else:
+                    cand = t.children(c)
+                hits = [n for n in cand if st.node_ok(t, n)]
+            if st.pos is not None:
+                hits = hits[st.pos - 1:st.pos]
+            for n in hits:
+                if n not in seen:
+                    seen.add(n)
+                    out.append(n)
+        ctx = sorted(out)
+        if not ctx:
+            break
+    return ctx
+
+
+# ───────────── compiled selectors ─────────────
+class Selector:
+    """Compiled matcher; evaluate with `find()` / `match_many()`."""
+
+    __slots__ = ("mode", "values", "xpath", "bounds", "tol", "center")
+
+    def __init__(self, values: dict[str, str], xpath: list[_Step] | None,
+                 bounds: tuple | None, tol: int | None, mode: str):
+        self.mode = mode
+        self.values = values        # canonical key → exact value
+        self.xpath = xpath
+        self.bounds = bounds
+        self.tol = tol
+        self.center = ((bounds[0] + bounds[2]) // 2, (bounds[1] + bounds[3]) // 2) if bounds else None
+
+    def __bool__(self) -> bool:
+        return bool(self.values or self.xpath)
+
+    def _pick(self, t: NodeTable, cands: list[int]) -> int | None:
+        """Nearest candidate to the expected bounds (first if none given)."""
+        if not cands:
+            return None
+        if self.center is None:
+            return cands[0]
+        cx, cy = self.center
+        best, dist = None, None
+        for n in cands:
+            r = t.rect(n)
+            if r is None:
+                continue
+            dx = abs((r[0] + r[2]) // 2 - cx)
+            dy = abs((r[1] + r[3]) // 2 - cy)
+            if self.tol is not None and (dx > self.tol or dy > self.tol):
+                continue
+            if dist is None or dx + dy < dist:
+                best, dist = n, dx + dy
+        if best is None and self.tol is None:
+            return cands[0]
+        return best
+
+    def _resolve(self, t: NodeTable, hits: dict[str, list[int]]) -> int | None:
+        """Pick the node from per-key candidate lists gathered by match_many."""
+        if self.mode == "all":
+            sets = [set(hits.get(k, ())) for k in self.values]
+            if self.xpath is not None:
+                sets.append(set(_eval_xpath(t, self.xpath)))
+            common = set.intersection(*sets) if sets else set()
+            return self._pick(t, sorted(common))
+        for key in _PRIORITY:
+            if key == "xpath":
+                if self.xpath is None:
+                    continue
+                cands = _eval_xpath(t, self.xpath)
+            elif key in self.values:
+                cands = hits.get(key, [])
+            else:
+                continue
+            n = self._pick(t, cands)
+            if n is not None:
+                return n
+        return None
+
+    def find(self, t: NodeTable) -> int | None:
+        """Matching node index in *t*, or None."""
+        return match_many(t, [self])[0]
+
+
+@lru_cache(maxsize=1024)
+def _compile_cached(items: tuple, mode: str, tol: int | None) -> Selector:
+    spec = dict(items)
+    values: dict[str, str] = {}
+    for k, v in spec.items():
+        if k in _KEYS and v:
+            values.setdefault(_KEYS[k], str(v))
+    xpath = _compile_xpath(spec["xpath"]) if spec.get("xpath") else None
+    bounds = parse_bounds(spec.get("bounds")) if isinstance(spec.get("bounds"), str) else None
+    if spec.get("tol") not in (None, ""):
+        tol = int(spec["tol"])
+    return Selector(values, xpath, bounds, tol, spec.get("mode") or mode)
+
+
+def compile_selector(spec: dict | str, mode: str = "any", tol: int | None = None) -> Selector:
+    """Compile a selector spec (dict of rid/text/desc/cls/bounds/tol/xpath, or
+    an XPath-lite string).  Unknown keys (op, x, y, …) are ignored, so a flow
+    step can be passed as is.  Results are cached per spec."""
+    if isinstance(spec, str):
+        spec = {"xpath": spec}
+    items = tuple(sorted((k, v) for k, v in spec.items()
+                         if isinstance(v, (str, int, float)) and
+                         (k in _KEYS or k in ("xpath", "bounds", "tol", "mode"))))
+    return _compile_cached(items, mode, tol)
+
+
+def match_many(t: NodeTable, selectors: list[Selector]) -> list[int | None]:
+    """Evaluate all *selectors* against one snapshot table.
+
+    Exact-value keys are resolved to interned string ids up front and the
+    table is walked once for all of them; returns one node index (or None)
+    per selector.
+    """
+    # (column, string id) → [(selector no., canonical key)]
+    wanted: dict[tuple[str, int], list[tuple[int, str]]] = {}
+    hits: list[dict[str, list[int]]] = [{} for _ in selectors]
+    for si, sel in enumerate(selectors):
+        for key, val in sel.values.items():
+            sid = t.string_id(val)
+            if sid is not None:
+                wanted.setdefault((_COL[key], sid), []).append((si, key))
+    if wanted:
+        cols = sorted({c for c, _ in wanted})
+        arrays = [(c, getattr(t, c)) for c in cols]
+        get = wanted.get
+        for n in range(len(t)):
+            for c, arr in arrays:
+                lst = get((c, arr[n]))
+                if lst:
+                    for si, key in lst:
+                        hits[si].setdefault(key, []).append(n)
+    return [sel._resolve(t, h) if sel else None for sel, h in zip(selectors, hits)]
+
+
+def locate(t: NodeTable, specs: list, mode: str = "any") -> list[tuple[int, int, int, int] | None]:
+    """Bounds of the node each spec resolves to (None when not found)."""
+    found = match_many(t, [compile_selector(s, mode) for s in specs])
+    return [None if n is None else t.rect(n) for n in found]
+
+
+def center(t: NodeTable, n: int) -> tuple[int, int] | None:
+    r = t.rect(n)
+    return None if r is None else ((r[0] + r[2]) // 2, (r[1] + r[3]) // 2)
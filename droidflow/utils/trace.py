@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-step timing spans for flow runs.
+
+runner เปิด span ต่อ step (dict ใน trace ของ run) ให้ thread ที่รันอยู่
+ส่วนอื่นบันทึกเวลาเข้า span ปัจจุบันของ thread ตัวเองผ่าน `part(kind)`:
+  • dump  — dump hierarchy (utils.core.snapshot)
+  • rpc   — คำสั่งไป device (tap / key / text / swipe / window_size)
+  • sleep — รอ UI นิ่ง / wait / pacing
+  • wait  — wait_el / wait_text / รอผล post-click check
+span เก็บผลรวมต่อชนิด (`dump`, `rpc`, …) และช่วงเวลาย่อย `parts`
+[[kind, at, sec], …] (at นับจากเริ่ม run) → `chrome()` แปลงเป็น
+Chrome trace-event JSON (เปิดใน chrome://tracing หรือ Perfetto)
+งานใน thread อื่น (เช่น post-click check เบื้องหลัง) ไม่มี span จึงไม่ถูกนับ
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+KINDS = ("dump", "rpc", "sleep", "wait")
+
+_local = threading.local()
+
+
+def begin(entry: dict, t0: float):
+    """Make *entry* the current span of this thread (*t0* = run start, epoch s)."""
+    _local.entry = entry
+    _local.t0 = t0
+
+
+def end():
+    _local.entry = None
+
+
+def current() -> dict | None:
+    return getattr(_local, "entry", None)
+
+
+def note(key: str, value):
+    """Attach a value (e.g. click ``path``) to the current span."""
+    e = current()
+    if e is not None:
+        e[key] = value
+
+
+def add(kind: str, start: float, sec: float):
+    """Account *sec* seconds of *kind* that began at *start* (epoch s)."""
+    e = current()
+    if e is None:
+        return
+    e[kind] = round(e.get(kind, 0.0) + sec, 4)
+    e.setdefault("parts", []).append([kind, round(start - _local.t0, 4), round(sec, 4)])
+
+
+@contextmanager
+def part(kind: str):
+    """Time the enclosed block as *kind* in the current span (no-op without one)."""
+    if current() is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        add(kind, start, time.time() - start)
+
+
+# ───────────── export ─────────────
+def chrome(runs: list[dict]) -> dict:
+    """Chrome trace-event JSON for runs given as ``Run.as_dict(trace=True)``.
+
+    One process per run, one thread per device; each step is a complete
+    ("X") event with its dump/rpc/sleep/wait parts nested inside.
+    """
+    events = []
+    for pid, run in enumerate(runs, 1):
+        t0 = run.get("started") or run.get("created") or 0.0
+        tid = run.get("serial") or "default"
+        events.append({"name": "process_name", "ph": "M", "pid": pid,
+                       "args": {"name": f"{run['id']} {run.get('name') or ''}".strip()}})
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": tid}})
+        for e in run.get("trace", ()):
+            args = {k: v for k, v in e.items() if k != "parts"}
+            events.append({"name": e["op"], "cat": "step", "ph": "X", "pid": pid, "tid": tid,
+                           "ts": round((t0 + e["at"]) * 1e6), "dur": round(e.get("sec", 0) * 1e6),
+                           "args": args})
+            for kind, at, sec in e.get("parts", ()):
+                events.append({"name": kind, "cat": kind, "ph": "X", "pid": pid, "tid": tid,
+                               "ts": round((t0 + at) * 1e6), "dur": round(sec * 1e6)})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def slowest(runs: list[dict], limit: int = 20) -> list[dict]:
+    """The *limit* longest steps across *runs* (``Run.as_dict(trace=True)``)."""
+    rows = []
+    for run in runs:
+        for e in run.get("trace", ()):
+            row = {"run": run["id"], "name": run.get("name", ""), "serial": run.get("serial"),
+                   "step": e["step"], "op": e["op"], "sec": e.get("sec", 0.0)}
+            for k in (*KINDS, "path", "verify"):
+                if k in e:
+                    row[k] = e[k]
+            rows.append(row)
+    rows.sort(key=lambda r: r["sec"], reverse=True)
+    return rows[:limit]
@@ -9,6 +9,14 @@ High-performance screen streamer
 3. Screenshot fallback (PNG → JPEG)                 🐢  0.2-0.4 s
 
 หากอุปกรณ์ยังไม่มีไฟล์ server จะ push ให้ครั้งแรกแบบอัตโนมัติ
+
+VIDEO_MODE=h264: ไม่ decode → JPEG บน host แล้ว  access unit ของ scrcpy ถูกส่ง
+ต่อทั้งก้อนให้ browser (socket.io namespace /video → templates/video.html
+ถอดด้วย WebCodecs)  เก็บ GOP ปัจจุบัน (keyframe ล่าสุด + เฟรมตามหลัง) ไว้ให้
+client ที่เข้ามาทีหลังเริ่มได้ทันที; JPEG ถอดเฉพาะตอนมีคนขอ (`video_frame()`)
+
+server (scrcpy/minicap) รันเฉพาะตอนมีผู้ชม: stream client นับ acquire/release
+แล้วหยุด server หลังคนสุดท้ายออกไป SS_GRACE วินาที
 """
 
 import os
@@ -22,7 +30,7 @@ from io import BytesIO
 
 import av
 
-from .screenshot import ScreenshotStreamer
+from .screenshot import _SS_GRACE, get_streamer
 from .core import log as _log, ensure_device_online
 
 # ───────────── config ─────────────
@@ -31,6 +39,8 @@ ADB_PATH      = os.getenv("ADB_PATH", "adb")
 FPS           = int(os.getenv("FPS", "30"))
 BITRATE       = os.getenv("BITRATE_M", "4M")
 SCRCPY_VER    = os.getenv("SCRCPY_SERVER_VER", "1.25")   # เวอร์ชันที่ใช้รันบน device
+VIDEO_MODE    = os.getenv("VIDEO_MODE", "jpeg")          # jpeg: decode → MJPEG | h264: pass-through
+VIDEO_GOP_MAX = int(os.getenv("VIDEO_GOP_MAX", "600"))   # access units kept after a keyframe
 
 # เส้นทางที่ “น่าจะ” มี scrcpy-server.jar ในเครื่อง host
 _LOCAL_CANDIDATES = [
@@ -44,16 +54,118 @@ _LOCAL_CANDIDATES = [
 _DEVICE_JAR_PATH = "/data/local/tmp/scrcpy-server.jar"
 
 
+def _nal_types(au: bytes) -> list[tuple[int, int]]:
+    """[(nal type, payload offset), …] of an Annex-B access unit."""
+    out, i = [], au.find(b"\x00\x00\x01")
+    while i >= 0 and i + 3 < len(au):
+        out.append((au[i + 3] & 0x1F, i + 3))
+        i = au.find(b"\x00\x00\x01", i + 3)
+    return out
+
+
+def _codec_string(au: bytes) -> str:
+    """WebCodecs codec id (avc1.PPCCLL) from the SPS in *au*, "" without one."""
+    for typ, at in _nal_types(au):
+        if typ == 7 and at + 3 < len(au):
+            return "avc1.%02X%02X%02X" % (au[at + 1], au[at + 2], au[at + 3])
+    return ""
+
+
+class H264Relay:
+    """Fan-out of H.264 access units; keeps the current GOP for late joiners."""
+
+    def __init__(self, gop_max: int = VIDEO_GOP_MAX):
+        self._cv = threading.Condition()
+        self._gop: list[bytes] = []    # keyframe AU + the AUs after it
+        self._start = 0                # seq of _gop[0]
+        self._seq = 0
+        self._gop_max = gop_max
+        self.codec = ""
+        self.closed = False            # the source died / was stopped: no more units
+        # on-demand JPEG: one decoder fed only with the AUs it has not seen yet
+        self._dec_lock = threading.Lock()
+        self._dec = None
+        self._dec_next = 0
+        self._jpeg = b""
+        self._jpeg_seq = 0
+
+    def publish(self, au: bytes):
+        key = any(t == 5 for t, _ in _nal_types(au))
+        with self._cv:
+            self._seq += 1
+            if key:
+                self._gop, self._start = [au], self._seq
+                self.codec = _codec_string(au) or self.codec
+            elif self._gop and len(self._gop) < self._gop_max:
+                self._gop.append(au)
+            else:
+                self._gop = []         # no usable GOP: joiners wait for the next keyframe
+            self._cv.notify_all()
+
+    def close(self):
+        """End every client's `units()`; the server behind this relay is gone."""
+        with self._cv:
+            self.closed = True
+            self._cv.notify_all()
+
+    def units(self, alive=lambda: True):
+        """Yield ``(key, au)`` for one client, starting at the last keyframe.
+
+        A client that falls behind the kept GOP resumes at the next keyframe.
+        Returns once the relay is closed.
+        """
+        nxt = None
+        while alive():
+            with self._cv:
+                ready = lambda: self._gop and (nxt is None or self._start + len(self._gop) > nxt)
+                if not self._cv.wait_for(lambda: self.closed or ready(), 1.0):
+                    continue
+                if self.closed:
+                    return
+                if nxt is None or nxt < self._start:
+                    nxt = self._start
+                first, batch = nxt, self._gop[nxt - self._start:]
+                start = self._start
+                nxt = self._start + len(self._gop)
+            for i, au in enumerate(batch):
+                yield first + i == start, au
+
+    def jpeg(self) -> bytes:
+        """Latest frame as JPEG, decoded now (only the AUs since the last call)."""
+        with self._dec_lock:
+            with self._cv:
+                gop, start = list(self._gop), self._start
+            end = start + len(gop)
+            if not gop or self._jpeg_seq == end:
+                return self._jpeg
+            if self._dec is None or not start <= self._dec_next <= end:
+                self._dec, self._dec_next = av.CodecContext.create("h264", "r"), start
+            frame = None
+            for au in gop[self._dec_next - start:]:
+                for frame in self._dec.decode(av.Packet(au)):
+                    pass
+            self._dec_next = end
+            if frame is not None:
+                buf = BytesIO()
+                frame.to_image().save(buf, format="JPEG", quality=70)
+                self._jpeg, self._jpeg_seq = buf.getvalue(), end
+            return self._jpeg
+
+
 class VideoStreamer:
     """scrcpy / minicap-based streaming with automatic fallback."""
 
     _proc = None
     _sock = None
     _lock = threading.Lock()
+    _start_lock = threading.Lock()  # one server start / stop at a time
     _last_jpeg: bytes = b""
+    _kind = ""                      # "scrcpy" | "minicap" while a server runs
+    _refs = 0                       # stream clients holding the server open
+    _idle_timer = None
 
     def __init__(self) -> None:
-        self._fallback = ScreenshotStreamer()
+        self.relay = H264Relay()
         atexit.register(self._cleanup)
 
     # ───────────── adb helper ─────────────
@@ -205,37 +317,104 @@ class VideoStreamer:
         self._sock = None
         self._proc = None
 
+    # ───────────── subscribers ─────────────
+    def acquire(self):
+        with self._lock:
+            self._refs += 1
+            if self._idle_timer:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+
+    def release(self):
+        with self._lock:
+            self._refs = max(0, self._refs - 1)
+            if not self._refs:
+                self._arm_idle()
+
+    def _arm_idle(self):
+        # caller holds self._lock; (re)start the countdown to stopping the server
+        if self._idle_timer:
+            self._idle_timer.cancel()
+        self._idle_timer = threading.Timer(_SS_GRACE, self._idle_stop)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _idle_stop(self):
+        with self._start_lock:
+            with self._lock:
+                if self._refs:
+                    return
+                self._idle_timer = None
+                self._last_jpeg = b""
+            if self._proc:
+                _log("VideoStreamer: no viewers, stopping server")
+            self._cleanup()
+            self.relay.close()
+            self.relay = H264Relay()
+
     def _ensure_server(self) -> bool:
-        # server ยังรันอยู่
-        if self._proc and self._proc.poll() is None:
-            return True
+        # check + start ภายใต้ lock เดียว: client ที่เข้ามาพร้อมกันไม่เปิด server ซ้ำ
+        with self._start_lock:
+            # server ยังรันอยู่
+            if self._proc and self._proc.poll() is None:
+                return True
 
-        self._cleanup()
-        # 1) scrcpy
-        if self._start_scrcpy():
-            _log("VideoStreamer: using scrcpy")
-            return True
-        # 2) minicap
-        if self._start_minicap():
-            _log("VideoStreamer: using minicap")
-            return True
+            self._cleanup()
+            if self.relay.closed:        # the last reader died: start clean
+                self.relay = H264Relay()
+            # 1) scrcpy
+            if self._start_scrcpy():
+                _log("VideoStreamer: using scrcpy")
+                self._kind = "scrcpy"
+                return True
+            # 2) minicap
+            if self._start_minicap():
+                _log("VideoStreamer: using minicap")
+                self._kind = "minicap"
+                return True
 
-        _log("VideoStreamer: fallback to screencap")
-        return False
+            _log("VideoStreamer: fallback to screencap")
+            return False
+
+    def _reader_gone(self, sock, relay=None):
+        """A reader's stream ended: stop its server and tell its clients."""
+        with self._start_lock:
+            if self._sock is sock:       # not a server started since
+                self._cleanup()
+        if relay is not None:
+            relay.close()               # /video clients get "unavailable" → MJPEG
 
 
     # ───────────── stream readers ─────────────
     def _reader_h264(self):
-        """ถอดรหัส H.264 → JPEG เก็บเฟรมล่าสุด"""
+        """ถอดรหัส H.264 → JPEG เก็บเฟรมล่าสุด (h264 mode: ส่งต่อ access unit)"""
+        if VIDEO_MODE == "h264":
+            return self._relay_h264()
+        sock = self._sock
         try:
-            container = av.open(self._sock.makefile('rb'), format='h264')
+            container = av.open(sock.makefile('rb'), format='h264')
             for frame in container.decode(video=0):
                 buf = BytesIO()
                 frame.to_image().save(buf, format='JPEG', quality=40)
                 with self._lock:
                     self._last_jpeg = buf.getvalue()
         except Exception:
-            self._cleanup()
+            self._reader_gone(sock)
+
+    def _relay_h264(self):
+        """แยก byte stream เป็น access unit (parser เท่านั้น ไม่ decode) → relay"""
+        sock, relay = self._sock, self.relay
+        parser = av.CodecContext.create("h264", "r")
+        try:
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                for pkt in parser.parse(chunk):
+                    relay.publish(bytes(pkt))
+        except Exception:
+            pass
+        self._reader_gone(sock, relay)
 
     def _reader_minicap(self):
         """อ่าน stream minicap (JPEG raw)"""
@@ -248,12 +427,12 @@ class VideoStreamer:
                 while len(data) < size:
                     chunk = s.recv(size - len(data))
                     if not chunk:
-                        return
+                        raise ConnectionError("minicap closed")
                     data += chunk
                 with self._lock:
                     self._last_jpeg = data
         except Exception:
-            self._cleanup()
+            self._reader_gone(s)
 
     # ───────────── public API ─────────────
     def jpeg(self) -> bytes:
@@ -261,21 +440,43 @@ class VideoStreamer:
         คืนค่าภาพล่าสุด (JPEG) – พยายามใช้ video backend,
         ถ้าไม่ได้ให้ fallback เป็น screenshot
         """
+        with self._lock:
+            if not self._refs:
+                self._arm_idle()         # one-shot frame: keep the server warm for SS_GRACE
         if self._ensure_server():
+            if VIDEO_MODE == "h264":
+                jpg = self.relay.jpeg()
+                if jpg:
+                    return jpg
             with self._lock:
                 if self._last_jpeg:
                     return self._last_jpeg
         # final fallback
-        return self._fallback._grab_screenshot()
+        return get_streamer(DEVICE_SERIAL)._grab_screenshot()   # shared with /stream, not a 2nd loop
+
+    def h264_units(self, alive=lambda: True):
+        """Access units for one /video client (VIDEO_MODE=h264); empty without scrcpy."""
+        if VIDEO_MODE != "h264":
+            return
+        self.acquire()
+        try:
+            if self._ensure_server() and self._kind == "scrcpy":
+                yield from self.relay.units(alive)
+        finally:
+            self.release()
 
     def mjpeg(self):
         tpl = (b"--frame\r\n"
             b"Content-Type: image/jpeg\r\n"
             b"Content-Length: %d\r\n\r\n")
-        while True:
-            jpg = self.jpeg()
-            yield tpl % len(jpg) + jpg + b"\r\n"
-            time.sleep(1 / max(FPS, 1))
+        self.acquire()
+        try:
+            while True:
+                jpg = self.jpeg()
+                yield tpl % len(jpg) + jpg + b"\r\n"
+                time.sleep(1 / max(FPS, 1))
+        finally:
+            self.release()
 
 
 
@@ -288,4 +489,11 @@ def video_frame() -> bytes:
 
 def video_stream():
     """สตรีม MJPEG ต่อเนื่อง"""
-    return streamer.mjpeg()
\ No newline at end of file
+    return streamer.mjpeg()
+
+def video_units(alive=lambda: True):
+    """H.264 access units ``(key, bytes)`` ตั้งแต่ keyframe ล่าสุด (VIDEO_MODE=h264)"""
+    return streamer.h264_units(alive)
+
+def video_codec() -> str:
+    return streamer.relay.codec
\ No newline at end of file
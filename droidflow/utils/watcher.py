@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server-side hierarchy change feed.
+
+เดิมทุกแท็บของ UI poll `/transactions` (2 s) และ `/current_app` (1.5 s) เอง
+แต่ละ poll = dump/dumpsys หนึ่งครั้ง  watcher นี้มีหนึ่งตัวต่อ device:
+  • อ่าน snapshot ร่วม (hierarchy_cache) ตามรอบ WATCH_INTERVAL
+  • hash โครงสร้างต่อ subtree (class/text/resource-id/content-desc + ลูก)
+    ถ้า hash ของทั้งต้นไม่เปลี่ยน = ไม่มีอะไรเปลี่ยน ไม่ต้องทำอะไรต่อ
+  • rule สกัดข้อมูล (utils/extract.py) ของแอปที่อยู่หน้าจอหา anchor รอบเดียว
+  • แถว transaction ถูกระบุด้วย hash ของ subtree จึง diff ได้เป็น add/remove
+    และ parse (regex) เฉพาะแถวที่ hash ยังไม่เคยเห็น แถวอื่นใช้ผลเดิม
+  • แถวใหม่ถูกส่งให้ `record` (ledger) แถวที่ ledger ไม่เคยเห็นออกเป็น tx_new
+  • ส่งเฉพาะส่วนที่เปลี่ยน (tx / tx_new / fg_app / ค่าของ rule อื่นตามชื่อ
+    เช่น payment) ให้ listener
+ทำงานเฉพาะตอนที่มี UI client เปิดอยู่ (acquire/release นับจำนวน)
+โหลดบน device จึงคงที่ไม่ว่าจะเปิด UI กี่แท็บ
+"""
+
+import os
+import threading
+from typing import Callable
+
+from .extract import RuleSet
+from .nodetable import NodeTable
+
+# ───────────── config ─────────────
+WATCH_INTERVAL = float(os.getenv("WATCH_INTERVAL", "1.0"))   # seconds between snapshot checks
+TX_RULE = "transactions"      # rule diffed row by row (tx / tx_new), others are sent whole
+
+
+def subtree_hashes(t: NodeTable) -> list[int]:
+    """Content hash of every node's subtree (bounds/flags ignored).
+
+    Rows that only moved (scrolling) or changed focus keep their hash, so
+    the diff reports what the user would call a change.
+    """
+    n = len(t)
+    strings = t.strings
+    kids: list[list[int]] = [[] for _ in range(n)]
+    out = [0] * n
+    for i in range(n - 1, -1, -1):
+        k = kids[i]
+        k.reverse()           # children were appended last-to-first
+        h = hash((strings[t.cls[i]], strings[t.text[i]], strings[t.rid[i]],
+                  strings[t.desc[i]], tuple(k)))
+        out[i] = h
+        p = t.parent[i]
+        if p >= 0:
+            kids[p].append(h)
+    return out
+
+
+def tree_hash(t: NodeTable, hashes: list[int]) -> int:
+    return hash(tuple(hashes[i] for i in t.children(-1)))
+
+
+class HierarchyWatcher:
+    """Poll one device's shared snapshot and report what changed."""
+
+    def __init__(self, serial: str | None, *, snap: Callable, rules: Callable[[str], RuleSet],
+                 app: Callable, emit: Callable[[str | None, dict], None],
+                 record: Callable | None = None, interval: float = WATCH_INTERVAL):
+        self.serial = serial
+        self._snap = snap            # (serial, max_age) -> Snapshot
+        self._rules = rules          # package -> RuleSet
+        self._app = app              # serial -> {'package', 'activity'}
+        self._record = record        # (serial, package, [row]) -> [rows new to the ledger]
+        self._emit = emit
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._seq = -1
+        self._root: int | None = None
+        # last state sent to clients
+        self.tx: dict[str, dict] = {}
+        self._parsed: dict[int, dict] = {}     # container subtree hash → parsed row
+        self._rs: RuleSet | None = None
+        self.values: dict[str, object] = {}     # other rules (payment, …) by name
+        self.fg_app: dict | None = None
+
+    # ───────────── lifecycle ─────────────
+    def start(self):
+        if self._thread is not None and self._thread.is_alive() and not self._stop.is_set():
+            return
+        # a thread still finishing after stop() (e.g. mid-dump on a page reload)
+        # keeps its own, already-set event and exits; this one gets a fresh one
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(self._stop,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                self.check()
+            except Exception:
+                pass          # device offline / dump failed: try again next round
+            stop.wait(self.interval)
+
+    # ───────────── diffing ─────────────
+    def state(self) -> dict:
+        """Full current state, for a client that just connected."""
+        with self._lock:
+            st = {"tx_init": list(self.tx.values()), **self.values}
+            if self.fg_app is not None:
+                st["fg_app"] = self.fg_app
+            return st
+
+    def _diff_tx(self, t: NodeTable, hashes: list[int], rs: RuleSet,
+                 hits: list[tuple[int, int]]) -> dict | None:
+        new: dict[str, dict] = {}
+        seen: dict[int, int] = {}
+        parsed: dict[int, dict] = {}
+        if rs is not self._rs:
+            self._rs, self._parsed = rs, {}         # other app → other rule, parse again
+        rule = rs.by_name.get(TX_RULE)
+        for n, cont in hits:
+            h = hashes[cont]
+            row = parsed.get(h) or self._parsed.get(h)
+            if row is None:
+                row = rule.row(t, n, cont)              # only rows whose content changed
+            else:
+                row = dict(row, bounds=t.get(cont, "bounds") or "")   # moved rows keep their parse
+            parsed[h] = row
+            k = seen[h] = seen.get(h, -1) + 1      # identical rows stay distinct
+            key = f"{h & 0xFFFFFFFFFFFFFFFF:x}-{k}"
+            new[key] = dict(row, id=key)
+        self._parsed = parsed
+        old = self.tx
+        if new.keys() == old.keys():
+            return None
+        self.tx = new
+        order = list(new)
+        return {
+            "add": [dict(new[k], at=order.index(k)) for k in order if k not in old],
+            "remove": [k for k in old if k not in new],
+        }
+
+    def check(self) -> dict:
+        """Take one snapshot and emit (and return) what changed since the last one."""
+        snap = self._snap(self.serial, self.interval)
+        with self._lock:
+            if snap.seq == self._seq:
+                return {}
+            self._seq = snap.seq
+            t = snap.table
+            hashes = subtree_hashes(t)
+            root = tree_hash(t, hashes)
+            if root == self._root:
+                return {}
+            self._root = root
+
+            delta: dict = {}
+            # the foreground app can only change together with the hierarchy
+            app = self._app(self.serial)
+            fg = {"package": app.get("package", ""), "activity": app.get("activity", "")}
+            if fg != self.fg_app:
+                self.fg_app = delta["fg_app"] = fg
+            rs = self._rules(fg["package"])
+            hits = rs.scan(t)               # every active rule, one walk
+            tx = self._diff_tx(t, hashes, rs, hits.pop(TX_RULE, []))
+            if tx:
+                delta["tx"] = tx
+                if self._record and tx["add"]:
+                    fresh = self._record(self.serial, fg["package"], tx["add"])
+                    if fresh:
+                        delta["tx_new"] = fresh
+            for name, h in hits.items():
+                val = rs.value(t, name, h)
+                if val != self.values.get(name):
+                    self.values[name] = delta[name] = val
+        if delta:
+            self._emit(self.serial, delta)
+        return delta
+
+
+class WatcherHub:
+    """One ref-counted HierarchyWatcher per serial, running while it has clients."""
+
+    def __init__(self, factory: Callable[..., HierarchyWatcher]):
+        self._factory = factory      # (serial, emit) -> HierarchyWatcher
+        self._watchers: dict[str | None, HierarchyWatcher] = {}
+        self._refs: dict[str | None, int] = {}
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[str | None, dict], None]] = []
+
+    def subscribe(self, fn: Callable[[str | None, dict], None]):
+        """Call ``fn(serial, delta)`` whenever a watcher sees a change."""
+        self._listeners.append(fn)
+
+    def _publish(self, serial: str | None, delta: dict):
+        for fn in list(self._listeners):
+            try:
+                fn(serial, delta)
+            except Exception:
+                pass
+
+    def acquire(self, serial: str | None = None) -> dict:
+        """Register one client for *serial*; returns the watcher's current state."""
+        with self._lock:
+            w = self._watchers.get(serial)
+            if w is None:
+                w = self._watchers[serial] = self._factory(serial, self._publish)
+            self._refs[serial] = self._refs.get(serial, 0) + 1
+            w.start()
+        return w.state()
+
+    def release(self, serial: str | None = None):
+        with self._lock:
+            n = self._refs.get(serial, 0) - 1
+            if n > 0:
+                self._refs[serial] = n
+                return
+            self._refs.pop(serial, None)
+            w = self._watchers.get(serial)
+            if w:
+                w.stop()
+
+    def get(self, serial: str | None = None) -> HierarchyWatcher | None:
+        with self._lock:
+            return self._watchers.get(serial)